@@ -1,8 +1,10 @@
 from dotenv import load_dotenv
 from backtest.minervini import *
+from backtest.runner import *
 
 from datatools.getdata import *
 from datatools.storedata import *
+from datatools.responsecache import *
 import warnings
 
 # Mute the warning of database should use SQLAlechemy
@@ -11,6 +13,10 @@ warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy conne
 # For testing, we do the operation only on X amount of symbols before batching the rest
 CONST_STARTSKIP = -1
 CONST_CUTOFF = 1500
+CONST_COMMIT_ROWS = 100000  # Backtest rows are buffered and group committed once this many are pending
+CONST_WORKERS = os.cpu_count()  # Backtest processes, each with its own DB connection
+CONST_ORDER = 'sorted'  # Symbol order: sorted, given or shuffled [see backtest/runner.py], a full recompute streams in sorted order
+CONST_INCREMENTAL = True  # Only extend symbols with new bars, False recomputes every symbol's full history
 
 ###################### MAIN ######################
 if __name__ == "__main__":
@@ -28,34 +34,21 @@ if __name__ == "__main__":
     DB_MAIN_TABLE = str(os.getenv('DB_MAIN_TABLE'))
     DB_BACKTEST_TABLE = str(os.getenv('DB_MINERVINI_TABLE'))
 
-    # Load the available exhange:symbol
-    ori_cur, ori_conn = dbInitializeTable()
-    exchange_symbol = dbGetUniqueData(ori_cur, ori_conn, DB_MAIN_TABLE)
-
-    # New table that'll store our formatted backtest data
-    columns_handled = False
-    bt_cur, bt_conn = dbInitializeTable(DB_BACKTEST_TABLE)
-
-    # Get all csvs under each folder
-    for idx, (exchange, symbol) in enumerate(exchange_symbol):
-        if idx <= CONST_STARTSKIP:
-            continue
-        if idx > CONST_CUTOFF:
-            print(f"Reached cutoff amount {CONST_CUTOFF} symbols")
-            break
-        print(f"{idx}/{CONST_CUTOFF} Working on {exchange}:{symbol}")
-
-        df = dbGetDataWhere(ori_cur, ori_conn, DB_MAIN_TABLE, f"exchange = '{exchange}' AND symbol = '{symbol}'")
-        minervini_df = dfSetupMinervini(df.copy()).reset_index()
-        
-        # Create columns in backtest database
-        if not columns_handled:
-            backtest_columns = dfInferColumnDBTypes(minervini_df)
-            db_minervini_columns = dbGetColumns(bt_cur, bt_conn, DB_BACKTEST_TABLE)
-            new_columns = {k: v for k, v in backtest_columns.items() if k.lower() not in db_minervini_columns}
-            if len(new_columns) > 0:
-                dbSlotColumns(bt_cur, bt_conn, DB_BACKTEST_TABLE, new_columns)
-            columns_handled = True
-
-        if not minervini_df.empty:
-            dbSlotDataDynamic(minervini_df, bt_cur, bt_conn, DB_BACKTEST_TABLE)
+    if not CONST_INCREMENTAL:
+        # Full recompute: one streaming scan of the bars feeds the workers, no per-symbol queries
+        runnerBacktestStream(DB_MAIN_TABLE, DB_BACKTEST_TABLE, workers=CONST_WORKERS, skip=CONST_STARTSKIP + 1,
+                             limit=CONST_CUTOFF - CONST_STARTSKIP, commit_rows=CONST_COMMIT_ROWS)
+    else:
+        # Load the available exhange:symbol [index skip scan, not a DISTINCT over every bar]
+        ori_cur, ori_conn = dbInitializeTable()
+        exchange_symbol = dbGetUniquePairs(ori_cur, ori_conn, DB_MAIN_TABLE)
+        ori_cur.close()
+        dbRelease(ori_conn)
+
+        # Apply the testing window on a deterministic order, then fan the symbols out over the worker processes
+        exchange_symbol = runnerOrder(exchange_symbol, CONST_ORDER)[CONST_STARTSKIP + 1:CONST_CUTOFF + 1]
+        runnerBacktestIncremental(exchange_symbol, DB_MAIN_TABLE, DB_BACKTEST_TABLE, workers=CONST_WORKERS, order=CONST_ORDER,
+                                  commit_rows=CONST_COMMIT_ROWS)
+
+    # Served responses are stale from here on [see datatools/responsecache.py]
+    dataVersionBump()
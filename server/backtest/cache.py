@@ -0,0 +1,204 @@
+'''
+Persistent indicator cache
+- Computed indicator series are stored on disk as .npy, one entry per (exchange, symbol, indicator, params)
+- An entry remembers the bars it covers: their count and a hash of exactly those rows [its version]
+- Indicators only look back, so an entry stays valid as the first values of a longer history whose first rows are unchanged:
+  a run after new bars arrived only computes the new bars' values [from a few warmup bars or the last cached value]
+- Changed bars inside the covered range never match the hash, the entry is then recomputed and replaced
+- The whole cache is kept under a size bound by LRU eviction
+'''
+
+import numpy as np
+import pandas as pd
+import threading
+import hashlib
+import uuid
+import os
+
+from datatools.constant import *
+
+###################### SETUP ######################
+DIR_INDICATOR_CACHE = 'indicator_cache'  # Under DIR_DATA/DIR_SUB_DATA
+INDICATOR_CACHE_MAX_BYTES = 2 * 1024 ** 3
+INDICATOR_CACHE_VERSION_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+###################### CACHE ######################
+class IndicatorCache:
+    '''
+    Files live at <cache_dir>/<exchange>/<symbol>/<indicator>-<params>-<version>.npy
+    - A hit refreshes the file's mtime, eviction removes the least recently used files first
+    '''
+    def __init__(self, cache_dir=None, max_bytes=INDICATOR_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir or os.path.join(DIR_DATA, DIR_SUB_DATA, DIR_INDICATOR_CACHE)
+        self.max_bytes = max_bytes
+        self.size = None  # Bytes on disk, scanned on first write
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def paramsKey(self, params):
+        return hashlib.blake2b(repr(params).encode(), digest_size=6).hexdigest()
+
+    def path(self, exchange, symbol, indicator, params, version):
+        return os.path.join(self.cache_dir, str(exchange), str(symbol), f"{indicator}-{self.paramsKey(params)}-{version}.npy")
+
+    def get(self, exchange, symbol, indicator, params):
+        '''
+        (length, digest, values) of the stored entry, None if there's none
+        '''
+        prefix = f"{indicator}-{self.paramsKey(params)}-"
+        symbol_dir = os.path.join(self.cache_dir, str(exchange), str(symbol))
+        try:
+            names = [name for name in os.listdir(symbol_dir) if name.startswith(prefix) and name.endswith('.npy')]
+        except FileNotFoundError:
+            names = []
+
+        for name in names:
+            path = os.path.join(symbol_dir, name)
+            length, _, digest = name[len(prefix):-len('.npy')].partition('-')
+            try:
+                values = np.load(path, allow_pickle=False)
+                os.utime(path)
+            except (FileNotFoundError, ValueError, OSError):
+                continue
+            if length.isdigit() and len(values) == int(length):
+                self.hits += 1
+                return int(length), digest, values
+        self.misses += 1
+        return None
+
+    def put(self, exchange, symbol, indicator, params, version, values):
+        path = self.path(exchange, symbol, indicator, params, version)
+        symbol_dir = os.path.dirname(path)
+        os.makedirs(symbol_dir, exist_ok=True)
+
+        # Write then rename, so parallel backtest workers never read a half written file
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.asarray(values), allow_pickle=False)
+        written = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+
+        # The new entry replaces the indicator's older ones [fewer bars or changed bars]
+        freed = 0
+        prefix = f"{indicator}-{self.paramsKey(params)}-"
+        for name in os.listdir(symbol_dir):
+            if name.startswith(prefix) and name.endswith('.npy') and name != os.path.basename(path):
+                freed += self.remove(os.path.join(symbol_dir, name))
+
+        with self.lock:
+            if self.size is None:
+                self.size = self.scan()[1]
+            else:
+                self.size += written - freed
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
+
+    def scan(self):
+        '''
+        [(mtime, size, path), ...] of every cached file and their total size
+        '''
+        files, total = [], 0
+        for root, dirs, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.npy'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return files, total
+
+    def evict(self, target_ratio=0.9):
+        '''
+        Remove least recently used files until the cache is under target_ratio of max_bytes
+        '''
+        files, total = self.scan()
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes * target_ratio:
+                break
+            total -= self.remove(path)
+        with self.lock:
+            self.size = total
+
+    def clear(self):
+        files, total = self.scan()
+        for mtime, size, path in files:
+            self.remove(path)
+        with self.lock:
+            self.size = 0
+
+###################### INDICATOR FUNCTIONS ######################
+def dfDataVersion(df, columns=INDICATOR_CACHE_VERSION_COLUMNS):
+    '''
+    Short hash of the bars in df, any changed, added or removed bar gives a new version
+    '''
+    digest = hashlib.blake2b(digest_size=10)
+    digest.update(str(len(df)).encode())
+    for column in columns:
+        if column in df.columns:
+            values = df[column].to_numpy()
+            if values.dtype.kind == 'M':
+                values = values.astype('datetime64[ns]').view('int64')
+            elif values.dtype.kind == 'O':
+                values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype='float64')
+            digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+def dfPrefixVersion(df, length, versions=None):
+    '''
+    dfDataVersion of df's first length rows, memoized in versions [a dict per df] across indicators
+    '''
+    if versions is None:
+        return dfDataVersion(df.iloc[:length])
+    if length not in versions:
+        versions[length] = dfDataVersion(df.iloc[:length])
+    return versions[length]
+
+def dfCachedIndicator(df, cache, indicator, fn, *params, versions=None, warmup=0, extend=None):
+    '''
+    fn(df, *params) as a Series aligned with df, served from the cache as far as the same bars were seen before
+    - cache=None just computes it
+    - Only bars past the cached ones are computed: fn on them plus warmup bars before them [rolling windows],
+      or extend(df, start, previous, *params) carrying a recursive indicator on from its last cached value
+    - Pass versions [an empty dict] to share the bar hashes between several indicators of the same df
+    '''
+    if cache is None or df.empty or 'symbol' not in df.columns:
+        return fn(df, *params)
+
+    exchange = df['exchange'].iloc[0] if 'exchange' in df.columns else ''
+    symbol = df['symbol'].iloc[0]
+    n = len(df)
+
+    values = None
+    entry = cache.get(exchange, symbol, indicator, params)
+    if entry is not None:
+        length, digest, cached = entry
+        if 0 < length <= n and dfPrefixVersion(df, length, versions) == digest:
+            if length == n:
+                return pd.Series(cached, index=df.index)
+            if extend is not None and not np.isnan(cached[-1]):
+                tail = extend(df, length, cached[-1], *params)
+            elif extend is None:
+                tail = fn(df.iloc[max(0, length - warmup):], *params).iloc[length - n:]
+            else:
+                tail = None
+            if tail is not None:
+                values = np.concatenate([cached, np.asarray(tail, dtype='float64')])
+
+    if values is None:
+        values = fn(df, *params).to_numpy(dtype='float64')
+    cache.put(exchange, symbol, indicator, params, f"{n}-{dfPrefixVersion(df, n, versions)}", values)
+    return pd.Series(values, index=df.index)
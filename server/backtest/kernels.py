@@ -0,0 +1,150 @@
+'''
+NumPy kernels behind the df_* indicator functions
+- Inputs are 1-D [one symbol] or 2-D time x symbol arrays [a panel], time always runs along axis 0
+- Results go into preallocated buffers [out=...], no DataFrame is built along the way
+- true_range and the rolling counts reproduce pandas bit for bit, wilder and the cumulative sum rolling windows agree to float rounding
+'''
+
+import numpy as np
+
+###################### SHIFT / TRUE RANGE ######################
+def kernel_shift(values, periods=1, out=None):
+    '''
+    values shifted down by periods along time, NaN filled [Series.shift]
+    '''
+    values = np.asarray(values, dtype='float64')
+    if out is None:
+        out = np.empty_like(values)
+    out[:periods] = np.nan
+    out[periods:] = values[:len(values) - periods]
+    return out
+
+def kernel_true_range(high, low, close, out=None):
+    '''
+    max(|high - low|, |high - prev close|, |low - prev close|)
+    - np.fmax instead of np.maximum: like pandas' max(axis=1) it skips the NaN prev close of the first bar
+    '''
+    high = np.asarray(high, dtype='float64')
+    low = np.asarray(low, dtype='float64')
+    prev_close = kernel_shift(close)
+    buffer = np.empty_like(high)
+    if out is None:
+        out = np.empty_like(high)
+
+    np.subtract(high, low, out=out)
+    np.abs(out, out=out)
+    np.subtract(high, prev_close, out=buffer)
+    np.abs(buffer, out=buffer)
+    np.fmax(out, buffer, out=out)
+    np.subtract(low, prev_close, out=buffer)
+    np.abs(buffer, out=buffer)
+    np.fmax(out, buffer, out=out)
+    return out
+
+###################### ROLLING WINDOWS ######################
+def kernel_rolling_sum(values, window, out=None):
+    '''
+    Rolling sum with min_periods=window [any NaN in the window gives NaN], from one cumulative sum
+    '''
+    values = np.asarray(values, dtype='float64')
+    if out is None:
+        out = np.empty_like(values)
+    missing = np.isnan(values)
+
+    np.cumsum(np.where(missing, 0.0, values), axis=0, out=out)
+    out[window:] -= out[:-window].copy()
+
+    missing_count = np.cumsum(missing, axis=0)
+    missing_count[window:] -= missing_count[:-window].copy()
+    out[missing_count > 0] = np.nan
+    out[:window - 1] = np.nan
+    return out
+
+def kernel_rolling_mean(values, window, out=None):
+    out = kernel_rolling_sum(values, window, out=out)
+    out /= window
+    return out
+
+def kernel_rolling_count(flags, window, valid=None, out=None):
+    '''
+    Rolling count of True flags, exact [integer cumulative sum]
+    - valid marks real bars, a window reaching an invalid one is NaN like a too short series [panel padding]
+    '''
+    flags = np.asarray(flags, dtype=bool)
+    if out is None:
+        out = np.empty(flags.shape, dtype='float64')
+
+    counts = np.cumsum(flags, axis=0, dtype='int64')
+    counts[window:] -= counts[:-window].copy()
+    out[...] = counts
+    out[:window - 1] = np.nan
+    if valid is not None:
+        invalid = np.cumsum(~np.asarray(valid, dtype=bool), axis=0, dtype='int64')
+        invalid[window:] -= invalid[:-window].copy()
+        out[invalid > 0] = np.nan
+    return out
+
+###################### SMOOTHING ######################
+WILDER_MAX_EXPONENT = 300.  # Blocks stop before decay ** -row passes e^300, far inside the float range
+
+def kernel_wilder(values, n, out=None):
+    '''
+    Wilder smoothing [ewm(alpha=1/n, min_periods=n, adjust=False).mean()] without a loop per bar
+    - Within a block of rows y[k] = decay^(k+1) * y[-1] + alpha * sum(decay^(k-j) * x[j]), one cumulative sum per block
+      [a block spans ~4000 rows for n = 14, so a daily history is a single one]
+    - Leading NaN [panel padding, a series starting late] is skipped per column, columns with NaN after their first value
+      fall back to pandas' ewm: it reweights across gaps, which the closed form doesn't
+    - A 2-D input runs every symbol at once
+    '''
+    values = np.asarray(values, dtype='float64')
+    if out is None:
+        out = np.empty_like(values)
+    if len(values) == 0:
+        return out
+
+    # pandas turns alpha into a center of mass and back, keep its rounding
+    com = (1 - 1/n) / (1/n)
+    alpha = 1. / (1. + com)
+    decay = 1. - alpha
+
+    x = values if values.ndim == 2 else values[:, None]
+    y = out if out.ndim == 2 else out[:, None]
+    rows, columns = x.shape
+
+    valid = ~np.isnan(x)
+    counts = valid.sum(axis=0)
+    start = np.where(counts > 0, valid.argmax(axis=0), rows)
+    gaps = counts < rows - start
+    row = np.arange(rows)[:, None]
+
+    # Before its first value a column holds that value, so the recurrence starts on it
+    # [column major buffer: cumulative sums down a column then run over contiguous memory]
+    first = x[np.minimum(start, rows - 1), np.arange(columns)]
+    work = np.empty((rows, columns), order='F')
+    np.copyto(work, x)
+    np.copyto(work, np.broadcast_to(first, work.shape), where=row < start)
+
+    if decay > 0:
+        block_rows = int(max(1, min(rows, WILDER_MAX_EXPONENT / -np.log(decay))))
+        steps = np.arange(block_rows, dtype='float64')
+        grow = alpha * decay ** -steps
+        shrink = decay ** steps
+        carry = shrink * decay
+        previous = first
+        for top in range(0, rows, block_rows):
+            smoothed = work[top:top + block_rows]
+            k = len(smoothed)
+            smoothed *= grow[:k, None]
+            np.cumsum(smoothed, axis=0, out=smoothed)
+            smoothed *= shrink[:k, None]
+            smoothed += carry[:k, None] * previous
+            previous = smoothed[-1].copy()
+
+    # min_periods: a column without gaps has row - start + 1 observations
+    y[...] = work
+    y[row < start + n - 1] = np.nan
+    if gaps.any():
+        import pandas as pd
+        gap_columns = np.flatnonzero(gaps)
+        y[:, gap_columns] = pd.DataFrame(x[:, gap_columns]).ewm(alpha=1/n, min_periods=n, adjust=False).mean().to_numpy()
+    return out
@@ -5,6 +5,7 @@ General csv database based on Minervini's strategy
 import pandas as pd
 import os
 from backtest.trading import *
+from backtest.cache import *
 
 ###################### SETUP ######################
 # General trade setup
@@ -23,14 +24,15 @@ WEEKTR_VOLUME_UP_LT_DOWN_PERIODS = 5  # In weeks (before conversion back to days
 TR_VMA = 50
 
 ###################### PANDAS RELATED FUNCTION ######################
-def dfSetupMinervini(df):
-    # Calculate default variables that we'll typically use 
-    df['ATR'] = df_atr(df, n=TR_ATR_N)
-    df['returns'] = df_return(df)
-    df[f'VMA_{TR_VMA}'] = df_vma(df, TR_VMA)
-    df['SMA_50'] = df_sma(df, 50)
-    df['SMA_150'] = df_sma(df, 150)
-    df['SMA_200'] = df_sma(df, 200)
+def dfSetupMinervini(df, cache=None):
+    # Calculate default variables that we'll typically use [from the indicator cache when one is given]
+    versions = {}
+    df['ATR'] = dfCachedIndicator(df, cache, 'ATR', df_atr, TR_ATR_N, versions=versions, extend=df_atr_continue)
+    df['returns'] = dfCachedIndicator(df, cache, 'returns', df_return, versions=versions, warmup=1)
+    df[f'VMA_{TR_VMA}'] = dfCachedIndicator(df, cache, 'VMA', df_vma, TR_VMA, versions=versions, warmup=TR_VMA - 1)
+    df['SMA_50'] = dfCachedIndicator(df, cache, 'SMA', df_sma, 50, versions=versions, warmup=49)
+    df['SMA_150'] = dfCachedIndicator(df, cache, 'SMA', df_sma, 150, versions=versions, warmup=149)
+    df['SMA_200'] = dfCachedIndicator(df, cache, 'SMA', df_sma, 200, versions=versions, warmup=199)
     df.dropna(inplace = True)
 
     # Calculate Minervini Criterias
@@ -42,6 +44,37 @@ def dfSetupMinervini(df):
     
     return df
 
+def dfContinueMinervini(minervini_df, tail_df, last_rows):
+    '''
+    Rows of a tail run [dfSetupMinervini on the last bars of each symbol] that extend the stored backtest
+    - last_rows = [(exchange, symbol, last_timestamp, last_atr, last_index), ...] of the stored rows
+    - ATR is an EMA over the whole history, so it carries on from last_atr instead of the tail's fresh start
+    - index carries on from last_index, counting every bar like a full run does
+    '''
+    tail_groups = dict(tuple(tail_df.groupby('symbol', sort=False)))
+    minervini_groups = dict(tuple(minervini_df.groupby('symbol', sort=False))) if not minervini_df.empty else {}
+
+    appended_dfs = []
+    for exchange, symbol, last_timestamp, last_atr, last_index in last_rows:
+        if symbol not in tail_groups or symbol not in minervini_groups:
+            continue
+        tail = tail_groups[symbol].reset_index(drop=True)
+        appended = minervini_groups[symbol]
+        appended = appended[appended['timestamp'] > last_timestamp].copy()
+        if appended.empty:
+            continue
+
+        # Tail position of the last stored bar, everything after it continues the stored values
+        stored = int((tail['timestamp'] <= last_timestamp).sum())
+        atr = df_wwma_continue(df_true_range(tail).iloc[stored:], TR_ATR_N, last_atr)
+        appended['ATR'] = atr.loc[appended['index']].to_numpy()
+        appended['index'] = last_index + appended['index'] - (stored - 1)
+        appended_dfs.append(appended)
+
+    if not appended_dfs:
+        return minervini_df.iloc[0:0]
+    return pd.concat(appended_dfs, ignore_index=True)
+
 ###################### MINERVINI TRANSITION LONG ######################
 def dfMinerviniTransitionLongCriteria_1(df):
     '''
@@ -68,8 +101,8 @@ def dfMinerviniTransitionLongCriteria_2(df, hhhl_amounts=TR_HIGHERHIGH_LOWERLOW_
     # Criteria 4: A series of higher highs and higher lows has occurred
     higherhighs = df['high'] > df['high'].shift()
     higherlows = df['low'] > df['low'].shift()
-    seriesofhigherhighs = higherhighs.rolling(window=hhhl_periods).sum() >= hhhl_amounts
-    seriesofhigherlows = higherlows.rolling(window=hhhl_periods).sum() >= hhhl_amounts
+    seriesofhigherhighs = df_rolling_count(higherhighs, hhhl_periods) >= hhhl_amounts
+    seriesofhigherlows = df_rolling_count(higherlows, hhhl_periods) >= hhhl_amounts
     
     criteria4 = seriesofhigherhighs & seriesofhigherlows
 
@@ -84,17 +117,17 @@ def dfMinerviniTransitionLongCriteria_3(df, volume_spike=TR_VOLUMESPIKE_RATIO, s
 
     # Criteria 5: Large up weeks on volume spikes are contrasted by low-volume pullbacks
     volume_spike = df['volume'] > (volume_spike * df[f'VMA_{TR_VMA}'])
-    seriesofvolumespikes = volume_spike.rolling(window=spike_periods).sum() >= spike_amounts
+    seriesofvolumespikes = df_rolling_count(volume_spike, spike_periods) >= spike_amounts
     df['volumespike'] = volume_spike
     df['long_vspike'] = seriesofvolumespikes
 
     # Criteria 6: There are more up weeks on volume than down weeks on volume
-    df['pastweek_volume'] = df['volume'].rolling(window=7).sum()
+    df['pastweek_volume'] = df_rolling_sum(df['volume'], 7)
     df['pastweek_return'] = df['pastweek_volume'].pct_change()
     df['pastweek_volume_up'] = df['pastweek_return'] > 0
     df['pastweek_volume_down'] = df['pastweek_return'] < 0
-    df['period_up_week'] = df['pastweek_volume_up'].rolling(window=weeklyvolume_up_lt_down_periods).sum()
-    df['period_down_week'] = df['pastweek_volume_down'].rolling(window=weeklyvolume_up_lt_down_periods).sum()
+    df['period_up_week'] = df_rolling_count(df['pastweek_volume_up'], weeklyvolume_up_lt_down_periods)
+    df['period_down_week'] = df_rolling_count(df['pastweek_volume_down'], weeklyvolume_up_lt_down_periods)
     df['long_week_vup_lt_vdn'] = df['period_up_week'] > df['period_down_week']
 
     return df
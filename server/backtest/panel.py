@@ -0,0 +1,276 @@
+'''
+Cross-sectional panel engine
+- The universe is loaded into right-aligned time x symbol arrays: column s holds symbol s's rows in order, its last row at the bottom
+- Shorter symbols are padded above with NaN [False for flags], so a rolling window never reaches into another symbol
+- Every indicator and criterion runs once over the whole panel with the same kernels as the per-symbol functions
+  [pandas or numpy, TRADING_ENGINE], so dfSetupMinerviniPanel matches dfSetupMinervini symbol by symbol
+'''
+
+import pandas as pd
+import numpy as np
+
+from backtest.trading import *
+from backtest.minervini import *
+
+###################### SETUP ######################
+PANEL_KEY = ['exchange', 'symbol']
+PANEL_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+# Columns dfSetupMinervini adds, in the order it adds them
+PANEL_INDICATORS = ['ATR', 'returns', f'VMA_{TR_VMA}', 'SMA_50', 'SMA_150', 'SMA_200']
+PANEL_CRITERIA = ['long_sma', 'long_hhhl', 'volumespike', 'long_vspike', 'pastweek_volume', 'pastweek_return',
+                  'pastweek_volume_up', 'pastweek_volume_down', 'period_up_week', 'period_down_week', 'long_week_vup_lt_vdn']
+
+###################### PANEL ######################
+class Panel:
+    '''
+    keys[s] is the (exchange, symbol) of column s
+    - rows: row of each cell in the source long df, -1 for padding
+    - position: row number of each cell within its symbol in the source df [the per-symbol index]
+    - fields: name -> 2-D array, float [NaN padding] or bool [False padding]
+    '''
+    def __init__(self, keys, rows, position, fields):
+        self.keys = keys
+        self.rows = rows
+        self.position = position
+        self.fields = fields
+
+    @property
+    def valid(self):
+        return self.rows >= 0
+
+    def frame(self, name):
+        # pandas view of a field, rolling / ewm then run column by column like they would per symbol
+        return pd.DataFrame(self.fields[name])
+
+def panelFromFrame(df, fields=PANEL_FIELDS):
+    '''
+    Long df [one row per symbol and bar, rows of a symbol in time order] -> Panel
+    - Keys come out sorted, rows keep their order within a symbol
+    '''
+    key_columns = [column for column in PANEL_KEY if column in df.columns]
+    grouper = df.groupby(key_columns, sort=True)
+    codes = grouper.ngroup().to_numpy()
+    position = grouper.cumcount().to_numpy()
+    keys = grouper.size().index.tolist()
+
+    # Rows without a key [ngroup -1] belong to no symbol
+    source = np.flatnonzero(codes >= 0)
+    codes, position = codes[source], position[source]
+    counts = np.bincount(codes, minlength=len(keys))
+
+    length = int(counts.max()) if len(counts) else 0
+    panel_row = length - counts[codes] + position
+
+    rows = np.full((length, len(keys)), -1, dtype='int64')
+    rows[panel_row, codes] = source
+    positions = np.full((length, len(keys)), -1, dtype='int64')
+    positions[panel_row, codes] = position
+
+    panel_fields = {}
+    for field in fields:
+        values = np.full((length, len(keys)), np.nan)
+        values[panel_row, codes] = df[field].to_numpy(dtype='float64')[source]
+        panel_fields[field] = values
+
+    # dropna in dfSetupMinervini looks at every column of the row, not only the price fields
+    complete = np.zeros((length, len(keys)), dtype=bool)
+    complete[panel_row, codes] = df.notna().all(axis=1).to_numpy()[source]
+    panel_fields['complete'] = complete
+
+    return Panel(keys, rows, positions, panel_fields)
+
+def panelRepack(panel, keep):
+    '''
+    Keep only the cells in keep and right-align every column again [the panel version of dropna]
+    - Later shifts and rolling windows then skip the dropped rows, exactly like they do per symbol
+    '''
+    keep = keep & panel.valid
+    counts = keep.sum(axis=0)
+    length = int(counts.max()) if counts.size else 0
+    rank = np.cumsum(keep, axis=0) - 1
+    r, c = np.nonzero(keep)
+    new_r = length - counts[c] + rank[r, c]
+
+    def move(values, fill):
+        moved = np.full((length, values.shape[1]), fill, dtype=values.dtype)
+        moved[new_r, c] = values[r, c]
+        return moved
+
+    fields = {name: move(values, False if values.dtype == bool else np.nan) for name, values in panel.fields.items()}
+    return Panel(panel.keys, move(panel.rows, -1), move(panel.position, -1), fields)
+
+###################### MINERVINI ######################
+def panelIndicators(panel, df=None, cache=None):
+    '''
+    ATR, returns, VMA and SMAs for every symbol at once, same formulas as backtest/trading.py
+    - Given the source df and an IndicatorCache, only the bars past each symbol's cached ones are computed [panelCachedIndicator]
+    '''
+    frames = {field: panel.frame(field) for field in PANEL_FIELDS}
+    high, low, close = frames['high'], frames['low'], frames['close']
+
+    # df_atr takes the row max of its three true range candidates, np.fmax is that max without a concat
+    tr0 = abs(high - low)
+    tr1 = abs(high - close.shift())
+    tr2 = abs(low - close.shift())
+    tr = np.fmax(np.fmax(tr0, tr1), tr2)
+    tr_values = tr.to_numpy()
+
+    def tail(top):
+        # The newest bars of every symbol [right-aligned], from panel row top on
+        return {field: frame.iloc[top:] for field, frame in frames.items()}
+
+    # name -> (cache indicator, params, compute(top) = values of rows top.., warmup rows, extend(column, start, previous))
+    indicators = {
+        'ATR': ('ATR', (TR_ATR_N,), lambda top: df_wwma(tr, TR_ATR_N).to_numpy()[top:], 0,
+                lambda column, start, previous: df_wwma_continue(tr_values[start:, column], TR_ATR_N, previous).to_numpy()),
+        'returns': ('returns', (), lambda top: df_return(tail(top)).to_numpy(), 1, None),
+        f'VMA_{TR_VMA}': ('VMA', (TR_VMA,), lambda top: df_vma(tail(top), TR_VMA).to_numpy(), TR_VMA - 1, None),
+        'SMA_50': ('SMA', (50,), lambda top: df_sma(tail(top), 50).to_numpy(), 49, None),
+        'SMA_150': ('SMA', (150,), lambda top: df_sma(tail(top), 150).to_numpy(), 149, None),
+        'SMA_200': ('SMA', (200,), lambda top: df_sma(tail(top), 200).to_numpy(), 199, None),
+    }
+
+    symbols = panelCacheSymbols(panel, df) if cache is not None and df is not None else None
+    for name, (indicator, params, compute, warmup, extend) in indicators.items():
+        if symbols is None:
+            panel.fields[name] = compute(0)
+        else:
+            panel.fields[name] = panelCachedIndicator(panel, symbols, cache, indicator, params, compute, warmup, extend)
+    return panel
+
+def panelCacheSymbols(panel, df):
+    '''
+    Per column: (exchange, symbol, its bars as a df, bar hash memo) for the indicator cache
+    '''
+    length = panel.rows.shape[0]
+    counts = panel.valid.sum(axis=0)
+    symbols = []
+    for column, key in enumerate(panel.keys):
+        exchange, symbol = key if isinstance(key, tuple) else ('', key)
+        symbols.append((exchange, symbol, df.iloc[panel.rows[length - counts[column]:, column]], {}))
+    return symbols
+
+def panelCachedIndicator(panel, symbols, cache, indicator, params, compute, warmup=0, extend=None):
+    '''
+    One indicator of the raw panel, reusing each symbol's cached values [same entries as dfCachedIndicator]
+    - The uncached bars are the newest ones, at the bottom of every column: windowed indicators are computed
+      on the bottom rows only [plus warmup rows], recursive ones are carried on column by column with extend
+    - Symbols without a usable entry make it a full computation, every symbol's entry is then brought up to date
+    '''
+    length, width = panel.rows.shape
+    counts = panel.valid.sum(axis=0)
+    values = np.full((length, width), np.nan)
+    cached = np.zeros(width, dtype='int64')
+
+    for column, (exchange, symbol, symbol_df, versions) in enumerate(symbols):
+        entry = cache.get(exchange, symbol, indicator, params)
+        if entry is None:
+            continue
+        entry_length, digest, entry_values = entry
+        if 0 < entry_length <= counts[column] and dfPrefixVersion(symbol_df, entry_length, versions) == digest:
+            top = length - counts[column]
+            values[top:top + entry_length, column] = entry_values
+            cached[column] = entry_length
+
+    missing = counts - cached
+    if not missing.any():
+        return values
+
+    stale = np.flatnonzero(missing)
+    seeded = all(cached[column] > 0 and not np.isnan(values[length - missing[column] - 1, column]) for column in stale)
+    if extend is not None and seeded:
+        for column in stale:
+            start = length - missing[column]
+            values[start:, column] = extend(column, start, values[start - 1, column])
+    else:
+        top = 0 if extend is not None else max(0, length - int(missing.max()) - warmup)
+        computed = compute(top)
+        for column in stale:
+            start = length - missing[column]
+            values[start:, column] = computed[start - top:, column]
+
+    for column in stale:
+        exchange, symbol, symbol_df, versions = symbols[column]
+        version = f"{counts[column]}-{dfPrefixVersion(symbol_df, counts[column], versions)}"
+        cache.put(exchange, symbol, indicator, params, version, values[length - counts[column]:, column])
+    return values
+
+def panelCriteria(panel, hhhl_amounts=TR_HIGHERHIGH_LOWERLOW_AMOUNTS, hhhl_periods=TR_HIGHERHIGH_LOWERLOW_PERIODS,
+                  volume_spike=TR_VOLUMESPIKE_RATIO, spike_amounts=TR_VOLUMESPIKE_AMOUNTS, spike_periods=TR_VOLUMESPIKE_PERIODS,
+                  weeklyvolume_up_lt_down_periods=WEEKTR_VOLUME_UP_LT_DOWN_PERIODS):
+    '''
+    Minervini criteria 1 - 6 on a repacked panel, see the dfMinerviniTransitionLongCriteria_* functions
+    '''
+    frames = {name: panel.frame(name) for name in ['high', 'low', 'close', 'volume', 'SMA_150', 'SMA_200', f'VMA_{TR_VMA}']}
+    valid = panel.valid
+    criteria = {}
+
+    # Criteria 1 - 3: plain comparisons, padding ends up False
+    criteria['long_sma'] = dfMinerviniTransitionLongCriteria_1(frames).to_numpy() & valid
+
+    # Criteria 4: counts of higher highs / lows, windows over the padding stay NaN
+    higherhighs = frames['high'] > frames['high'].shift()
+    higherlows = frames['low'] > frames['low'].shift()
+    seriesofhigherhighs = df_rolling_count(higherhighs, hhhl_periods, valid) >= hhhl_amounts
+    seriesofhigherlows = df_rolling_count(higherlows, hhhl_periods, valid) >= hhhl_amounts
+    criteria['long_hhhl'] = (seriesofhigherhighs & seriesofhigherlows).to_numpy()
+
+    # Criteria 5: volume spikes
+    volumespike = frames['volume'] > (volume_spike * frames[f'VMA_{TR_VMA}'])
+    criteria['volumespike'] = volumespike.to_numpy() & valid
+    criteria['long_vspike'] = (df_rolling_count(volumespike, spike_periods, valid) >= spike_amounts).to_numpy()
+
+    # Criteria 6: more up weeks on volume than down weeks
+    pastweek_volume = df_rolling_sum(frames['volume'], 7)
+    pastweek_return = pastweek_volume.pct_change()
+    pastweek_volume_up = pastweek_return > 0
+    pastweek_volume_down = pastweek_return < 0
+    period_up_week = df_rolling_count(pastweek_volume_up, weeklyvolume_up_lt_down_periods, valid)
+    period_down_week = df_rolling_count(pastweek_volume_down, weeklyvolume_up_lt_down_periods, valid)
+    criteria['pastweek_volume'] = pastweek_volume.to_numpy()
+    criteria['pastweek_return'] = pastweek_return.to_numpy()
+    criteria['pastweek_volume_up'] = pastweek_volume_up.to_numpy() & valid
+    criteria['pastweek_volume_down'] = pastweek_volume_down.to_numpy() & valid
+    criteria['period_up_week'] = period_up_week.to_numpy()
+    criteria['period_down_week'] = period_down_week.to_numpy()
+    criteria['long_week_vup_lt_vdn'] = (period_up_week > period_down_week).to_numpy()
+
+    panel.fields.update(criteria)
+    return panel
+
+def panelSetupMinervini(panel, df=None, cache=None):
+    '''
+    Panel version of dfSetupMinervini: indicators [cached given df and cache], dropna, criteria
+    '''
+    panel = panelIndicators(panel, df, cache)
+    keep = panel.fields['complete'].copy()
+    for name in PANEL_INDICATORS:
+        keep &= ~np.isnan(panel.fields[name])
+    panel = panelRepack(panel, keep)
+    return panelCriteria(panel)
+
+def panelToFrame(panel, df, columns=PANEL_INDICATORS + PANEL_CRITERIA, index=True):
+    '''
+    Back to a long df: the source rows still in the panel, symbol by symbol, with the computed columns appended
+    - index=True adds the per-symbol row number as 'index', like dfSetupMinervini(...).reset_index()
+    '''
+    c, r = np.nonzero(panel.valid.T)  # Symbol major, time ascending
+    out = df.iloc[panel.rows[r, c]].reset_index(drop=True)
+    for name in columns:
+        out[name] = panel.fields[name][r, c]
+    if index:
+        out.insert(0, 'index', panel.position[r, c])
+    return out
+
+def dfSetupMinerviniPanel(df, index=True, cache=None):
+    '''
+    dfSetupMinervini for a whole universe in one pass
+    - Same result as running dfSetupMinervini(symbol_df.reset_index(drop=True)) on every symbol and concatenating them in key order
+    - cache: IndicatorCache shared with the per-symbol path
+    '''
+    if df.empty:
+        return df
+    df = df.reset_index(drop=True)
+    panel = panelSetupMinervini(panelFromFrame(df), df, cache)
+    return panelToFrame(panel, df, index=index)
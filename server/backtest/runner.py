@@ -0,0 +1,459 @@
+'''
+Parallel backtest runner
+- The (exchange, symbol) list is cut into chunks that a process pool works through, one core per worker
+- Every worker has its own DB connection, loads a chunk in one query and group commits its results
+- Rows are written with a packed signal_mask, and every chunk refreshes its symbols in the latest screen table
+'''
+
+import multiprocessing
+import collections
+import random
+import time
+
+from backtest.minervini import *
+from backtest.panel import *
+from datatools.getdata import *
+from datatools.storedata import *
+
+###################### SETUP ######################
+RUNNER_CHUNK_SYMBOLS = 200  # Symbols loaded per query and handed out per task [one panel in panel mode]
+RUNNER_COMMIT_ROWS = 100000  # Rows a worker buffers before one COPY into the backtest table [at least once per chunk]
+RUNNER_ORDERS = ['sorted', 'given', 'shuffled']
+RUNNER_WARMUP_ROWS = 260  # Bars loaded up to a symbol's last backtested bar: 199 dropped by SMA_200 plus the criteria lookbacks
+RUNNER_MODES = ['panel', 'symbol']  # panel: one vectorized pass per chunk, symbol: dfSetupMinervini per symbol
+RUNNER_STREAM_INFLIGHT = 2  # Streamed chunks loaded ahead per worker [runnerBacktestStream]
+RUNNER_INDICATOR_CACHE = True  # Full runs [panel and symbol mode] and sweeps read / fill the on-disk indicator cache [backtest/cache.py]
+
+# Per-process state, set up by runnerWorkerInit
+_worker = {}
+
+###################### PLANNING FUNCTIONS ######################
+def runnerOrder(exchange_symbol, order='sorted', seed=0):
+    '''
+    Deterministic processing order of the (exchange, symbol) list
+    - sorted: by exchange then symbol, given: as listed, shuffled: seeded shuffle [spreads big exchanges across workers]
+    '''
+    if order not in RUNNER_ORDERS:
+        raise ValueError(f"Unknown order {order}, expected one of {RUNNER_ORDERS}")
+
+    exchange_symbol = [tuple(pair) for pair in exchange_symbol]
+    if order == 'sorted':
+        exchange_symbol.sort()
+    elif order == 'shuffled':
+        random.Random(seed).shuffle(exchange_symbol)
+    return exchange_symbol
+
+def runnerChunks(exchange_symbol, chunk_symbols=RUNNER_CHUNK_SYMBOLS):
+    '''
+    Chunks of one exchange each [exchanges in order of first appearance], so a chunk loads with a single exchange = ... AND symbol = ANY(...) query
+    - Items are (exchange, symbol, ...) tuples, anything after the symbol rides along
+    '''
+    by_exchange = {}
+    for item in exchange_symbol:
+        by_exchange.setdefault(item[0], []).append(item)
+
+    chunks = []
+    for items in by_exchange.values():
+        chunks += [items[i:i + chunk_symbols] for i in range(0, len(items), chunk_symbols)]
+    return chunks
+
+###################### WORKER FUNCTIONS ######################
+def runnerWorkerInit(main_table, backtest_table, commit_rows, mode='panel', screen_table=DB_SCREEN_TABLE):
+    import warnings
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy connectable")
+
+    cur, conn = dbConnect()
+    cache = IndicatorCache() if RUNNER_INDICATOR_CACHE else None
+    _worker.update(cur=cur, conn=conn, main_table=main_table, backtest_table=backtest_table, commit_rows=commit_rows, mode=mode, cache=cache,
+                   screen_table=screen_table)
+
+def runnerBacktestChunk(chunk):
+    '''
+    Minervini setup for every symbol of a chunk
+    - Results are written once commit_rows are pending and whatever is left when the chunk is done
+    - Returns (symbols, rows read, rows written) for the progress report
+    '''
+    cur, conn = _worker['cur'], _worker['conn']
+    exchange = chunk[0][0]
+    symbols = [symbol for _, symbol in chunk]
+
+    df = dbGetDataWhere(cur, conn, _worker['main_table'], "exchange = %s AND symbol = ANY(%s) ORDER BY symbol, timestamp",
+                        params=(exchange, symbols))
+    conn.rollback()  # Don't keep the read transaction open while computing
+    return runnerBacktestFrame((chunk, df))
+
+def runnerBacktestFrame(task):
+    '''
+    runnerBacktestChunk on bars that are already loaded, task = (chunk, df) [from runnerStreamChunks]
+    '''
+    chunk, df = task
+    cur, conn = _worker['cur'], _worker['conn']
+
+    if _worker['mode'] == 'panel':
+        minervini_df = dfSetupMinerviniPanel(df, cache=_worker['cache'])
+        runnerWrite(minervini_df)
+        dbRefreshScreen(cur, conn, _worker['backtest_table'], _worker['screen_table'], chunk)
+        return len(chunk), len(df), len(minervini_df)
+
+    rows_out, pending_dfs, pending_rows = 0, [], 0
+    for symbol, symbol_df in df.groupby('symbol', sort=True):
+        minervini_df = dfSetupMinervini(symbol_df.reset_index(drop=True), cache=_worker['cache']).reset_index()
+        if minervini_df.empty:
+            continue
+        minervini_df['signal_mask'] = df_signal_mask(minervini_df)
+        pending_dfs.append(minervini_df)
+        pending_rows += len(minervini_df)
+        rows_out += len(minervini_df)
+        if pending_rows >= _worker['commit_rows']:
+            dbSlotDataCopyGroup(pending_dfs, cur, conn, _worker['backtest_table'])
+            pending_dfs, pending_rows = [], 0
+    dbSlotDataCopyGroup(pending_dfs, cur, conn, _worker['backtest_table'])
+    dbRefreshScreen(cur, conn, _worker['backtest_table'], _worker['screen_table'], chunk)
+
+    return len(chunk), len(df), rows_out
+
+def runnerBacktestTailChunk(chunk):
+    '''
+    Incremental version of runnerBacktestChunk, chunk = [(exchange, symbol, last_timestamp, last_atr, last_index), ...]
+    - Only RUNNER_WARMUP_ROWS bars up to the last backtested one are loaded, plus everything after it
+    - Only the bars after last_timestamp are written, ATR and index carry on from the stored values
+    - No indicator cache: the loaded bars don't start at a symbol's first bar, so they never match its cached history
+    '''
+    cur, conn = _worker['cur'], _worker['conn']
+    df = dbGetBacktestTail(cur, conn, _worker['main_table'], chunk)
+    conn.rollback()
+
+    if _worker['mode'] == 'panel':
+        minervini_df = dfSetupMinerviniPanel(df)
+    else:
+        minervini_dfs = [dfSetupMinervini(symbol_df.reset_index(drop=True)).reset_index()
+                         for symbol, symbol_df in df.groupby('symbol', sort=True)]
+        minervini_df = pd.concat(minervini_dfs, ignore_index=True) if minervini_dfs else df
+
+    appended_df = dfContinueMinervini(minervini_df, df, chunk)
+    runnerWrite(appended_df)
+    dbRefreshScreen(cur, conn, _worker['backtest_table'], _worker['screen_table'], chunk)
+    return len(chunk), len(df), len(appended_df)
+
+def runnerWrite(minervini_df):
+    if not minervini_df.empty:
+        minervini_df['signal_mask'] = df_signal_mask(minervini_df)
+    for idx in range(0, len(minervini_df), _worker['commit_rows']):
+        dbSlotDataCopy(minervini_df.iloc[idx:idx + _worker['commit_rows']], _worker['cur'], _worker['conn'], _worker['backtest_table'])
+
+###################### DB FUNCTIONS ######################
+def dbGetBacktestPending(cur, main_table, backtest_table, exchange_symbol):
+    '''
+    Symbols with bars newer than their last backtested bar, as [(exchange, symbol, last_timestamp, last_atr, last_index), ...]
+    - Never backtested symbols come back with None for the last_* fields
+    - Two index lookups per symbol, no scan of either table
+    '''
+    if not exchange_symbol:
+        return []
+    exchanges, symbols = zip(*exchange_symbol)
+    cur.execute(f"""
+        SELECT u.exchange, u.symbol, b.timestamp, b.atr, b."index"
+        FROM unnest(%s::text[], %s::text[]) AS u(exchange, symbol)
+        LEFT JOIN LATERAL (
+            SELECT timestamp, atr, "index" FROM {backtest_table}
+            WHERE exchange = u.exchange AND symbol = u.symbol
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ) b ON TRUE
+        WHERE b.timestamp IS NULL OR EXISTS (
+            SELECT FROM {main_table} m
+            WHERE m.exchange = u.exchange AND m.symbol = u.symbol AND m.timestamp > b.timestamp
+        )
+    """, (list(exchanges), list(symbols)))
+
+    pending = []
+    for exchange, symbol, last_timestamp, last_atr, last_index in cur.fetchall():
+        if last_timestamp is None:
+            pending.append((exchange, symbol, None, None, None))
+        else:
+            pending.append((exchange, symbol, last_timestamp, float(last_atr), int(last_index)))
+    return pending
+
+def dbGetBacktestTail(cur, conn, main_table, chunk, warmup=RUNNER_WARMUP_ROWS):
+    '''
+    Bars of a one-exchange chunk from warmup bars before each symbol's last_timestamp onward
+    '''
+    exchange = chunk[0][0]
+    symbols = [item[1] for item in chunk]
+    last_timestamps = [item[2] for item in chunk]
+    sql_query = f"""
+        SELECT m.* FROM unnest(%s::text[], %s::timestamp[]) AS u(symbol, last_timestamp)
+        CROSS JOIN LATERAL (
+            SELECT COALESCE((
+                SELECT timestamp FROM {main_table}
+                WHERE exchange = %s AND symbol = u.symbol AND timestamp <= u.last_timestamp
+                ORDER BY timestamp DESC
+                OFFSET %s LIMIT 1
+            ), '-infinity'::timestamp) AS first_timestamp
+        ) s
+        JOIN {main_table} m ON m.exchange = %s AND m.symbol = u.symbol AND m.timestamp >= s.first_timestamp
+        ORDER BY m.symbol, m.timestamp
+    """
+    return pd.read_sql_query(sql_query, conn, params=(symbols, last_timestamps, exchange, warmup - 1, exchange))
+
+def dbInitializeScreen(cur, conn, backtest_table, screen_table=DB_SCREEN_TABLE):
+    '''
+    signal_mask column with its partial index on the backtest table, the chart's (symbol, timestamp) index, and the latest screen table
+    - Rows written before signal_mask existed are backfilled from their criteria once
+    - A new screen table is filled from the whole backtest table once, chunks keep it current after that
+    '''
+    backtest_columns = dbGetColumns(cur, conn, backtest_table)
+    if 'signal_mask' not in backtest_columns and all(column in backtest_columns for column in TRADING_LONG_CRITERIA):
+        mask_sql = " | ".join(f"(CASE WHEN {column} THEN {1 << bit} ELSE 0 END)" for bit, column in enumerate(TRADING_LONG_CRITERIA))
+        cur.execute(f"ALTER TABLE {backtest_table} ADD COLUMN signal_mask SMALLINT")
+        cur.execute(f"UPDATE {backtest_table} SET signal_mask = ({mask_sql})::smallint")
+        print(f"Added column signal_mask SMALLINT to {backtest_table}, backfilled {cur.rowcount} rows")
+    elif 'signal_mask' not in backtest_columns:
+        cur.execute(f"ALTER TABLE {backtest_table} ADD COLUMN signal_mask SMALLINT")
+
+    # Chart ranges and keyset pages of a symbol [/stocks/<symbol>] are one range scan of this index
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {backtest_table}_symbol_timestamp ON {backtest_table} (symbol, timestamp)")
+
+    # Only rows meeting every criterion are indexed, a tiny fraction of the history
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS {backtest_table}_signal_all ON {backtest_table} (symbol, timestamp)
+        WHERE signal_mask = {TRADING_SIGNAL_ALL}
+    """)
+
+    cur.execute("SELECT to_regclass(%s)", (screen_table,))
+    if cur.fetchone()[0] is None:
+        cur.execute(f"""
+            CREATE TABLE {screen_table} (
+                exchange TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                signal_mask SMALLINT,
+                first_signal TIMESTAMP,
+                last_signal TIMESTAMP,
+                PRIMARY KEY (exchange, symbol)
+            )
+        """)
+        cur.execute(f"CREATE INDEX {screen_table}_last_signal ON {screen_table} (last_signal) WHERE last_signal IS NOT NULL")
+        cur.execute(f"""
+            INSERT INTO {screen_table} (exchange, symbol, timestamp, signal_mask, first_signal, last_signal)
+            SELECT l.exchange, l.symbol, l.timestamp, l.signal_mask, s.first_signal, s.last_signal
+            FROM (
+                SELECT DISTINCT ON (exchange, symbol) exchange, symbol, timestamp, signal_mask
+                FROM {backtest_table}
+                ORDER BY exchange, symbol, timestamp DESC
+            ) l
+            LEFT JOIN (
+                SELECT exchange, symbol, MIN(timestamp) AS first_signal, MAX(timestamp) AS last_signal
+                FROM {backtest_table}
+                WHERE signal_mask = {TRADING_SIGNAL_ALL}
+                GROUP BY exchange, symbol
+            ) s USING (exchange, symbol)
+        """)
+        print(f"Created {screen_table} with {cur.rowcount} symbols")
+    dbCommit(conn)
+
+def dbRefreshScreen(cur, conn, backtest_table, screen_table, chunk):
+    '''
+    Latest row and signal range of a chunk's symbols into the screen table, one upsert
+    - Both lookups per symbol are index scans: the primary key for the latest row, the partial index for the signals
+    '''
+    exchanges = [item[0] for item in chunk]
+    symbols = [item[1] for item in chunk]
+    cur.execute(f"""
+        INSERT INTO {screen_table} (exchange, symbol, timestamp, signal_mask, first_signal, last_signal)
+        SELECT u.exchange, u.symbol, l.timestamp, l.signal_mask, s.first_signal, s.last_signal
+        FROM unnest(%s::text[], %s::text[]) AS u(exchange, symbol)
+        CROSS JOIN LATERAL (
+            SELECT timestamp, signal_mask FROM {backtest_table}
+            WHERE exchange = u.exchange AND symbol = u.symbol
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ) l
+        CROSS JOIN LATERAL (
+            SELECT MIN(timestamp) AS first_signal, MAX(timestamp) AS last_signal FROM {backtest_table}
+            WHERE symbol = u.symbol AND exchange = u.exchange AND signal_mask = {TRADING_SIGNAL_ALL}
+        ) s
+        ON CONFLICT (exchange, symbol) DO UPDATE SET
+            timestamp = EXCLUDED.timestamp, signal_mask = EXCLUDED.signal_mask,
+            first_signal = EXCLUDED.first_signal, last_signal = EXCLUDED.last_signal
+    """, (exchanges, symbols))
+    dbCommit(conn)
+
+###################### RUNNER ######################
+def runnerPrepareColumns(exchange_symbol, main_table, backtest_table, screen_table=DB_SCREEN_TABLE):
+    '''
+    Add the Minervini columns to the backtest table from the first symbol with enough data, before any worker writes
+    - Then the signal_mask column, its index and the screen table
+    '''
+    cur, conn = dbInitializeTable(backtest_table)
+    try:
+        for exchange, symbol in exchange_symbol:
+            df = dbGetDataWhere(cur, conn, main_table, "exchange = %s AND symbol = %s ORDER BY timestamp", params=(exchange, symbol))
+            if runnerPrepareColumnsFrame(cur, conn, df, backtest_table, screen_table):
+                return
+    finally:
+        conn.rollback()
+        cur.close()
+        dbRelease(conn)
+
+def runnerPrepareColumnsFrame(cur, conn, df, backtest_table, screen_table=DB_SCREEN_TABLE):
+    '''
+    runnerPrepareColumns from one symbol's bars, False when they are too short to show every column
+    '''
+    minervini_df = dfSetupMinervini(df.copy()).reset_index()
+    if minervini_df.empty:
+        return False
+
+    backtest_columns = dfInferColumnDBTypes(minervini_df)
+    db_minervini_columns = dbGetColumns(cur, conn, backtest_table)
+    new_columns = {k: v for k, v in backtest_columns.items() if k.lower() not in db_minervini_columns}
+    if len(new_columns) > 0:
+        dbSlotColumns(cur, conn, backtest_table, new_columns)
+    dbInitializeScreen(cur, conn, backtest_table, screen_table)
+    return True
+
+def runnerStreamChunks(conn, main_table, chunk_symbols=RUNNER_CHUNK_SYMBOLS, skip=0, limit=None):
+    '''
+    One streaming scan of the main table packed into one-exchange chunks, yields (chunk, df)
+    - Symbols come in sorted order, skip / limit select a window of it like slicing runnerOrder(..., 'sorted')
+    '''
+    chunk, dfs = [], []
+    for count, (exchange, symbol, df) in enumerate(dbStreamSymbolGroups(conn, main_table)):
+        if count < skip:
+            continue
+        if limit is not None and count >= skip + limit:
+            break
+        if chunk and (exchange != chunk[0][0] or len(chunk) >= chunk_symbols):
+            yield chunk, pd.concat(dfs, ignore_index=True)
+            chunk, dfs = [], []
+        chunk.append((exchange, symbol))
+        dfs.append(df)
+    if chunk:
+        yield chunk, pd.concat(dfs, ignore_index=True)
+
+def runnerBacktest(exchange_symbol, main_table=DB_MAIN_TABLE, backtest_table=DB_MINERVINI_TABLE, workers=None,
+                   order='sorted', seed=0, chunk_symbols=RUNNER_CHUNK_SYMBOLS, commit_rows=RUNNER_COMMIT_ROWS, mode='panel',
+                   screen_table=DB_SCREEN_TABLE):
+    '''
+    Run the Minervini setup over exchange_symbol on a process pool
+    - workers defaults to every core, each worker holds one DB connection
+    - Chunks are handed out in the chosen order, results land in the backtest table in batches
+    - mode='panel' computes a chunk in one vectorized pass, with the same result as mode='symbol'
+    '''
+    if mode not in RUNNER_MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {RUNNER_MODES}")
+    workers = workers or os.cpu_count()
+    exchange_symbol = runnerOrder(exchange_symbol, order, seed)
+    chunks = runnerChunks(exchange_symbol, chunk_symbols)
+    runnerPrepareColumns(exchange_symbol, main_table, backtest_table, screen_table)
+
+    return runnerPool(chunks, runnerBacktestChunk, len(exchange_symbol), workers, (main_table, backtest_table, commit_rows, mode, screen_table))
+
+def runnerBacktestStream(main_table=DB_MAIN_TABLE, backtest_table=DB_MINERVINI_TABLE, workers=None, skip=0, limit=None,
+                         chunk_symbols=RUNNER_CHUNK_SYMBOLS, commit_rows=RUNNER_COMMIT_ROWS, mode='panel', screen_table=DB_SCREEN_TABLE):
+    '''
+    runnerBacktest over every symbol from one sequential scan of the main table, instead of a query per chunk
+    - The parent streams the bars [server-side cursor], workers only compute and write
+    - At most RUNNER_STREAM_INFLIGHT chunks per worker are loaded ahead, so memory stays bounded however large the table is
+    '''
+    if mode not in RUNNER_MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {RUNNER_MODES}")
+    workers = workers or os.cpu_count()
+    done, rows_in, rows_out = 0, 0, 0
+    start = time.perf_counter()
+    print(f"Backtesting from one streaming scan of {main_table} on {workers} workers")
+
+    stream_cur, stream_conn = dbConnect()
+    prep_cur, prep_conn = dbInitializeTable(backtest_table)
+    prepared = False
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        with ctx.Pool(workers, initializer=runnerWorkerInit, initargs=(main_table, backtest_table, commit_rows, mode, screen_table)) as pool:
+            pending = collections.deque()
+            for chunk, df in runnerStreamChunks(stream_conn, main_table, chunk_symbols, skip, limit):
+                # Columns must exist before the first worker writes
+                if not prepared:
+                    for symbol, symbol_df in df.groupby('symbol', sort=False):
+                        if runnerPrepareColumnsFrame(prep_cur, prep_conn, symbol_df.reset_index(drop=True), backtest_table, screen_table):
+                            prepared = True
+                            break
+                    if not prepared:
+                        continue
+
+                pending.append(pool.apply_async(runnerBacktestFrame, ((chunk, df),)))
+                while pending and (len(pending) >= workers * RUNNER_STREAM_INFLIGHT or pending[0].ready()):
+                    symbols, chunk_in, chunk_out = pending.popleft().get()
+                    done, rows_in, rows_out = done + symbols, rows_in + chunk_in, rows_out + chunk_out
+                    elapsed = time.perf_counter() - start
+                    print(f"{done} symbols, {rows_in / elapsed:,.0f} rows/s read, {done / elapsed:,.1f} symbols/s")
+            while pending:
+                symbols, chunk_in, chunk_out = pending.popleft().get()
+                done, rows_in, rows_out = done + symbols, rows_in + chunk_in, rows_out + chunk_out
+    finally:
+        stream_cur.close()
+        dbRelease(stream_conn)
+        prep_conn.rollback()
+        prep_cur.close()
+        dbRelease(prep_conn)
+
+    elapsed = time.perf_counter() - start
+    print(f"Backtested {done} symbols in {elapsed:.1f}s: {rows_in} rows read, {rows_out} rows written ({rows_out / max(elapsed, 1e-9):,.0f} rows/s)")
+    return done, rows_out
+
+def runnerPool(chunks, task, total, workers, initargs, initializer=None):
+    done, rows_in, rows_out = 0, 0, 0
+    start = time.perf_counter()
+    print(f"Backtesting {total} symbols in {len(chunks)} chunks on {workers} workers")
+
+    # Spawned workers start clean, a forked one would share the parent's DB sockets
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(workers, initializer=initializer or runnerWorkerInit, initargs=initargs) as pool:
+        for symbols, chunk_in, chunk_out in pool.imap_unordered(task, chunks):
+            done += symbols
+            rows_in += chunk_in
+            rows_out += chunk_out
+            elapsed = time.perf_counter() - start
+            rate = done / elapsed if elapsed else 0
+            eta = (total - done) / rate if rate else 0
+            print(f"{done}/{total} symbols, {rows_in / elapsed:,.0f} rows/s read, {rate:,.1f} symbols/s, eta {eta:,.0f}s")
+
+    elapsed = time.perf_counter() - start
+    print(f"Backtested {done} symbols in {elapsed:.1f}s: {rows_in} rows read, {rows_out} rows written ({rows_out / max(elapsed, 1e-9):,.0f} rows/s)")
+    return done, rows_out
+
+def runnerBacktestIncremental(exchange_symbol, main_table=DB_MAIN_TABLE, backtest_table=DB_MINERVINI_TABLE, workers=None,
+                              order='sorted', seed=0, chunk_symbols=RUNNER_CHUNK_SYMBOLS, commit_rows=RUNNER_COMMIT_ROWS, mode='panel',
+                              screen_table=DB_SCREEN_TABLE):
+    '''
+    Backtest only what changed since the last run
+    - Never backtested symbols get a full runnerBacktest
+    - Symbols with new bars load a warmup tail and append the new rows, so a daily run scales with the new bars
+    '''
+    if mode not in RUNNER_MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {RUNNER_MODES}")
+    workers = workers or os.cpu_count()
+
+    cur, conn = dbInitializeTable(backtest_table)
+    try:
+        if 'atr' in dbGetColumns(cur, conn, backtest_table):
+            dbInitializeScreen(cur, conn, backtest_table, screen_table)
+            pending = dbGetBacktestPending(cur, main_table, backtest_table, exchange_symbol)
+        else:
+            pending = [(exchange, symbol, None, None, None) for exchange, symbol in exchange_symbol]
+    finally:
+        conn.rollback()
+        cur.close()
+        dbRelease(conn)
+
+    fresh = [(exchange, symbol) for exchange, symbol, last_timestamp, _, _ in pending if last_timestamp is None]
+    tails = [item for item in pending if item[2] is not None]
+    print(f"{len(pending)}/{len(exchange_symbol)} symbols have new bars: {len(fresh)} never backtested, {len(tails)} to extend")
+
+    done, rows_out = 0, 0
+    if fresh:
+        done, rows_out = runnerBacktest(fresh, main_table, backtest_table, workers, order, seed, chunk_symbols, commit_rows, mode, screen_table)
+    if tails:
+        chunks = runnerChunks(runnerOrder(tails, order, seed), chunk_symbols)
+        tail_done, tail_rows = runnerPool(chunks, runnerBacktestTailChunk, len(tails), workers, (main_table, backtest_table, commit_rows, mode, screen_table))
+        done, rows_out = done + tail_done, rows_out + tail_rows
+    return done, rows_out
@@ -0,0 +1,230 @@
+'''
+Trade simulator on top of the stored Minervini signals
+- Works on the long backtest df [one row per symbol and bar] as flat arrays, every symbol and bar at once, no per-bar loop
+- A trade opens at the next bar's open after the signal turns on, with an ATR stop fixed at entry
+- It closes at the stop [or the open when it gaps below], else at the close of the first bar the signal is off
+- Trades of a symbol never overlap: one trade per run of signal bars, the next run starts after an off bar
+- Position size is a fixed fraction of the starting capital [no compounding], so the portfolio stays a sum of trades
+- Open notional is capped at SIM_MAX_EXPOSURE * capital: a day's entries share the room left pro rata, entries without room are skipped
+'''
+
+import pandas as pd
+import numpy as np
+
+from backtest.trading import *
+
+###################### SETUP ######################
+SIM_CAPITAL = 100000.
+SIM_STOP_ATR = 2.  # Stop distance below the entry in ATRs
+SIM_RISK = 0.01  # Capital lost when a stop is hit
+SIM_MAX_WEIGHT = 0.1  # Cap on one position's size, as a fraction of capital
+SIM_MAX_EXPOSURE = 1.  # Cap on the open positions' total size, as a fraction of capital [1 = no leverage]
+SIM_COST = 0.0005  # Commission and slippage per side, as a fraction of the traded value
+SIM_PERIODS_YEAR = 252
+SIM_COLUMNS = ['exchange', 'symbol', 'timestamp', 'open', 'low', 'close', 'ATR'] + TRADING_LONG_CRITERIA
+
+###################### SIMULATION ######################
+def simulateExposureCap(entry_time, exit_time, notional, limit):
+    '''
+    notional of each trade scaled down so the open notional never exceeds limit
+    - Entry days are walked in order [one step per day, vectorized within it], a day's entries share the room left pro rata
+    - A trade's notional is freed for the entries of the day after its exit
+    '''
+    days = np.unique(np.concatenate([entry_time, exit_time]))
+    entry_day = np.searchsorted(days, entry_time)
+    release_day = np.searchsorted(days, exit_time) + 1
+    order = np.argsort(entry_day, kind='stable')
+    groups = np.split(order, np.flatnonzero(np.diff(entry_day[order])) + 1) if len(order) else []
+
+    capped = np.asarray(notional, dtype='float64').copy()
+    released = np.zeros(len(days) + 1)
+    open_notional, freed = 0., 0
+    for group in groups:
+        day = entry_day[group[0]]
+        open_notional -= released[freed:day + 1].sum()
+        freed = day + 1
+        wanted = capped[group].sum()
+        if wanted <= 0:
+            continue
+        capped[group] *= min(1., max(limit - open_notional, 0.) / wanted)
+        open_notional += capped[group].sum()
+        np.add.at(released, release_day[group], capped[group])
+    return capped
+
+def simulateTrades(df, stop_atr=SIM_STOP_ATR, risk=SIM_RISK, max_weight=SIM_MAX_WEIGHT, cost=SIM_COST, capital=SIM_CAPITAL,
+                   max_exposure=SIM_MAX_EXPOSURE):
+    '''
+    Every trade of every symbol in df [rows ordered by exchange, symbol, timestamp, default index]
+    - Returns one row per trade: entry / exit row of df, prices, reason [stop, signal or open], size and return
+    '''
+    n = len(df)
+    idx = np.arange(n)
+
+    symbol_code = df.groupby(['exchange', 'symbol'], sort=False).ngroup().to_numpy()
+    first = np.ones(n, dtype=bool)
+    first[1:] = symbol_code[1:] != symbol_code[:-1]
+    last = np.ones(n, dtype=bool)
+    last[:-1] = first[1:]
+
+    signal = df_long_signal(df).to_numpy()
+    open_, low, close = (df[column].to_numpy(dtype='float64') for column in ['open', 'low', 'close'])
+    atr = df['ATR'].to_numpy(dtype='float64')
+
+    # Signal switching on, with a next bar of the same symbol to enter on
+    previous = np.zeros(n, dtype=bool)
+    previous[1:] = signal[:-1]
+    previous[first] = False
+    signal_bar = np.flatnonzero(signal & ~previous & ~last & ~np.isnan(atr))
+    entry = signal_bar + 1
+    entry_price = open_[entry]
+    stop = entry_price - stop_atr * atr[signal_bar]
+
+    # First bar from entry on with the signal off [or the symbol's last bar]: a reverse running minimum
+    candidate = np.where(~signal | last, idx, n)
+    next_off = np.minimum.accumulate(candidate[::-1])[::-1]
+    signal_exit = next_off[entry]
+
+    # Each bar belongs to at most one trade's window [entry, signal_exit], find the first stop hit per window
+    starts = np.zeros(n, dtype=bool)
+    starts[entry] = True
+    marks = np.zeros(n + 1, dtype='int64')
+    np.add.at(marks, entry, 1)
+    np.add.at(marks, signal_exit + 1, -1)
+    in_trade = np.cumsum(marks)[:n] > 0
+    trade_of_bar = np.maximum(np.cumsum(starts) - 1, 0)
+    hit = in_trade & (low <= stop[trade_of_bar]) if len(entry) else np.zeros(n, dtype=bool)
+    stop_hit = np.full(len(entry), n)
+    np.minimum.at(stop_hit, trade_of_bar[hit], idx[hit])
+
+    stopped = stop_hit <= signal_exit
+    exit = np.where(stopped, stop_hit, signal_exit)
+    exit_price = np.where(stopped, np.minimum(open_[exit], stop), close[exit])
+    reason = np.where(stopped, 'stop', np.where(signal[exit], 'open', 'signal'))
+
+    # Risk a fixed part of the capital per trade, capped per position
+    stop_distance = (entry_price - stop) / entry_price
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.clip(np.where(stop_distance > 0, risk / stop_distance, max_weight), 0, max_weight)
+    trade_return = exit_price / entry_price - 1 - 2 * cost
+
+    # Then the portfolio cap, datetime64 keys [a tz-aware column's to_numpy() would build one Timestamp per row]
+    times = df['timestamp'].to_numpy('datetime64[ns]')
+    notional = simulateExposureCap(times[entry], times[exit], weight * capital, max_exposure * capital)
+
+    trades = pd.DataFrame({
+        'exchange': df['exchange'].to_numpy()[entry],
+        'symbol': df['symbol'].to_numpy()[entry],
+        'entry_row': entry,
+        'exit_row': exit,
+        'entry_time': df['timestamp'].array.take(entry),
+        'exit_time': df['timestamp'].array.take(exit),
+        'entry_price': entry_price,
+        'exit_price': exit_price,
+        'stop': stop,
+        'reason': reason,
+        'bars': exit - entry + 1,
+        'weight': notional / capital,
+        'notional': notional,
+        'return': trade_return,
+        'pnl': notional * trade_return,
+    })
+    return trades[trades['notional'] > 0].reset_index(drop=True)
+
+def simulateEquity(df, trades, cost=SIM_COST, capital=SIM_CAPITAL):
+    '''
+    Daily marked to market portfolio of the trades [df as given to simulateTrades]
+    - pnl of a bar = notional * price change since the previous bar / entry price, costs booked on entry and exit bars
+    - Returns per timestamp: pnl, equity, exposure [open notional / capital] and open positions
+    '''
+    if trades.empty:
+        return pd.DataFrame(columns=['timestamp', 'pnl', 'equity', 'exposure', 'positions'])
+
+    entry = trades['entry_row'].to_numpy()
+    exit = trades['exit_row'].to_numpy()
+    bars = exit - entry + 1
+
+    # One element per (trade, bar held), laid out trade after trade
+    trade = np.repeat(np.arange(len(trades)), bars)
+    offset = np.arange(len(trade)) - np.repeat(np.cumsum(bars) - bars, bars)
+    row = entry[trade] + offset
+
+    price = df['close'].to_numpy(dtype='float64')[row]
+    is_exit = row == exit[trade]
+    price[is_exit] = trades['exit_price'].to_numpy()[trade[is_exit]]
+
+    entry_price = trades['entry_price'].to_numpy()[trade]
+    previous_price = np.empty_like(price)
+    previous_price[1:] = price[:-1]
+    previous_price[offset == 0] = entry_price[offset == 0]
+
+    notional = trades['notional'].to_numpy()[trade]
+    pnl = notional * (price - previous_price) / entry_price
+    pnl -= notional * cost * ((offset == 0).astype('float64') + is_exit)
+
+    # Grouped on datetime64 [UTC for a tz-aware column], the column's time zone is put back on the result
+    times = df['timestamp'].to_numpy('datetime64[ns]')
+    bar_df = pd.DataFrame({'timestamp': times[row], 'pnl': pnl, 'notional': np.where(is_exit, 0., notional), 'positions': ~is_exit})
+    equity = bar_df.groupby('timestamp', sort=True).agg(pnl=('pnl', 'sum'), notional=('notional', 'sum'), positions=('positions', 'sum'))
+
+    # Dates without an open position still belong on the curve
+    equity = equity.reindex(np.unique(times), fill_value=0).rename_axis('timestamp').reset_index()
+    tz = getattr(df['timestamp'].dtype, 'tz', None)
+    if tz is not None:
+        equity['timestamp'] = equity['timestamp'].dt.tz_localize('UTC').dt.tz_convert(tz)
+    equity['equity'] = capital + equity['pnl'].cumsum()
+    equity['exposure'] = equity.pop('notional') / capital
+    return equity[['timestamp', 'pnl', 'equity', 'exposure', 'positions']]
+
+def simulateStatistics(trades, equity, capital=SIM_CAPITAL, periods_year=SIM_PERIODS_YEAR):
+    '''
+    Trade and equity statistics as a dict
+    - Daily returns are pnl / capital, matching the fixed sizing [a percent change of the curve flips sign once equity is negative]
+    '''
+    closed = trades[trades['reason'] != 'open']
+    wins = closed[closed['return'] > 0]
+    losses = closed[closed['return'] <= 0]
+    stats = {
+        'trades': len(trades),
+        'closed': len(closed),
+        'win_rate': len(wins) / len(closed) if len(closed) else np.nan,
+        'avg_return': closed['return'].mean(),
+        'avg_win': wins['return'].mean(),
+        'avg_loss': losses['return'].mean(),
+        'profit_factor': wins['pnl'].sum() / -losses['pnl'].sum() if losses['pnl'].sum() < 0 else np.nan,
+        'avg_bars': closed['bars'].mean(),
+        'stopped': (closed['reason'] == 'stop').mean() if len(closed) else np.nan,
+    }
+
+    if equity.empty:
+        return stats
+    curve = equity['equity']
+    daily = equity['pnl'] / capital
+    years = len(curve) / periods_year
+    stats.update({
+        'final_equity': curve.iloc[-1],
+        'total_return': curve.iloc[-1] / capital - 1,
+        'cagr': (curve.iloc[-1] / capital) ** (1 / years) - 1 if years > 0 and curve.iloc[-1] > 0 else np.nan,
+        'max_drawdown': (curve / curve.cummax() - 1).min(),
+        'sharpe': daily.mean() / daily.std() * np.sqrt(periods_year) if daily.std() > 0 else np.nan,
+        'max_exposure': equity['exposure'].max(),
+        'max_positions': int(equity['positions'].max()),
+    })
+    return stats
+
+def simulateMinervini(df, stop_atr=SIM_STOP_ATR, risk=SIM_RISK, max_weight=SIM_MAX_WEIGHT, cost=SIM_COST, capital=SIM_CAPITAL,
+                      max_exposure=SIM_MAX_EXPOSURE):
+    '''
+    Trades, equity curve and statistics of the Minervini long signals in df [rows of the backtest table]
+    '''
+    df = df.sort_values(['exchange', 'symbol', 'timestamp'], kind='stable', ignore_index=True)
+    trades = simulateTrades(df, stop_atr, risk, max_weight, cost, capital, max_exposure)
+    equity = simulateEquity(df, trades, cost, capital)
+    return trades, equity, simulateStatistics(trades, equity, capital)
+
+###################### DB FUNCTIONS ######################
+def dbGetSimulationData(cur, conn, backtest_table, columns=SIM_COLUMNS, where="TRUE", params=None):
+    '''
+    Only the columns the simulator needs, already in its order
+    '''
+    sql_query = f"SELECT {', '.join(columns)} FROM {backtest_table} WHERE {where} ORDER BY exchange, symbol, timestamp"
+    return pd.read_sql_query(sql_query, conn, params=params)
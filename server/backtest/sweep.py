@@ -0,0 +1,259 @@
+'''
+Parameter sweep over the Minervini thresholds
+- Every combination of a parameter grid is evaluated per symbol in one pass over its bars
+- Flags [higher highs / lows, volume spikes, up / down weeks] get one cumulative sum each, every window size is read off it
+- Per (symbol, combination) only the signal count and its forward return outcome are stored, in a compact table
+'''
+
+import itertools
+import io
+
+from psycopg2.extras import execute_values
+
+from backtest.minervini import *
+from backtest.runner import *
+from datatools.getdata import *
+from datatools.storedata import *
+
+###################### SETUP ######################
+SWEEP_TABLE = 'minervini_sweep'  # Results, combinations go to <table>_combos
+SWEEP_HORIZON = 20  # Bars after a signal its outcome [forward return] is measured over
+SWEEP_PARAMS = ['hhhl_amounts', 'hhhl_periods', 'volume_spike', 'spike_amounts', 'spike_periods', 'vma', 'week_periods']
+
+# The module constants as a one-combination grid, widen any list to sweep it
+SWEEP_DEFAULT_GRID = {
+    'hhhl_amounts': [TR_HIGHERHIGH_LOWERLOW_AMOUNTS],
+    'hhhl_periods': [TR_HIGHERHIGH_LOWERLOW_PERIODS],
+    'volume_spike': [TR_VOLUMESPIKE_RATIO],
+    'spike_amounts': [TR_VOLUMESPIKE_AMOUNTS],
+    'spike_periods': [TR_VOLUMESPIKE_PERIODS],
+    'vma': [TR_VMA],
+    'week_periods': [WEEKTR_VOLUME_UP_LT_DOWN_PERIODS],
+}
+
+_sweep_worker = {}
+
+###################### GRID FUNCTIONS ######################
+def sweepCombinations(grid):
+    '''
+    Every combination of the grid as a df with a combo id, missing parameters take the module constants
+    '''
+    grid = {**SWEEP_DEFAULT_GRID, **grid}
+    unknown = set(grid) - set(SWEEP_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters {sorted(unknown)}, expected {SWEEP_PARAMS}")
+
+    combos = pd.DataFrame(list(itertools.product(*[sorted(grid[param]) for param in SWEEP_PARAMS])), columns=SWEEP_PARAMS)
+    combos.insert(0, 'combo', range(len(combos)))
+    return combos
+
+def sweepWindowCounts(flags, windows):
+    '''
+    Rolling True counts for several windows off one cumulative sum, NaN until a window is full [rolling(w).sum()]
+    '''
+    flags = np.asarray(flags, dtype=bool)
+    cumulative = np.concatenate([[0], np.cumsum(flags, dtype='int64')])
+    n = len(flags)
+    counts = {}
+    for window in set(windows):
+        window_counts = np.full(n, np.nan)
+        if n >= window:
+            window_counts[window - 1:] = cumulative[window:] - cumulative[:n - window + 1]
+        counts[window] = window_counts
+    return counts
+
+###################### SWEEP FUNCTIONS ######################
+def dfSweepMinervini(df, combos, horizon=SWEEP_HORIZON, cache=None):
+    '''
+    Signal counts and outcomes of every combination for one symbol's bars [time ordered]
+    - Signal = all four Minervini transition criteria, as in dfSetupMinervini
+    - Outcome = return over the next horizon bars: how many signals have one, how many were positive, their sum
+    - cache: IndicatorCache, the indicators [every VMA window too] then come from the same entries as the backtest's
+    - Returns a df with one row per combination
+    '''
+    base = df.reset_index(drop=True).copy()
+    versions = {}
+    base['ATR'] = dfCachedIndicator(base, cache, 'ATR', df_atr, TR_ATR_N, versions=versions, extend=df_atr_continue)
+    base['returns'] = dfCachedIndicator(base, cache, 'returns', df_return, versions=versions, warmup=1)
+    base['SMA_50'] = dfCachedIndicator(base, cache, 'SMA', df_sma, 50, versions=versions, warmup=49)
+    base['SMA_150'] = dfCachedIndicator(base, cache, 'SMA', df_sma, 150, versions=versions, warmup=149)
+    base['SMA_200'] = dfCachedIndicator(base, cache, 'SMA', df_sma, 200, versions=versions, warmup=199)
+    complete = base.notna().all(axis=1)
+
+    results = []
+    for vma, vma_combos in combos.groupby('vma', sort=True):
+        # dropna depends on the VMA window, everything after it works on the kept bars
+        vma_values = dfCachedIndicator(base, cache, 'VMA', df_vma, int(vma), versions=versions, warmup=int(vma) - 1)
+        keep = (complete & vma_values.notna()).to_numpy()
+        kept = base[keep].reset_index(drop=True)
+        kept_vma = vma_values[keep].to_numpy()
+        n = len(kept)
+        if n == 0:
+            results.append(pd.DataFrame({'combo': vma_combos['combo'].to_numpy(), 'signals': 0, 'outcomes': 0, 'wins': 0, 'return_sum': 0.0}))
+            continue
+
+        long_sma = dfMinerviniTransitionLongCriteria_1(kept).to_numpy()
+
+        # Shared flags, one cumulative sum each
+        higherhighs = (kept['high'] > kept['high'].shift()).to_numpy()
+        higherlows = (kept['low'] > kept['low'].shift()).to_numpy()
+        higherhighs_counts = sweepWindowCounts(higherhighs, vma_combos['hhhl_periods'])
+        higherlows_counts = sweepWindowCounts(higherlows, vma_combos['hhhl_periods'])
+
+        volume = kept['volume'].to_numpy(dtype='float64')
+        volumespike_counts = {ratio: sweepWindowCounts(volume > (ratio * kept_vma), vma_combos['spike_periods'])
+                              for ratio in vma_combos['volume_spike'].unique()}
+
+        pastweek_return = kept['volume'].rolling(window=7).sum().pct_change()
+        up_counts = sweepWindowCounts((pastweek_return > 0).to_numpy(), vma_combos['week_periods'])
+        down_counts = sweepWindowCounts((pastweek_return < 0).to_numpy(), vma_combos['week_periods'])
+
+        # Outcome of a signal at bar i: close[i + horizon] / close[i] - 1
+        close = kept['close'].to_numpy(dtype='float64')
+        forward = np.full(n, np.nan)
+        if n > horizon:
+            forward[:-horizon] = close[horizon:] / close[:-horizon] - 1
+        has_outcome = ~np.isnan(forward)
+
+        # Criteria per parameter subset, reused by every combination sharing it
+        hhhl, vspike, week = {}, {}, {}
+        rows = []
+        for combo in vma_combos.itertuples(index=False):
+            hhhl_key = (combo.hhhl_amounts, combo.hhhl_periods)
+            if hhhl_key not in hhhl:
+                with np.errstate(invalid='ignore'):
+                    hhhl[hhhl_key] = (long_sma & (higherhighs_counts[combo.hhhl_periods] >= combo.hhhl_amounts)
+                                      & (higherlows_counts[combo.hhhl_periods] >= combo.hhhl_amounts))
+            vspike_key = (combo.volume_spike, combo.spike_amounts, combo.spike_periods)
+            if vspike_key not in vspike:
+                with np.errstate(invalid='ignore'):
+                    vspike[vspike_key] = volumespike_counts[combo.volume_spike][combo.spike_periods] >= combo.spike_amounts
+            if combo.week_periods not in week:
+                with np.errstate(invalid='ignore'):
+                    week[combo.week_periods] = up_counts[combo.week_periods] > down_counts[combo.week_periods]
+
+            signal = hhhl[hhhl_key] & vspike[vspike_key] & week[combo.week_periods]
+            outcome = forward[signal & has_outcome]
+            rows.append((combo.combo, int(signal.sum()), len(outcome), int((outcome > 0).sum()), float(outcome.sum())))
+        results.append(pd.DataFrame(rows, columns=['combo', 'signals', 'outcomes', 'wins', 'return_sum']))
+
+    return pd.concat(results, ignore_index=True).sort_values('combo', ignore_index=True)
+
+###################### DB FUNCTIONS ######################
+def dbInitializeSweep(cur, conn, table=SWEEP_TABLE):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table}_combos (
+            sweep TEXT NOT NULL,
+            combo INTEGER NOT NULL,
+            hhhl_amounts INTEGER, hhhl_periods INTEGER,
+            volume_spike DOUBLE PRECISION, spike_amounts INTEGER, spike_periods INTEGER,
+            vma INTEGER, week_periods INTEGER,
+            PRIMARY KEY (sweep, combo)
+        )
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            sweep TEXT NOT NULL,
+            exchange TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            combo INTEGER NOT NULL,
+            signals INTEGER NOT NULL,
+            outcomes INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            return_sum DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (sweep, exchange, symbol, combo)
+        )
+    """)
+    dbCommit(conn)
+
+def dbStoreSweepCombos(cur, conn, sweep, combos, table=SWEEP_TABLE):
+    '''
+    A sweep name always refers to one grid, rerunning it with another grid replaces the old one
+    '''
+    cur.execute(f"DELETE FROM {table}_combos WHERE sweep = %s", (sweep,))
+    cur.execute(f"DELETE FROM {table} WHERE sweep = %s", (sweep,))
+    execute_values(cur, f"INSERT INTO {table}_combos (sweep, combo, {', '.join(SWEEP_PARAMS)}) VALUES %s",
+                   [(sweep, *row) for row in combos[['combo'] + SWEEP_PARAMS].itertuples(index=False)])
+    dbCommit(conn)
+
+def dbStoreSweepResults(cur, conn, sweep, exchange, symbols, results_df, table=SWEEP_TABLE):
+    '''
+    Replace a chunk's results in one transaction: delete, then COPY
+    '''
+    cur.execute(f"DELETE FROM {table} WHERE sweep = %s AND exchange = %s AND symbol = ANY(%s)", (sweep, exchange, list(symbols)))
+    if not results_df.empty:
+        buffer = io.StringIO()
+        results_df[['sweep', 'exchange', 'symbol', 'combo', 'signals', 'outcomes', 'wins', 'return_sum']].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {table} (sweep, exchange, symbol, combo, signals, outcomes, wins, return_sum) FROM STDIN WITH (FORMAT csv)", buffer)
+    dbCommit(conn)
+
+def dbGetSweepSummary(cur, conn, sweep, table=SWEEP_TABLE, min_outcomes=1):
+    '''
+    Per combination totals across the universe, best average outcome first
+    '''
+    sql_query = f"""
+        SELECT c.*, SUM(r.signals) AS signals, SUM(r.outcomes) AS outcomes,
+               SUM(r.wins)::float / NULLIF(SUM(r.outcomes), 0) AS win_rate,
+               SUM(r.return_sum) / NULLIF(SUM(r.outcomes), 0) AS mean_return
+        FROM {table}_combos c
+        JOIN {table} r ON r.sweep = c.sweep AND r.combo = c.combo
+        WHERE c.sweep = %s
+        GROUP BY c.sweep, c.combo
+        HAVING SUM(r.outcomes) >= %s
+        ORDER BY mean_return DESC
+    """
+    return pd.read_sql_query(sql_query, conn, params=(sweep, min_outcomes))
+
+###################### RUNNER ######################
+def sweepWorkerInit(main_table, table, sweep, combos, horizon):
+    import warnings
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy connectable")
+
+    cur, conn = dbConnect()
+    cache = IndicatorCache() if RUNNER_INDICATOR_CACHE else None
+    _sweep_worker.update(cur=cur, conn=conn, main_table=main_table, table=table, sweep=sweep, combos=combos, horizon=horizon, cache=cache)
+
+def sweepChunk(chunk):
+    cur, conn = _sweep_worker['cur'], _sweep_worker['conn']
+    exchange = chunk[0][0]
+    symbols = [item[1] for item in chunk]
+
+    df = dbGetDataWhere(cur, conn, _sweep_worker['main_table'], "exchange = %s AND symbol = ANY(%s) ORDER BY symbol, timestamp",
+                        params=(exchange, symbols))
+    conn.rollback()
+
+    results_dfs = []
+    for symbol, symbol_df in df.groupby('symbol', sort=True):
+        results_df = dfSweepMinervini(symbol_df, _sweep_worker['combos'], _sweep_worker['horizon'], _sweep_worker['cache'])
+        results_df.insert(0, 'symbol', symbol)
+        results_dfs.append(results_df)
+    results_df = pd.concat(results_dfs, ignore_index=True) if results_dfs else pd.DataFrame()
+    if not results_df.empty:
+        results_df.insert(0, 'exchange', exchange)
+        results_df.insert(0, 'sweep', _sweep_worker['sweep'])
+
+    dbStoreSweepResults(cur, conn, _sweep_worker['sweep'], exchange, symbols, results_df, _sweep_worker['table'])
+    return len(chunk), len(df), len(results_df)
+
+def sweepRun(exchange_symbol, grid, sweep, main_table=DB_MAIN_TABLE, table=SWEEP_TABLE, workers=None,
+             horizon=SWEEP_HORIZON, order='sorted', chunk_symbols=RUNNER_CHUNK_SYMBOLS):
+    '''
+    Evaluate every combination of grid for every symbol on the runner's process pool
+    - Results land in table under the sweep name, dbGetSweepSummary ranks the combinations
+    '''
+    workers = workers or os.cpu_count()
+    combos = sweepCombinations(grid)
+    print(f"Sweep {sweep}: {len(combos)} combinations over {len(exchange_symbol)} symbols")
+
+    cur, conn = dbConnect()
+    try:
+        dbInitializeSweep(cur, conn, table)
+        dbStoreSweepCombos(cur, conn, sweep, combos, table)
+    finally:
+        cur.close()
+        dbRelease(conn)
+
+    chunks = runnerChunks(runnerOrder(exchange_symbol, order), chunk_symbols)
+    return runnerPool(chunks, sweepChunk, len(exchange_symbol), workers, (main_table, table, sweep, combos, horizon),
+                      initializer=sweepWorkerInit)
@@ -1,17 +1,60 @@
 import pandas as pd 
 import numpy as np
+import os
+
+from backtest.kernels import *
+
+###################### SETUP ######################
+# Default engine of the df_* functions and the Minervini criteria: 'pandas' or 'numpy' [backtest/kernels.py]
+# - numpy matches pandas exactly for true range and the rolling counts, ATR and rolling means / sums agree to float rounding
+# - pandas stays the default: rounding noise on flat stretches flips comparisons like SMA_200 > SMA_200.shift() [long_sma],
+#   and the panel, continuation and cache paths are only exact against the per-symbol results under one engine
+# - numpy is ahead end to end [benchmark_kernels.py], TRADING_ENGINE=numpy opts in where that difference is acceptable
+TRADING_ENGINE = os.getenv('TRADING_ENGINE', 'pandas')
+
+def _engineResult(values, result):
+    # Wrap a kernel result like the pandas object it replaces
+    if isinstance(values, pd.DataFrame):
+        return pd.DataFrame(result, index=values.index, columns=values.columns)
+    return pd.Series(result, index=values.index)
 
 ###################### COMMON FUNCTIONS ######################
-def df_wwma(values, n):
+def df_wwma(values, n, engine=None):
     '''
     J. Welles Wilder's EMA 
     '''
+    if (engine or TRADING_ENGINE) == 'numpy':
+        return _engineResult(values, kernel_wilder(values.to_numpy(dtype='float64'), n))
     return values.ewm(alpha=1/n, min_periods=n, adjust=False).mean()
 
-def df_atr(df, n=14):
+def df_wwma_continue(values, n, previous):
     '''
-    Average True Range for the measurement of volatility
+    Carry df_wwma on from its last value, for bars appended after it
+    - Same recurrence and rounding as pandas' ewm(adjust=False), so continuing matches a full recompute
     '''
+    com = (1 - 1/n) / (1/n)
+    alpha = 1. / (1. + com)
+    old_wt_factor = 1. - alpha
+    new_wt = alpha
+
+    weighted = previous
+    old_wt = 1.
+    output = np.empty(len(values))
+    for i, cur in enumerate(np.asarray(values, dtype='float64')):
+        is_observation = cur == cur
+        old_wt *= old_wt_factor
+        if is_observation:
+            if weighted != cur:
+                weighted = old_wt * weighted + new_wt * cur
+                weighted /= (old_wt + new_wt)
+            old_wt = 1.
+        output[i] = weighted
+    return pd.Series(output, index=getattr(values, 'index', None))
+
+def df_true_range(df, engine=None):
+    if (engine or TRADING_ENGINE) == 'numpy':
+        high, low, close = (df[column].to_numpy(dtype='float64') for column in ['high', 'low', 'close'])
+        return _engineResult(df['close'], kernel_true_range(high, low, close))
     high = df['high']
     low = df['low']
     close = df['close']
@@ -19,19 +62,73 @@ def df_atr(df, n=14):
     tr1 = abs(high - close.shift())
     tr2 = abs(low - close.shift())
     tr = pd.concat([tr0, tr1, tr2], axis=1).max(axis=1)
-    atr = df_wwma(tr, n)
+    return tr
+
+def df_atr(df, n=14, engine=None):
+    '''
+    Average True Range for the measurement of volatility
+    '''
+    tr = df_true_range(df, engine)
+    atr = df_wwma(tr, n, engine)
     return atr
 
+def df_atr_continue(df, start, previous, n=14):
+    '''
+    df_atr of df's rows from start on, carried on from previous [df_atr at row start - 1]
+    '''
+    tr = df_true_range(df.iloc[start - 1:]).iloc[1:]
+    return df_wwma_continue(tr, n, previous)
+
 def df_return(df):
     returns = np.log(df['close'].div(df['close'].shift(1)))
     return returns
 
-def df_sma(df, window):
+def df_sma(df, window, engine=None):
+    if (engine or TRADING_ENGINE) == 'numpy':
+        return _engineResult(df['close'], kernel_rolling_mean(df['close'].to_numpy(dtype='float64'), window))
     sma = df['close'].rolling(window=window).mean()
     return sma
 
-def df_vma(df, window):
+def df_vma(df, window, engine=None):
+    if (engine or TRADING_ENGINE) == 'numpy':
+        return _engineResult(df['volume'], kernel_rolling_mean(df['volume'].to_numpy(dtype='float64'), window))
     vma = df['volume'].rolling(window=window).mean()
     return vma
 
+def df_rolling_sum(values, window, engine=None):
+    if (engine or TRADING_ENGINE) == 'numpy':
+        return _engineResult(values, kernel_rolling_sum(values.to_numpy(dtype='float64'), window))
+    return values.rolling(window=window).sum()
+
+def df_rolling_count(flags, window, valid=None, engine=None):
+    '''
+    Rolling count of True flags [flags.rolling(window).sum()]
+    - valid marks the real bars of a panel, a window reaching padding is NaN like a too short series
+    '''
+    if (engine or TRADING_ENGINE) == 'numpy':
+        return _engineResult(flags, kernel_rolling_count(flags.to_numpy(dtype=bool), window, valid))
+    if valid is not None:
+        flags = pd.DataFrame(np.where(valid, flags.to_numpy(dtype='float64'), np.nan), index=flags.index, columns=flags.columns)
+    return flags.rolling(window=window).sum()
+
 ###################### MINERVINI FUNCTIONS ######################
+TRADING_LONG_CRITERIA = ['long_sma', 'long_hhhl', 'long_vspike', 'long_week_vup_lt_vdn']  # Bit 0, 1, 2, 3 of signal_mask
+TRADING_SIGNAL_ALL = (1 << len(TRADING_LONG_CRITERIA)) - 1  # signal_mask with every criterion met
+
+def df_long_signal(df, criteria=TRADING_LONG_CRITERIA):
+    '''
+    All Minervini transition long criteria at once, missing values count as False
+    '''
+    signal = pd.Series(True, index=df.index)
+    for column in criteria:
+        signal &= df[column].fillna(False).astype(bool)
+    return signal
+
+def df_signal_mask(df, criteria=TRADING_LONG_CRITERIA):
+    '''
+    The criteria packed into one small integer per row, bit i set when criteria[i] is met
+    '''
+    mask = np.zeros(len(df), dtype='int16')
+    for bit, column in enumerate(criteria):
+        mask |= df[column].fillna(False).to_numpy(dtype=bool).astype('int16') << bit
+    return pd.Series(mask, index=df.index)
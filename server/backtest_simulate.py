@@ -0,0 +1,33 @@
+from dotenv import load_dotenv
+from backtest.simulate import *
+
+from datatools.getdata import *
+from datatools.storedata import *
+import warnings
+import time
+
+# Mute the warning of database should use SQLAlechemy
+warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy connectable")
+
+CONST_STOP_ATR = 2.
+CONST_RISK = 0.01
+CONST_COST = 0.0005
+
+###################### MAIN ######################
+if __name__ == "__main__":
+    load_dotenv()
+    DB_BACKTEST_TABLE = str(os.getenv('DB_MINERVINI_TABLE'))
+
+    cur, conn = dbConnect()
+    start = time.perf_counter()
+    df = dbGetSimulationData(cur, conn, DB_BACKTEST_TABLE)
+    print(f"Loaded {len(df)} rows in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    trades, equity, stats = simulateMinervini(df, stop_atr=CONST_STOP_ATR, risk=CONST_RISK, cost=CONST_COST)
+    print(f"Simulated {len(trades)} trades in {time.perf_counter() - start:.1f}s")
+    for name, value in stats.items():
+        print(f"{name:>15}: {value}")
+
+    cur.close()
+    dbRelease(conn)
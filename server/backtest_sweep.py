@@ -0,0 +1,41 @@
+from dotenv import load_dotenv
+from backtest.sweep import *
+
+from datatools.getdata import *
+from datatools.storedata import *
+import warnings
+
+# Mute the warning of database should use SQLAlechemy
+warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy connectable")
+
+# Sweep name results are stored under, rerunning a name replaces its results
+CONST_SWEEP = 'minervini_thresholds'
+CONST_CUTOFF = 1500
+CONST_WORKERS = os.cpu_count()
+CONST_HORIZON = 20  # Bars a signal's forward return is measured over
+
+# Values to try per parameter, parameters left out keep the backtest/minervini.py constants
+CONST_GRID = {
+    'hhhl_amounts': [2, 3, 4],
+    'hhhl_periods': [5, 10, 15],
+    'volume_spike': [1.5, 2.0, 2.5],
+    'spike_amounts': [1, 2, 3],
+    'spike_periods': [10, 20],
+    'vma': [20, 50],
+    'week_periods': [4, 8],
+}
+
+###################### MAIN ######################
+if __name__ == "__main__":
+    load_dotenv()
+    DB_MAIN_TABLE = str(os.getenv('DB_MAIN_TABLE'))
+
+    ori_cur, ori_conn = dbInitializeTable()
+    exchange_symbol = dbGetUniquePairs(ori_cur, ori_conn, DB_MAIN_TABLE)
+    exchange_symbol = runnerOrder(exchange_symbol, 'sorted')[:CONST_CUTOFF]
+
+    sweepRun(exchange_symbol, CONST_GRID, CONST_SWEEP, DB_MAIN_TABLE, workers=CONST_WORKERS, horizon=CONST_HORIZON)
+
+    print(dbGetSweepSummary(ori_cur, ori_conn, CONST_SWEEP).head(20).to_string())
+    ori_cur.close()
+    dbRelease(ori_conn)
@@ -0,0 +1,137 @@
+'''
+Run this script to check the NumPy kernels against the pandas df_* functions and time both
+- Every kernel is first compared on random bars [exact where it should be exact], then timed per symbol and as one panel.
+- Last the whole Minervini setup is timed under both engines, per symbol and as one panel [what TRADING_ENGINE decides].
+'''
+
+import numpy as np
+import pandas as pd
+import time
+
+import backtest.trading as trading
+from backtest.trading import *
+from backtest.kernels import *
+from backtest.panel import *
+
+###################### SETUP ######################
+BENCH_SYMBOLS = 500
+BENCH_DAYS = 1750  # ~7 years of daily bars
+BENCH_REPEAT = 3
+BENCH_RTOL = 1e-9  # Cumulative sum windows and the closed form Wilder smoothing vs pandas
+BENCH_SETUP_SYMBOLS = 200  # Symbols of the end to end timing
+
+###################### HELPER FUNCTIONS ######################
+def benchGenerateBars(days, seed=0, gaps=True):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(rng.normal(0, 0.02, days).cumsum())
+    spread = np.abs(rng.normal(0, 0.01, days)) * close
+    df = pd.DataFrame({
+        'open': close + rng.normal(0, 0.005, days) * close,
+        'high': close + spread,
+        'low': close - spread,
+        'close': close,
+        'volume': rng.integers(1000, 10000000, days).astype(float),
+    })
+    if gaps:
+        # A few missing bars, windows across them must come out NaN like pandas
+        df.loc[rng.choice(days, size=3, replace=False), ['high', 'close', 'volume']] = np.nan
+    return df
+
+def benchTime(fn, repeat=BENCH_REPEAT):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def benchMatches(expected, actual, exact):
+    expected = np.asarray(expected, dtype='float64')
+    actual = np.asarray(actual, dtype='float64')
+    if exact:
+        return np.array_equal(expected, actual, equal_nan=True)
+    return np.array_equal(np.isnan(expected), np.isnan(actual)) and np.allclose(expected, actual, rtol=BENCH_RTOL, atol=0, equal_nan=True)
+
+###################### EQUIVALENCE ######################
+BENCH_CHECKS = [
+    # (name, pandas result, numpy result, exact)
+    ('true range', lambda df: df_true_range(df, 'pandas'), lambda df: df_true_range(df, 'numpy'), True),
+    ('ATR', lambda df: df_atr(df, 14, 'pandas'), lambda df: df_atr(df, 14, 'numpy'), False),
+    ('SMA_200', lambda df: df_sma(df, 200, 'pandas'), lambda df: df_sma(df, 200, 'numpy'), False),
+    ('VMA_50', lambda df: df_vma(df, 50, 'pandas'), lambda df: df_vma(df, 50, 'numpy'), False),
+    ('rolling count', lambda df: (df['high'] > df['high'].shift()).rolling(window=30).sum(),
+                      lambda df: kernel_rolling_count((df['high'] > df['high'].shift()).to_numpy(), 30), True),
+    ('weekly volume', lambda df: df_rolling_sum(df['volume'], 7, 'pandas'), lambda df: df_rolling_sum(df['volume'], 7, 'numpy'), False),
+]
+
+def benchEquivalence(dfs):
+    print("Equivalence against pandas:")
+    for name, pandas_fn, numpy_fn, exact in BENCH_CHECKS:
+        for idx, df in enumerate(dfs):
+            if not benchMatches(pandas_fn(df), numpy_fn(df), exact):
+                raise AssertionError(f"{name}: numpy kernel doesn't match pandas on symbol {idx}")
+        print(f"  {name:<16} {'identical' if exact else f'within rtol {BENCH_RTOL}'} on {len(dfs)} symbols")
+
+    # One 2-D pass equals the symbols one by one
+    tr = np.column_stack([benchTrueRange(df) for df in dfs])
+    wilder_each = np.column_stack([df_wwma(pd.Series(tr[:, i]), 14, 'pandas').to_numpy() for i in range(tr.shape[1])])
+    if not benchMatches(wilder_each, kernel_wilder(tr, 14), exact=False):
+        raise AssertionError("panel wilder: 2-D kernel doesn't match pandas")
+    print(f"  {'panel wilder':<16} within rtol {BENCH_RTOL} on {len(dfs)} symbols")
+
+def benchTrueRange(df):
+    return df_true_range(df, 'pandas').to_numpy()
+
+###################### BENCHMARK ######################
+def benchSpeed(dfs):
+    print(f"Timing {len(dfs)} symbols x {BENCH_DAYS} bars:")
+    results = {}
+    for name, fn in [
+        ('ATR', lambda df, engine: df_atr(df, 14, engine)),
+        ('SMA_200', lambda df, engine: df_sma(df, 200, engine)),
+        ('VMA_50', lambda df, engine: df_vma(df, 50, engine)),
+    ]:
+        pandas_time = benchTime(lambda: [fn(df, 'pandas') for df in dfs])
+        numpy_time = benchTime(lambda: [fn(df, 'numpy') for df in dfs])
+        results[name] = (pandas_time, numpy_time)
+        print(f"  {name:<16} pandas: {pandas_time:.3f}s  numpy: {numpy_time:.3f}s  ({pandas_time / numpy_time:.1f}x)")
+
+    # The same kernels over one time x symbol panel
+    close = np.column_stack([df['close'].to_numpy() for df in dfs])
+    tr = np.column_stack([benchTrueRange(df) for df in dfs])
+    out = np.empty_like(close)
+    print(f"  {'panel SMA_200':<16} numpy: {benchTime(lambda: kernel_rolling_mean(close, 200, out=out)):.3f}s")
+    print(f"  {'panel ATR':<16} numpy: {benchTime(lambda: kernel_wilder(tr, 14, out=out)):.3f}s")
+    return results
+
+def benchSetup(dfs):
+    # The Minervini setup as the runner calls it, under each engine
+    frames = []
+    for idx, df in enumerate(dfs[:BENCH_SETUP_SYMBOLS]):
+        df = df.copy()
+        df.insert(0, 'symbol', f"S{idx:04d}")
+        df.insert(0, 'exchange', 'BENCH')
+        frames.append(df)
+    universe = pd.concat(frames, ignore_index=True)
+
+    print(f"Minervini setup on {len(frames)} symbols x {BENCH_DAYS} bars:")
+    default_engine = trading.TRADING_ENGINE
+    times = {}
+    try:
+        for engine in ['pandas', 'numpy']:
+            trading.TRADING_ENGINE = engine
+            symbol_time = benchTime(lambda: [dfSetupMinervini(df.copy()) for df in frames])
+            panel_time = benchTime(lambda: dfSetupMinerviniPanel(universe))
+            times[engine] = (symbol_time, panel_time)
+            print(f"  {engine:<16} per symbol: {symbol_time:.3f}s  panel: {panel_time:.3f}s")
+    finally:
+        trading.TRADING_ENGINE = default_engine
+    faster = all(numpy_time < pandas_time for numpy_time, pandas_time in zip(times['numpy'], times['pandas']))
+    print(f"  numpy is {'ahead' if faster else 'not ahead'} on both paths, TRADING_ENGINE default: {default_engine}")
+    return times
+
+if __name__ == "__main__":
+    dfs = [benchGenerateBars(BENCH_DAYS, seed) for seed in range(BENCH_SYMBOLS)]
+    benchEquivalence(dfs)
+    benchSpeed(dfs)
+    benchSetup(dfs)
@@ -0,0 +1,69 @@
+'''
+Run this script to exercise the fetch scheduler against the in-process FakeClient [no network, no API keys]
+- Each scenario checks one path: concurrency, 429 retry / backoff, exhausted retries, timeouts, a server side quota.
+'''
+
+import time
+
+from datatools.scheduler import *
+
+###################### SETUP ######################
+BENCH_BACKOFF = 0.05  # Seconds, scaled down from FETCH_BACKOFF so the run stays short
+BENCH_TIMEOUT = 0.3
+
+###################### HELPER FUNCTIONS ######################
+def benchRun(client, jobs, workers=4, requests_per_minute=60000, timeout=5, retries=FETCH_RETRIES):
+    results, errors = {}, {}
+    start = time.perf_counter()
+    fetchConcurrent(jobs, client.fetch, lambda job, result: results.__setitem__(job, result),
+                    on_error=lambda job, e: errors.__setitem__(job, e), workers=workers,
+                    requests_per_minute=requests_per_minute, timeout=timeout, retries=retries, backoff=BENCH_BACKOFF)
+    return results, errors, time.perf_counter() - start
+
+def benchCheck(name, passed, detail):
+    print(f"{'PASS' if passed else 'FAIL'} {name}: {detail}")
+    return passed
+
+###################### SCENARIOS ######################
+def benchConcurrency():
+    # 40 jobs of 50ms on 8 workers take about 5 rounds, not 40
+    client = FakeClient(latency=0.05)
+    results, errors, elapsed = benchRun(client, range(40), workers=8)
+    return benchCheck("concurrency", len(results) == 40 and not errors and elapsed < 1.0,
+                      f"{len(results)} ok, {len(errors)} failed in {elapsed:.2f}s")
+
+def benchRetryBackoff():
+    # Two 429s then success: three attempts, spaced by at least backoff and 2 * backoff
+    client = FakeClient(latency=0.01, rate_limited={'a': 2})
+    results, errors, elapsed = benchRun(client, ['a'])
+    starts = [start for _, start, _ in client.attempts('a')]
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+    passed = 'a' in results and len(starts) == 3 and gaps[0] >= BENCH_BACKOFF and gaps[1] >= 2 * BENCH_BACKOFF
+    return benchCheck("retry + backoff", passed, f"{len(starts)} attempts, gaps {[round(gap, 3) for gap in gaps]}")
+
+def benchRetriesExhausted():
+    # More 429s than retries: reported as a rate limit error after retries + 1 attempts
+    client = FakeClient(rate_limited={'a': FETCH_RETRIES + 5})
+    results, errors, elapsed = benchRun(client, ['a', 'b'])
+    passed = 'b' in results and isRateLimitError(errors.get('a')) and len(client.attempts('a')) == FETCH_RETRIES + 1
+    return benchCheck("retries exhausted", passed, f"{len(client.attempts('a'))} attempts, error {errors.get('a')!r}")
+
+def benchTimeout():
+    # A stalled request is given up on, the others still finish
+    client = FakeClient(latency=0.01, hang={'slow': 3})
+    results, errors, elapsed = benchRun(client, ['slow', 'x', 'y'], timeout=BENCH_TIMEOUT)
+    passed = isinstance(errors.get('slow'), TimeoutError) and {'x', 'y'} <= set(results) and elapsed < 2.5
+    return benchCheck("timeout", passed, f"slow -> {errors.get('slow')!r} after {elapsed:.2f}s")
+
+def benchQuota():
+    # Client side limit under the server quota: no request ever sees a 429
+    client = FakeClient(latency=0.005, quota_per_second=20)
+    results, errors, elapsed = benchRun(client, range(30), workers=4, requests_per_minute=15 * 60)
+    rate_limited = sum(outcome == '429' for _, _, outcome in client.calls)
+    return benchCheck("rate limit", len(results) == 30 and rate_limited == 0,
+                      f"{len(results)} ok in {elapsed:.2f}s, {rate_limited} 429s")
+
+###################### MAIN ######################
+if __name__ == "__main__":
+    checks = [benchConcurrency(), benchRetryBackoff(), benchRetriesExhausted(), benchTimeout(), benchQuota()]
+    print(f"{sum(checks)}/{len(checks)} scheduler checks passed")
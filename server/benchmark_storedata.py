@@ -0,0 +1,86 @@
+'''
+Run this script to compare database write throughput of the row-by-row and COPY based writers
+- Uses a scratch table, so the main table is never touched.
+- Earlier versions wrote into the main table by mistake, benchDropTable also removes their exchange = 'BENCH' rows from it.
+'''
+
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import time
+
+from datatools.storedata import *
+
+###################### SETUP ######################
+BENCH_TABLE = f"{DB_MAIN_TABLE}_bench"
+BENCH_EXCHANGE = 'BENCH'
+BENCH_SYMBOLS = 200
+BENCH_DAYS = 250
+
+###################### HELPER FUNCTIONS ######################
+def benchGenerateBars(symbols, days, seed=0):
+    # Random walk OHLC bars, one df per symbol as the fetch loops produce them
+    rng = np.random.default_rng(seed)
+    start = datetime(2020, 1, 1)
+    timestamps = [start + timedelta(days=d) for d in range(days)]
+    dfs = []
+    for idx in range(symbols):
+        close = 100 + rng.standard_normal(days).cumsum()
+        dfs.append(pd.DataFrame({
+            'exchange': BENCH_EXCHANGE,
+            'symbol': f"SYM{idx}",
+            'timestamp': timestamps,
+            'open': close + rng.standard_normal(days),
+            'high': close + 2,
+            'low': close - 2,
+            'close': close,
+            'volume': rng.integers(1000, 100000, days).astype(float),
+            'trade_count': rng.integers(10, 1000, days).astype(float),
+            'vwap': close,
+        }))
+    return dfs
+
+def benchDropTable():
+    cur, conn = dbInitializeTable(BENCH_TABLE)
+    cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    # Synthetic rows left in the main table by earlier runs
+    cur.execute(f"DELETE FROM {DB_MAIN_TABLE} WHERE exchange = %s", (BENCH_EXCHANGE,))
+    conn.commit()
+    dbRelease(conn)
+
+def benchRun(name, write, dfs):
+    benchDropTable()
+    cur, conn = dbInitializeTable(BENCH_TABLE)
+    rows = sum(len(df) for df in dfs)
+
+    start = time.perf_counter()
+    write(dfs, cur, conn)
+    elapsed = time.perf_counter() - start
+
+    print(f"{name}: {rows} rows in {elapsed:.2f}s = {rows / elapsed:,.0f} rows/sec")
+    cur.close()
+    dbRelease(conn)
+    return rows / elapsed
+
+###################### MAIN ######################
+if __name__ == "__main__":
+    dfs = benchGenerateBars(BENCH_SYMBOLS, BENCH_DAYS)
+
+    def writeOHLC(dfs, cur, conn):
+        for df in dfs:
+            dbSlotDataOHLC(df, cur, conn, table=BENCH_TABLE)
+
+    def writeCopy(dfs, cur, conn):
+        for df in dfs:
+            dbSlotDataCopy(df, cur, conn, table=BENCH_TABLE, columns=OHLC_COLUMNS)
+
+    def writeCopyGroup(dfs, cur, conn):
+        dbSlotDataCopyGroup(dfs, cur, conn, table=BENCH_TABLE, columns=OHLC_COLUMNS)
+
+    base = benchRun("dbSlotDataOHLC (executemany)", writeOHLC, dfs)
+    copy = benchRun("dbSlotDataCopy (per symbol)", writeCopy, dfs)
+    group = benchRun("dbSlotDataCopyGroup (one commit)", writeCopyGroup, dfs)
+    print(f"Speedup: per symbol {copy / base:.1f}x, group commit {group / base:.1f}x")
+
+    # Clean up the scratch table
+    benchDropTable()
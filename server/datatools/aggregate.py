@@ -0,0 +1,115 @@
+'''
+Weekly / monthly bars aggregated from the daily bars in the main table
+- One table per timeframe next to the main table [<main table>_1week, <main table>_1month], same columns plus the bars they cover
+- Periods are calendar periods [date_trunc: ISO weeks starting Monday, calendar months], stamped with their first day
+- A refresh only rebuilds each symbol's periods from its last aggregated one on, so a daily run touches one period per symbol
+'''
+
+from datetime import timezone
+
+from datatools.constant import *
+from datatools.storedata import dbCommit
+
+###################### SETUP ######################
+TIMEFRAME_DAY = '1Day'
+AGGREGATE_UNITS = {'1Week': 'week', '1Month': 'month'}  # Timeframe -> date_trunc unit
+TIMEFRAMES = [TIMEFRAME_DAY] + list(AGGREGATE_UNITS)
+AGGREGATE_CHUNK_SYMBOLS = 500  # Symbols refreshed per statement [and per commit]
+
+###################### TABLE FUNCTIONS ######################
+def dbTimeframeTable(table, timeframe=None):
+    '''
+    Table holding table's bars in timeframe, the daily timeframe is table itself
+    '''
+    if timeframe is None or timeframe == TIMEFRAME_DAY:
+        return table
+    if timeframe not in AGGREGATE_UNITS:
+        raise ValueError(f"Unknown timeframe {timeframe}, expected one of {TIMEFRAMES}")
+    return f"{table}_{timeframe.lower()}"
+
+def dbInitializeAggregate(cur, conn, main_table=DB_MAIN_TABLE, timeframe='1Week', schema=DB_SCHEMA):
+    aggregate_table = dbTimeframeTable(main_table, timeframe)
+    value_type = 'DOUBLE PRECISION' if schema == 'compact' else 'NUMERIC'
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {aggregate_table} (
+            exchange TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            open {value_type},
+            high {value_type},
+            low {value_type},
+            close {value_type},
+            volume {value_type},
+            trade_count {value_type},
+            vwap {value_type},
+            first_bar TIMESTAMP NOT NULL,
+            last_bar TIMESTAMP NOT NULL,
+            bars INTEGER NOT NULL,
+            PRIMARY KEY (exchange, symbol, timestamp)
+        )
+    """)
+    dbCommit(conn)
+    return aggregate_table
+
+###################### REFRESH FUNCTIONS ######################
+def dbRefreshAggregate(cur, conn, exchange_symbol, main_table=DB_MAIN_TABLE, timeframe='1Week', since=None):
+    '''
+    Bring the timeframe's bars of exchange_symbol up to date with the main table
+    - Per symbol, periods from its last aggregated one on are rebuilt [the last one may have been partial]
+    - since [after dbRemovePastDate] also drops and rebuilds every period from the one holding since
+    - Returns the amount of periods written
+    '''
+    unit = AGGREGATE_UNITS[timeframe]
+    aggregate_table = dbInitializeAggregate(cur, conn, main_table, timeframe)
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+
+    written = 0
+    for idx in range(0, len(exchange_symbol), AGGREGATE_CHUNK_SYMBOLS):
+        exchanges, symbols = zip(*[item[:2] for item in exchange_symbol[idx:idx + AGGREGATE_CHUNK_SYMBOLS]])
+        exchanges, symbols = list(exchanges), list(symbols)
+
+        if since is not None:
+            cur.execute(f"""
+                DELETE FROM {aggregate_table} a
+                USING unnest(%s::text[], %s::text[]) AS u(exchange, symbol)
+                WHERE a.exchange = u.exchange AND a.symbol = u.symbol AND a.timestamp >= date_trunc('{unit}', %s::timestamp)
+            """, (exchanges, symbols, since))
+
+        cur.execute(f"""
+            WITH marks AS (
+                SELECT u.exchange, u.symbol, COALESCE(a.timestamp, '-infinity'::timestamp) AS period_start
+                FROM unnest(%s::text[], %s::text[]) AS u(exchange, symbol)
+                LEFT JOIN LATERAL (
+                    SELECT timestamp FROM {aggregate_table}
+                    WHERE exchange = u.exchange AND symbol = u.symbol
+                    ORDER BY timestamp DESC
+                    LIMIT 1
+                ) a ON TRUE
+            )
+            INSERT INTO {aggregate_table} (exchange, symbol, timestamp, open, high, low, close, volume, trade_count, vwap,
+                                           first_bar, last_bar, bars)
+            SELECT m.exchange, m.symbol, date_trunc('{unit}', m.timestamp),
+                   (array_agg(m.open ORDER BY m.timestamp))[1], MAX(m.high), MIN(m.low),
+                   (array_agg(m.close ORDER BY m.timestamp DESC))[1],
+                   SUM(m.volume), SUM(m.trade_count), SUM(m.vwap * m.volume) / NULLIF(SUM(m.volume), 0),
+                   MIN(m.timestamp), MAX(m.timestamp), COUNT(*)
+            FROM marks k
+            JOIN {main_table} m ON m.exchange = k.exchange AND m.symbol = k.symbol AND m.timestamp >= k.period_start
+            GROUP BY m.exchange, m.symbol, date_trunc('{unit}', m.timestamp)
+            ON CONFLICT (exchange, symbol, timestamp) DO UPDATE SET
+                open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close,
+                volume = EXCLUDED.volume, trade_count = EXCLUDED.trade_count, vwap = EXCLUDED.vwap,
+                first_bar = EXCLUDED.first_bar, last_bar = EXCLUDED.last_bar, bars = EXCLUDED.bars
+        """, (exchanges, symbols))
+        written += cur.rowcount
+        dbCommit(conn)
+
+    return written
+
+def dbRefreshAggregates(cur, conn, exchange_symbol, main_table=DB_MAIN_TABLE, timeframes=None, since=None):
+    '''
+    dbRefreshAggregate for every aggregated timeframe, {timeframe: periods written}
+    '''
+    timeframes = timeframes or list(AGGREGATE_UNITS)
+    return {timeframe: dbRefreshAggregate(cur, conn, exchange_symbol, main_table, timeframe, since) for timeframe in timeframes}
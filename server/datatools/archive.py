@@ -0,0 +1,232 @@
+'''
+Columnar archive of the OHLC history
+- Parquet files partitioned by exchange and year [hive layout: exchange=NYSE/year=2023/part-*.parquet]
+- Typed float / int columns with zstd compression, appends add a new file to the partition
+- Reads push symbol and date predicates down to partitions and row group statistics
+'''
+
+from datetime import datetime, timedelta
+import pandas as pd
+import threading
+import uuid
+import os
+
+from datatools.constant import *
+from datatools.storedata import dfGroupStoreCSVs
+
+###################### SETUP ######################
+DIR_ARCHIVE = 'parquet'  # Under DIR_DATA/DIR_SUB_DATA
+ARCHIVE_COMPRESSION = 'zstd'
+ARCHIVE_FLOAT_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'vwap']
+ARCHIVE_INT_COLUMNS = ['trade_count']
+
+_part_lock = threading.Lock()
+_part_last_stamp = None
+
+###################### SCHEMA FUNCTIONS ######################
+def parquetArchiveDir(archive_dir=DIR_ARCHIVE):
+    return os.path.join(DIR_DATA, DIR_SUB_DATA, archive_dir)
+
+def parquetSchema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('symbol', pa.string()),
+        ('timestamp', pa.timestamp('ns', tz='UTC')),
+        *[(column, pa.float64()) for column in ARCHIVE_FLOAT_COLUMNS],
+        *[(column, pa.int64()) for column in ARCHIVE_INT_COLUMNS],
+        ('exchange', pa.string()),
+        ('year', pa.int32()),
+    ])
+
+def parquetPartitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([('exchange', pa.string()), ('year', pa.int32())]), flavor='hive')
+
+def dfPrepareArchive(df):
+    '''
+    Cast a bars df [as stored in DB / CSV, with an exchange column] into the archive's types
+    '''
+    df = df.reset_index(drop=('symbol' in df.columns))
+    df = df[['symbol', 'timestamp', *ARCHIVE_FLOAT_COLUMNS, *ARCHIVE_INT_COLUMNS, 'exchange']].copy()
+    df['symbol'] = df['symbol'].astype(str)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    for column in ARCHIVE_FLOAT_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    for column in ARCHIVE_INT_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce').round().astype('Int64')
+    df['year'] = df['timestamp'].dt.year.astype('int32')
+
+    # Sorted rows keep each row group's symbol / timestamp statistics tight for pushdown
+    return df.sort_values(['exchange', 'year', 'symbol', 'timestamp'], ignore_index=True)
+
+###################### WRITE FUNCTIONS ######################
+def parquetPartName(suffix):
+    '''
+    part-<UTC time to the microsecond>-<random>-suffix, file names sort in write order
+    - The time never repeats within a process [bumped by 1us on a tie], so compaction can tell which copy of a bar is latest
+    - Names of older second resolution files [part-%Y%m%d%H%M%S-...] still sort before newer ones of the same second
+    '''
+    global _part_last_stamp
+    with _part_lock:
+        stamp = datetime.utcnow()
+        if _part_last_stamp is not None and stamp <= _part_last_stamp:
+            stamp = _part_last_stamp + timedelta(microseconds=1)
+        _part_last_stamp = stamp
+    return f"part-{stamp:%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}-{suffix}"
+
+def parquetAppend(df, archive_dir=DIR_ARCHIVE):
+    '''
+    Append bars to the archive, every touched (exchange, year) partition gets one new file
+    '''
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if df.empty:
+        return
+    df = dfPrepareArchive(df)
+    table = pa.Table.from_pandas(df, schema=parquetSchema(), preserve_index=False)
+
+    ds.write_dataset(
+        table,
+        parquetArchiveDir(archive_dir),
+        format='parquet',
+        partitioning=parquetPartitioning(),
+        file_options=ds.ParquetFileFormat().make_write_options(compression=ARCHIVE_COMPRESSION),
+        basename_template=parquetPartName("{i}.parquet"),
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+def parquetCompact(exchange, year, archive_dir=DIR_ARCHIVE):
+    '''
+    Rewrite one partition into a single file, daily appends otherwise leave many small ones
+    '''
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    partition_dir = os.path.join(parquetArchiveDir(archive_dir), f"exchange={exchange}", f"year={year}")
+    # In name order = write order [parquetPartName], os.listdir's own order is arbitrary
+    files = [os.path.join(partition_dir, f) for f in sorted(os.listdir(partition_dir)) if f.endswith('.parquet')]
+    if len(files) <= 1:
+        return
+
+    # Duplicated bars [a re-fetched day] keep their latest copy, the one of the last file [read file by file to keep that order]
+    table = pa.concat_tables([ds.dataset(f, format='parquet').to_table() for f in files])
+    df = table.to_pandas().drop_duplicates(subset=['symbol', 'timestamp'], keep='last')
+    df = df.sort_values(['symbol', 'timestamp'], ignore_index=True)
+
+    compacted_path = os.path.join(partition_dir, parquetPartName("compacted.parquet"))
+    pq.write_table(pa.Table.from_pandas(df, schema=table.schema, preserve_index=False), compacted_path, compression=ARCHIVE_COMPRESSION)
+    for f in files:
+        os.remove(f)
+
+def parquetCompactAll(archive_dir=DIR_ARCHIVE):
+    root = parquetArchiveDir(archive_dir)
+    for exchange_dir in sorted(os.listdir(root)):
+        if not exchange_dir.startswith('exchange='):
+            continue
+        for year_dir in sorted(os.listdir(os.path.join(root, exchange_dir))):
+            if year_dir.startswith('year='):
+                parquetCompact(exchange_dir.split('=', 1)[1], int(year_dir.split('=', 1)[1]), archive_dir)
+
+def dfStoreArchive(df, mode=ARCHIVE_MODE):
+    '''
+    Store bars [with an exchange column] to whichever archive the scripts are set to
+    '''
+    if mode == 'parquet':
+        parquetAppend(df)
+    else:
+        dfGroupStoreCSVs(df)
+
+###################### READ FUNCTIONS ######################
+def parquetRead(exchange=None, symbols=None, start=None, end=None, columns=None, archive_dir=DIR_ARCHIVE):
+    '''
+    Read bars back as a typed df
+    - exchange / start / end prune whole partitions, symbols / dates are pushed down to row groups
+    - start is inclusive, end exclusive
+    '''
+    import pyarrow.dataset as ds
+
+    root = parquetArchiveDir(archive_dir)
+    if not os.path.exists(root):
+        return pd.DataFrame()
+    dataset = ds.dataset(root, format='parquet', partitioning=parquetPartitioning())
+
+    # Build the predicate, partitions first
+    predicate = None
+    def both(a, b):
+        return b if a is None else a & b
+    if exchange is not None:
+        predicate = both(predicate, ds.field('exchange') == exchange)
+    if start is not None:
+        start = _utcTimestamp(start)
+        predicate = both(predicate, ds.field('year') >= start.year)
+        predicate = both(predicate, ds.field('timestamp') >= start)
+    if end is not None:
+        end = _utcTimestamp(end)
+        predicate = both(predicate, ds.field('year') <= end.year)
+        predicate = both(predicate, ds.field('timestamp') < end)
+    if symbols is not None:
+        predicate = both(predicate, ds.field('symbol').isin(list(symbols)))
+
+    table = dataset.to_table(columns=columns, filter=predicate)
+    df = table.to_pandas()
+    if 'year' in df.columns and (columns is None or 'year' not in columns):
+        df = df.drop(columns=['year'])
+    if 'symbol' in df.columns and 'timestamp' in df.columns:
+        df = df.sort_values(['symbol', 'timestamp'], ignore_index=True)
+    return df
+
+def parquetGetLatestDate(exchange, symbol, archive_dir=DIR_ARCHIVE):
+    '''
+    Parquet counterpart of csvGetLatestDate
+    '''
+    df = parquetRead(exchange=exchange, symbols=[symbol], columns=['timestamp'], archive_dir=archive_dir)
+    if df.empty:
+        return None
+    return df['timestamp'].max().to_pydatetime()
+
+def _utcTimestamp(date):
+    # Naive dates are taken as UTC, like the bars themselves
+    date = pd.Timestamp(date)
+    return date.tz_localize('UTC') if date.tzinfo is None else date.tz_convert('UTC')
+
+###################### CONVERSION FUNCTIONS ######################
+def parquetConvertCSVTree(csv_root=None, archive_dir=DIR_ARCHIVE, batch_rows=2000000, compact=True):
+    '''
+    One-shot conversion of the per-symbol CSV tree [csv_root/<exchange>/<symbol>.csv] into the archive
+    - CSVs are batched so each partition gets few, large files
+    '''
+    if csv_root is None:
+        csv_root = os.path.join(DIR_DATA, DIR_SUB_DATA)
+
+    pending_dfs, pending_rows, converted = [], 0, 0
+    for exchange in sorted(os.listdir(csv_root)):
+        exchange_dir = os.path.join(csv_root, exchange)
+        if not os.path.isdir(exchange_dir) or exchange == archive_dir:
+            continue
+        for csv_name in sorted(os.listdir(exchange_dir)):
+            if not csv_name.endswith('.csv'):
+                continue
+            df = pd.read_csv(os.path.join(exchange_dir, csv_name), dtype={'symbol': str})
+            if df.empty:
+                continue
+            df['exchange'] = exchange
+            pending_dfs.append(df)
+            pending_rows += len(df)
+            converted += 1
+
+            if pending_rows >= batch_rows:
+                print(f"Archiving {converted} CSVs so far ({pending_rows} rows in this batch)")
+                parquetAppend(pd.concat(pending_dfs, ignore_index=True), archive_dir)
+                pending_dfs, pending_rows = [], 0
+
+    if pending_dfs:
+        parquetAppend(pd.concat(pending_dfs, ignore_index=True), archive_dir)
+    if compact:
+        parquetCompactAll(archive_dir)
+    print(f"Archived {converted} CSVs into {parquetArchiveDir(archive_dir)}")
+    return converted
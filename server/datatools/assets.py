@@ -0,0 +1,147 @@
+'''
+Tradable asset registry
+- Loads the pickled Alpaca asset list once and keeps hash indexes by (exchange, symbol) and by exchange
+- Reloads only when the pickle's mtime changes, refreshes from Alpaca once it's older than a TTL
+'''
+
+from datetime import datetime, timedelta
+import threading
+import pickle
+import os
+
+from datatools.constant import *
+
+###################### SETUP ######################
+ASSET_PICKLE = 'tradable_assets.pkl'  # Under DIR_DATA/DIR_SUB_DATA
+ASSET_EXCHANGE_SKIP = ['OTC']  # All OTC data can't be fetched anyway
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+###################### REGISTRY ######################
+class AssetRegistry:
+    def __init__(self, pickle_dir=ASSET_PICKLE):
+        self.pickle_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, pickle_dir)
+        self.mtime = None
+        self.tradable_assets = []
+        self.by_key = {}  # (exchange, symbol) -> asset
+        self.by_exchange = {}  # exchange -> [symbol, ...] in asset list order
+        self.views = {}  # Memoized filtered / grouped results, dropped on every reload
+        self.lock = threading.RLock()
+
+    ##### LOADING #####
+    def load(self, API_KEY=None, API_SECRET=None):
+        '''
+        (Re)load the pickle if it changed on disk, fetching it from Alpaca if it doesn't exist yet
+        '''
+        with self.lock:
+            try:
+                mtime = os.path.getmtime(self.pickle_file_path)
+            except FileNotFoundError:
+                if API_KEY is None:
+                    raise
+                self.save(alpacaListTradableAssets(API_KEY, API_SECRET))
+                mtime = os.path.getmtime(self.pickle_file_path)
+
+            if mtime != self.mtime:
+                with open(self.pickle_file_path, 'rb') as f:
+                    self.index(pickle.load(f))
+                self.mtime = mtime
+        return self
+
+    def index(self, tradable_assets):
+        by_key, by_exchange = {}, {}
+        for asset in tradable_assets:
+            key = (asset['exchange'], asset['symbol'])
+            if key in by_key:
+                continue
+            by_key[key] = asset
+            by_exchange.setdefault(asset['exchange'], []).append(asset['symbol'])
+
+        self.tradable_assets = list(by_key.values())
+        self.by_key = by_key
+        self.by_exchange = by_exchange
+        self.views = {}
+
+    def save(self, tradable_assets):
+        os.makedirs(os.path.dirname(self.pickle_file_path), exist_ok=True)
+        with open(self.pickle_file_path, 'wb') as f:
+            pickle.dump(tradable_assets, f)
+
+    def refresh(self, API_KEY, API_SECRET, ttl=timedelta(days=1), force=False):
+        '''
+        Re-list assets from Alpaca once the pickle is older than ttl, and report the difference
+        '''
+        with self.lock:
+            self.load(API_KEY, API_SECRET)
+            age = datetime.now() - datetime.fromtimestamp(self.mtime)
+            if not force and age < ttl:
+                return [], []
+
+            latest_assets = alpacaListTradableAssets(API_KEY, API_SECRET)
+            latest_keys = {(asset['exchange'], asset['symbol']) for asset in latest_assets}
+            added = sorted(latest_keys - self.by_key.keys())
+            removed = sorted(self.by_key.keys() - latest_keys)
+            print(f"Tradable assets refreshed: {len(added)} added, {len(removed)} removed")
+
+            self.save(latest_assets)
+            self.load()
+            return added, removed
+
+    ##### LOOKUPS #####
+    def get(self, exchange, symbol):
+        return self.by_key.get((exchange, symbol))
+
+    def symbols(self, exchange):
+        return self.by_exchange.get(exchange, [])
+
+    def assets(self, skipCSVData=None, exchange_skip=()):
+        '''
+        Asset dicts minus the skip list [set difference] and skipped exchanges
+        '''
+        skip = frozenset(tuple(skipping[:2]) for skipping in skipCSVData or [])
+        view_key = ('assets', skip, tuple(exchange_skip))
+        with self.lock:
+            if view_key not in self.views:
+                for skipping in sorted(skip & self.by_key.keys()):
+                    print(f"Removing {skipping[0]}, {skipping[1]} from tradable assets")
+                keys = self.by_key.keys() - skip
+                self.views[view_key] = [asset for asset in self.tradable_assets
+                                        if (asset['exchange'], asset['symbol']) in keys and asset['exchange'] not in exchange_skip]
+            return self.views[view_key]
+
+    def grouped(self, skipCSVData=None, exchange_skip=ASSET_EXCHANGE_SKIP):
+        '''
+        exchange -> [symbol, ...], built once per load and served from memory
+        '''
+        skip = frozenset(tuple(skipping[:2]) for skipping in skipCSVData or [])
+        view_key = ('grouped', skip, tuple(exchange_skip))
+        with self.lock:
+            if view_key not in self.views:
+                self.views[view_key] = {exchange: [symbol for symbol in symbols if (exchange, symbol) not in skip]
+                                        for exchange, symbols in self.by_exchange.items() if exchange not in exchange_skip}
+            return self.views[view_key]
+
+def assetRegistry(pickle_dir=ASSET_PICKLE, API_KEY=None, API_SECRET=None):
+    '''
+    Shared registry per pickle file, already reloaded if the file changed
+    '''
+    with _registries_lock:
+        if pickle_dir not in _registries:
+            _registries[pickle_dir] = AssetRegistry(pickle_dir)
+        registry = _registries[pickle_dir]
+    return registry.load(API_KEY, API_SECRET)
+
+###################### ALPACA FUNCTIONS ######################
+def alpacaListTradableAssets(API_KEY, API_SECRET):
+    import alpaca_trade_api as tradeapi
+
+    # Initialize API
+    trade_api = tradeapi.REST(API_KEY, API_SECRET)
+
+    # Filter for assets that are tradable
+    assets = trade_api.list_assets()
+    tradable_assets = [asset for asset in assets if asset.tradable]
+
+    # Convert assets to dictionaries [to avoid pickle hit recursion limit]
+    return [asset._raw for asset in tradable_assets]
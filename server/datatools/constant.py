@@ -13,4 +13,22 @@ DB_NAME = str(os.getenv('DB_NAME'))
 DB_PASSWORD = str(os.getenv('DB_PASSWORD'))
 DB_HOST = str(os.getenv('DB_HOST'))
 DB_PORT = str(os.getenv('DB_PORT'))
-DB_MAIN_TABLE = str(os.getenv('DB_MAIN_TABLE'))
\ No newline at end of file
+DB_MAIN_TABLE = str(os.getenv('DB_MAIN_TABLE'))
+DB_MINERVINI_TABLE = str(os.getenv('DB_MINERVINI_TABLE'))
+DB_JOURNAL_TABLE = str(os.getenv('DB_JOURNAL_TABLE', 'ingest_journal'))
+DB_SCREEN_TABLE = str(os.getenv('DB_SCREEN_TABLE', 'latest_screen'))  # Latest signal state per symbol [see backtest/runner.py]
+
+# Archive written next to the DB: 'csv' [one file per symbol] or 'parquet' [see datatools/archive.py]
+ARCHIVE_MODE = str(os.getenv('ARCHIVE_MODE', 'csv'))
+
+# Bars table layout: 'numeric' [original arbitrary precision columns] or 'compact' [double precision / bigint, partitioned by year]
+DB_SCHEMA = str(os.getenv('DB_SCHEMA', 'numeric'))
+
+# Connection pool [see datatools/dbpool.py], statement timeout in milliseconds [0 = no limit]
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', 30))
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 0))
+
+# Rows fetched per round-trip by streaming [server-side cursor] scans
+DB_STREAM_ITERSIZE = int(os.getenv('DB_STREAM_ITERSIZE', 50000))
\ No newline at end of file
@@ -0,0 +1,118 @@
+'''
+Shared Postgres connection pool
+- One pool per process, sized by DB_POOL_MIN / DB_POOL_MAX, connections carry DB_STATEMENT_TIMEOUT
+- A checkout waits for a free connection instead of failing when the pool is exhausted
+- Connections idle for a while are health checked before being handed out, broken ones are replaced
+'''
+
+from contextlib import contextmanager
+from psycopg2 import extensions
+from psycopg2 import pool
+import threading
+import psycopg2
+import time
+
+from datatools.constant import *
+
+###################### SETUP ######################
+DB_POOL_HEALTH_INTERVAL = 30  # Seconds a connection may sit idle before it's checked again
+
+_pool = None
+_pool_slots = None  # Bounds checkouts to the pool size, so callers wait rather than hit PoolError
+_pool_lock = threading.Lock()
+_last_used = {}  # id(conn) -> time it was last returned
+
+###################### POOL FUNCTIONS ######################
+def dbPoolInit(minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, statement_timeout=DB_STATEMENT_TIMEOUT):
+    '''
+    Create the process pool, the first call wins [the server calls this at start up with its own settings]
+    - statement_timeout is in milliseconds, 0 means no limit
+    '''
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = pool.ThreadedConnectionPool(
+                minconn, maxconn,
+                dbname=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                host=DB_HOST,
+                options=f"-c statement_timeout={int(statement_timeout)}",
+            )
+            _pool_slots = threading.BoundedSemaphore(maxconn)
+    return _pool
+
+def dbPoolClose():
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool, _pool_slots = None, None
+        _last_used.clear()
+
+def dbHealthy(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < DB_POOL_HEALTH_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def dbAcquire(timeout=DB_POOL_CHECKOUT_TIMEOUT):
+    '''
+    Take a healthy connection out of the pool, waiting up to timeout seconds for one
+    - Hand it back with dbRelease
+    '''
+    pg_pool = dbPoolInit()
+    if not _pool_slots.acquire(timeout=timeout):
+        raise pool.PoolError(f"No database connection free after {timeout}s")
+
+    try:
+        conn = pg_pool.getconn()
+        if not dbHealthy(conn):
+            pg_pool.putconn(conn, close=True)
+            conn = pg_pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+    return conn
+
+def dbRelease(conn, close=False):
+    '''
+    Return a connection to the pool, discarding whatever transaction it left open
+    '''
+    if _pool is None:
+        conn.close()
+        return
+
+    if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            close = True
+    _last_used[id(conn)] = time.monotonic()
+    _pool.putconn(conn, close=close or bool(conn.closed))
+    _pool_slots.release()
+
+@contextmanager
+def dbCheckout(timeout=DB_POOL_CHECKOUT_TIMEOUT):
+    '''
+    Per-request connection: with dbCheckout() as (cur, conn): ...
+    - Commits when the block finishes, rolls back if it raises
+    '''
+    conn = dbAcquire(timeout)
+    cur = conn.cursor()
+    try:
+        yield cur, conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        dbRelease(conn)
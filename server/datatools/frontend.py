@@ -1,52 +1,235 @@
 import os 
-import pickle
 import pandas as pd
 import json
 from datatools.constant import *
+from datatools.assets import *
+from datatools.aggregate import *
+
+###################### SETUP ######################
+# Response formats of dfResponse, picked by ?format= or the Accept header [records is what the client reads by default]
+RESPONSE_FORMATS = {
+    'records': 'application/json',  # [{column: value, ...}, ...]
+    'columnar': 'application/vnd.columnar+json',  # {column: [values], ...}, one array per field
+    'arrow': 'application/vnd.apache.arrow.stream',  # Apache Arrow IPC stream [needs pyarrow]
+}
+LTTB_PRESELECT = 4  # dbGetRangeLTTB buckets per returned point, each sends its lowest and highest close to dfLTTB
 
 ###################### FRONT-END RELATED FUNCTION ######################
-def jsonAssets(pickle_dir='tradable_assets.pkl'):
-    global DIR_DATA, DIR_SUB_DATA
-    pickle_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, pickle_dir)
-    with open(pickle_file_path, 'rb') as f:
-        tradable_assets = pickle.load(f)
-    
-    # Format into JSON
-    json_asset = {}
-    for asset in tradable_assets:
-        symbol = asset['symbol']
-        exchange = asset['exchange']
-        if exchange == 'OTC':
-            continue
-        
-        # Format in our dictionary
-        if exchange not in json_asset:
-            json_asset[exchange] = []
-        json_asset[exchange].append(symbol)
-    
-    return json_asset   
+def jsonAssets(pickle_dir=ASSET_PICKLE):
+    '''
+    exchange -> symbols map [OTC excluded], served from the registry's memory until the pickle changes
+    '''
+    return assetRegistry(pickle_dir).grouped(exchange_skip=ASSET_EXCHANGE_SKIP)
 
 def jsonDF(df):
     json_str = df.to_json(orient='records')
     json_obj = json.loads(json_str)
     return json_obj
 
+def dfSerialize(df, response_format='records'):
+    '''
+    df -> (bytes, mimetype) in a single encoding pass, no Python object per value on the way
+    - records / columnar: pandas' C JSON encoder, dates as epoch milliseconds like jsonDF
+    - arrow: IPC stream, falls back to records when pyarrow isn't installed
+    '''
+    df = dfCoerceDecimals(df)
+    if response_format == 'arrow':
+        try:
+            import pyarrow as pa
+        except ImportError:
+            response_format = 'records'
+        else:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return sink.getvalue().to_pybytes(), RESPONSE_FORMATS['arrow']
+
+    if response_format == 'columnar':
+        fields = [f"{json.dumps(str(column))}:{df[column].to_json(orient='records')}" for column in df.columns]
+        return f"{{{','.join(fields)}}}".encode(), RESPONSE_FORMATS['columnar']
+
+    return df.to_json(orient='records').encode(), RESPONSE_FORMATS['records']
+
+def dfResponse(df):
+    '''
+    Flask response of df in the format the request asks for
+    '''
+    from flask import request, Response
+
+    response_format = request.args.get('format')
+    if response_format not in RESPONSE_FORMATS:
+        mimetype = request.accept_mimetypes.best_match(list(RESPONSE_FORMATS.values()), default=RESPONSE_FORMATS['records'])
+        response_format = next(name for name, value in RESPONSE_FORMATS.items() if value == mimetype)
+    body, mimetype = dfSerialize(df, response_format)
+    return Response(body, mimetype=mimetype)
+
+def requestRangeArgs(args, max_rows=None):
+    '''
+    start / end / after / before [ISO dates or epoch milliseconds, as the JSON timestamps come], limit / points [ints]
+    - Raises ValueError on a malformed value [NaT included], limit and points are capped at max_rows
+    '''
+    range_args = {}
+    for name in ['start', 'end', 'after', 'before']:
+        value = args.get(name)
+        if value:
+            range_args[name] = pd.to_datetime(int(value), unit='ms') if value.isdigit() else pd.to_datetime(value)
+            if pd.isna(range_args[name]):
+                raise ValueError(f"{name} is not a date")
+            if range_args[name].tzinfo is not None:
+                range_args[name] = range_args[name].tz_convert('UTC').tz_localize(None)  # Stored as naive UTC
+            range_args[name] = range_args[name].to_pydatetime()
+    for name in ['limit', 'points']:
+        value = args.get(name)
+        if value:
+            value = int(value)
+            if value < 1:
+                raise ValueError(f"{name} must be positive")
+            range_args[name] = min(value, max_rows) if max_rows else value
+    if 'after' in range_args and 'before' in range_args:
+        raise ValueError("Use either after or before")
+    return range_args
+
 ###################### SPECIFIC DATABASE FUNCTION ######################
 ##### DB MINERVINI FUNCTIONS #####
-def dbGetDataWhereDefault(cur, conn, table, where, datafetch="*"):
+def dbGetDataWhereDefault(cur, conn, table, where, datafetch="*", params=None, timeframe=None):
     '''
     Could be slightly faster compared to: pd.read_sql_query(sql_query, conn)
     - With lesser readability
+    - Values coming from a request go in params [%s placeholders in where], never into where itself
+    - timeframe reads the weekly / monthly bars aggregated from table
     '''
-    sql_query = f"SELECT {datafetch} FROM {table} WHERE {where}"
-    cur.execute(sql_query)
+    sql_query = f"SELECT {datafetch} FROM {dbTimeframeTable(table, timeframe)} WHERE {where}"
+    cur.execute(sql_query, params)
     column_names = [desc[0] for desc in cur.description]
     data = cur.fetchall()
     df = pd.DataFrame(data, columns=column_names)
 
     return df
 
+##### DB CHART FUNCTIONS #####
+def dbRangeWhere(symbol, start=None, end=None, after=None, before=None):
+    where, params = ["symbol = %s"], [symbol]
+    for column_filter, value in [("timestamp >= %s", start), ("timestamp <= %s", end), ("timestamp > %s", after), ("timestamp < %s", before)]:
+        if value is not None:
+            where.append(column_filter)
+            params.append(value)
+    return " AND ".join(where), params
+
+def dbGetRange(cur, conn, table, symbol, start=None, end=None, after=None, before=None, limit=None, datafetch="*", timeframe=None):
+    '''
+    Rows of symbol within [start, end], oldest first
+    - Keyset pages: after = last timestamp of the previous page [scrolling forward], before = first one [scrolling back]
+    - Every page is one (symbol, timestamp) index range of limit rows, as cheap deep in the history as at its start
+    '''
+    where, params = dbRangeWhere(symbol, start, end, after, before)
+    order = "DESC" if before is not None else "ASC"
+    where += f" ORDER BY timestamp {order}"
+    if limit is not None:
+        where += " LIMIT %s"
+        params.append(limit)
+    df = dbGetDataWhereDefault(cur, conn, table, where, datafetch, params=tuple(params), timeframe=timeframe)
+    if order == "DESC":
+        df = df.iloc[::-1].reset_index(drop=True)
+    return df
+
+def dbGetRangeOHLC(cur, conn, table, symbol, points, start=None, end=None, timeframe=None):
+    '''
+    Range of symbol downsampled to at most points OHLCV bars
+    - Rows are split into points equal buckets [ntile], each keeps its first open, highest high, lowest low, last close, summed volume
+    - Extremes survive the downsampling, so a zoomed out chart still shows every spike
+    '''
+    where, params = dbRangeWhere(symbol, start, end)
+    sql_query = f"""
+        SELECT MIN(timestamp) AS timestamp,
+               (array_agg(open ORDER BY timestamp))[1] AS open, MAX(high) AS high, MIN(low) AS low,
+               (array_agg(close ORDER BY timestamp DESC))[1] AS close, SUM(volume) AS volume, COUNT(*) AS bars
+        FROM (
+            SELECT timestamp, open, high, low, close, volume, ntile(%s) OVER (ORDER BY timestamp) AS bucket
+            FROM {dbTimeframeTable(table, timeframe)}
+            WHERE {where}
+        ) b
+        GROUP BY bucket
+        ORDER BY bucket
+    """
+    cur.execute(sql_query, (points, *params))
+    column_names = [desc[0] for desc in cur.description]
+    return pd.DataFrame(cur.fetchall(), columns=column_names)
+
+def dbGetRangeLTTB(cur, conn, table, symbol, points, start=None, end=None, datafetch="timestamp, open, high, low, close, volume",
+                   timeframe=None, preselect=LTTB_PRESELECT):
+    '''
+    Range of symbol downsampled to points rows by dfLTTB, without loading the whole range
+    - Rows are split into points * preselect buckets [ntile], only each bucket's lowest and highest close and the range's ends are fetched
+    - LTTB's picks are mostly local extremes, so running it on these [MinMaxLTTB] keeps the shape and every spike of the range
+    - At most 2 * points * preselect + 2 rows come back instead of the whole range
+    - datafetch needs timestamp and close
+    '''
+    where, params = dbRangeWhere(symbol, start, end)
+    sql_query = f"""
+        SELECT {datafetch}
+        FROM (
+            SELECT *,
+                   row_number() OVER (PARTITION BY bucket ORDER BY close ASC NULLS LAST, timestamp) AS low_rank,
+                   row_number() OVER (PARTITION BY bucket ORDER BY close DESC NULLS LAST, timestamp) AS high_rank,
+                   row_number() OVER (ORDER BY timestamp) AS first_rank,
+                   row_number() OVER (ORDER BY timestamp DESC) AS last_rank
+            FROM (
+                SELECT {datafetch}, ntile(%s) OVER (ORDER BY timestamp) AS bucket
+                FROM {dbTimeframeTable(table, timeframe)}
+                WHERE {where}
+            ) b
+        ) r
+        WHERE low_rank = 1 OR high_rank = 1 OR first_rank = 1 OR last_rank = 1
+        ORDER BY timestamp
+    """
+    cur.execute(sql_query, (points * preselect, *params))
+    column_names = [desc[0] for desc in cur.description]
+    return dfLTTB(pd.DataFrame(cur.fetchall(), columns=column_names), points)
+
 ###################### SPECIFIC PANDAS FUNCTION ######################
+def dfLTTB(df, points, column='close', time_column='timestamp'):
+    '''
+    Largest-Triangle-Three-Buckets: keep the points rows of df [time ordered] that best preserve the shape of column
+    - First and last rows are always kept, every bucket in between keeps the row spanning the largest triangle with its neighbours
+    '''
+    import numpy as np
+
+    n = len(df)
+    if points >= n:
+        return df.reset_index(drop=True)
+    if points < 3:
+        return df.iloc[[0, n - 1][:points]].reset_index(drop=True)
+
+    x = pd.to_datetime(df[time_column]).to_numpy(dtype='datetime64[ns]').astype('int64').astype('float64')
+    y = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype='float64')
+    edges = np.linspace(1, n - 1, points - 1).astype('int64')  # points - 2 buckets over the rows between first and last
+
+    selected = np.empty(points, dtype='int64')
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for bucket in range(points - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        # The next bucket's average is the third corner [the last row for the last bucket]
+        next_lo, next_hi = hi, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_x, avg_y = x[next_lo:next_hi].mean(), np.nanmean(y[next_lo:next_hi])
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.nanargmax(area)) if not np.all(np.isnan(area)) else lo
+        selected[bucket + 1] = a
+    return df.iloc[selected].reset_index(drop=True)
+
+def dfCoerceDecimals(df):
+    '''
+    NUMERIC columns fetched through a plain cursor come back as Decimal objects, as float64 they serialize natively
+    '''
+    from decimal import Decimal
+
+    decimal_columns = [column for column in df.columns
+                       if df[column].dtype == object and isinstance(df[column].dropna().iloc[0] if df[column].notna().any() else None, Decimal)]
+    if not decimal_columns:
+        return df
+    return df.astype({column: 'float64' for column in decimal_columns})
+
 def dfGroupGetFirstDate(df):
     '''
     Given a mix of symbols with different time stamp, group them together. 
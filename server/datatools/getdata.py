@@ -1,73 +1,30 @@
 import os
-import pickle
+import json
 import pandas as pd
+from datetime import timedelta
 from datatools.constant import *
+from datatools.assets import *
+from datatools.aggregate import *
 
 ###################### ALPACA RELATED FUNCTIONS ######################
-def alpacaLoadTradableAssets(API_KEY, API_SECRET, skipCSVData=None, groupAssets=False, pickle_dir='tradable_assets.pkl', EXCHANGE_SKIP = ['OTC']):
-    import alpaca_trade_api as tradeapi
+def alpacaLoadTradableAssets(API_KEY, API_SECRET, skipCSVData=None, groupAssets=False, pickle_dir=ASSET_PICKLE, EXCHANGE_SKIP = ASSET_EXCHANGE_SKIP, refresh_ttl=None):
+    '''
+    Tradable assets from the shared registry [pickle fetched from Alpaca on first use]
+    - skipCSVData is removed as a set difference, the pickle itself keeps every tradable asset
+    - refresh_ttl re-lists assets from Alpaca when the pickle is older than it
+    '''
+    registry = assetRegistry(pickle_dir, API_KEY, API_SECRET)
+    if refresh_ttl is not None:
+        registry.refresh(API_KEY, API_SECRET, ttl=refresh_ttl)
 
-    global DIR_DATA, DIR_SUB_DATA
-
-    # Define path for the pickle file
-    os.makedirs(os.path.join(DIR_DATA, DIR_SUB_DATA), exist_ok=True)
-    pickle_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, pickle_dir)
-
-    try:
-        with open(pickle_file_path, 'rb') as f:
-            tradable_assets = pickle.load(f)
-        
-        # Used this to do a check and noticed alpaca tradable asset is not updated
-        if skipCSVData:
-            for asset in tradable_assets:
-                for skipping in skipCSVData:
-                    if asset['symbol'] == skipping[1] and asset['exchange'] == skipping[0]:
-                        print(f"Removing {skipping[0]}, {skipping[1]} from tradable assets")
-                        tradable_assets.remove(asset)
-                        break
-                
-    except FileNotFoundError:
-        # Initialize API
-        trade_api = tradeapi.REST(API_KEY, API_SECRET)
-
-        # If the file does not exist, fetch the assets and save them to a file
-        assets = trade_api.list_assets()
-
-        # Filter for assets that are tradable
-        tradable_assets = [asset for asset in assets if asset.tradable]
-
-        # Convert assets to dictionaries [to avoid pickle hit recursion limit]
-        tradable_assets = [asset._raw for asset in tradable_assets]
-
-        # Used this to do a check and noticed alpaca tradable asset is not updated
-        if skipCSVData:
-            for asset in tradable_assets:
-                for skipping in skipCSVData:
-                    if asset['symbol'] == skipping[1] and asset['exchange'] == skipping[0]:
-                        print(f"Removing {skipping[0]}, {skipping[1]} from tradable assets")
-                        tradable_assets.remove(asset)
-                        break
-
-        # Save tradable_assets to a file
-        with open(pickle_file_path, 'wb') as f:
-            pickle.dump(tradable_assets, f)
-    
     if groupAssets:
         # This is the earlier version of return where I grouped things based on exchange
-        grouped_assets = {}
-        for asset in tradable_assets:
-            symbol = asset['symbol']
-            exchange = asset['exchange']
-            
-            # Format in our dictionary
-            if exchange not in grouped_assets:
-                grouped_assets[exchange] = []
-            grouped_assets[exchange].append(symbol)
-
+        grouped_assets = registry.grouped(skipCSVData, exchange_skip=())
+        tradable_assets = registry.assets(skipCSVData)
         return grouped_assets, tradable_assets
     else:
         # If exchange is in EXCHANGE_SKIP, skip it
-        tradable_assets = [asset for asset in tradable_assets if asset['exchange'] not in EXCHANGE_SKIP]
+        tradable_assets = registry.assets(skipCSVData, exchange_skip=EXCHANGE_SKIP)
 
         # Get the exchanges and symbols
         exchanges = [asset['exchange'] for asset in tradable_assets]
@@ -121,25 +78,174 @@ def alpacaGetMaxRequestAssets(stock_client, crypto_client, exchangesymbols, star
             current_symbols = symbols[0:max_assets]
             print(f"Error: {e}\nReducing max_assets to {max_assets}")
 
+def alpacaFetchBars(stock_client, crypto_client, exchange, symbols, startdate, enddate, timeframe=None):
+    '''
+    Fetch daily bars for one or more symbols of the same asset class
+    - Clients only need get_stock_bars / get_crypto_bars, so a fake client can be passed in
+    '''
+    from alpaca.data.requests import CryptoBarsRequest
+    from alpaca.data.historical.crypto import CryptoFeed
+    from alpaca.data.requests import StockBarsRequest
+    from alpaca.data.timeframe import TimeFrame, TimeFrameUnit
+    from alpaca.data.enums import Adjustment, DataFeed
+
+    if timeframe is None:
+        timeframe = TimeFrame(1, TimeFrameUnit.Day)  # Define a daily timeframe
+
+    if exchange.lower() == "crypto":
+        request = CryptoBarsRequest(
+            symbol_or_symbols=symbols,
+            start=startdate,
+            end=enddate,
+            timeframe=timeframe,
+            limit=None,
+        )
+        return crypto_client.get_crypto_bars(request_params=request, feed=CryptoFeed.US)
+    else:
+        request = StockBarsRequest(
+            symbol_or_symbols=symbols,
+            start=startdate,
+            end=enddate,
+            timeframe=timeframe,
+            limit=None,
+            adjustment=Adjustment.ALL,
+            feed=DataFeed.SIP
+        )
+        return stock_client.get_stock_bars(request)
+
+##### ALPACA REQUEST SIZE PLANNING #####
+REQUEST_TOO_LARGE_MESSAGES = ['too large', 'too long', 'too many symbols', 'response size', 'incomplete read', 'connection broken']
+
+def isRequestTooLargeError(e):
+    '''
+    Errors a smaller request would avoid: 413 / 414, or a response cut off for its size
+    - Anything else [429, 5xx, network, auth] says nothing about the request size
+    '''
+    status_code = getattr(e, 'status_code', None)
+    if status_code is None and getattr(e, 'response', None) is not None:
+        status_code = getattr(e.response, 'status_code', None)
+    if status_code in (413, 414):
+        return True
+    message = str(e).lower()
+    return '413' in message or '414' in message or any(text in message for text in REQUEST_TOO_LARGE_MESSAGES)
+
+def alpacaLoadRequestLimits(json_dir='request_limits.json'):
+    '''
+    Last known good request sizes, keyed by asset class and timeframe
+    - e.g. {"stock:1Day": {"max_assets": 1000, "fail_rows": null, "max_rows": 250000}}
+    '''
+    json_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, json_dir)
+    try:
+        with open(json_file_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def alpacaSaveRequestLimits(limits, json_dir='request_limits.json'):
+    os.makedirs(os.path.join(DIR_DATA, DIR_SUB_DATA), exist_ok=True)
+    json_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, json_dir)
+    with open(json_file_path, 'w') as f:
+        json.dump(limits, f, indent=2)
+
+def alpacaRequestLimitKey(exchange, timeframe_key='1Day'):
+    asset_class = 'crypto' if exchange.lower() == 'crypto' else 'stock'
+    return f"{asset_class}:{timeframe_key}"
+
+def alpacaPlanMaxRequestAssets(stock_client, crypto_client, exchangesymbols, startdate, enddate, limits,
+                               timeframe_key='1Day', max_assets=1000, probe_days=5):
+    '''
+    Replacement of alpacaGetMaxRequestAssets that remembers what it learned
+    - Known limit: no request at all, only capped so the expected rows stay below the last failing response size
+    - Unknown limit: probe with only probe_days of bars, halving on too large errors, then store it
+    - Any other probe error leaves the limit unknown, it's probed again next run
+    '''
+    key = alpacaRequestLimitKey(exchangesymbols[0][0], timeframe_key)
+    expected_rows_per_symbol = max(1, (enddate - startdate).days)
+
+    if key not in limits:
+        # Cheap probe, a few days of bars is enough to find whether the symbol count is accepted
+        exchanges, symbols = zip(*exchangesymbols)
+        probe_start = enddate - timedelta(days=probe_days)
+        probe_assets = max_assets
+        probed = True
+        while probe_assets > 1:
+            try:
+                alpacaFetchBars(stock_client, crypto_client, exchanges[0], list(symbols[0:probe_assets]), probe_start, enddate)
+                break
+            except Exception as e:
+                if not isRequestTooLargeError(e):
+                    probed = False
+                    print(f"Error: {e}\nProbe of {key} inconclusive, keeping max_assets at {probe_assets}")
+                    break
+                probe_assets = probe_assets // 2
+                print(f"Error: {e}\nReducing max_assets to {probe_assets}")
+        if not probed:
+            return max(1, min(probe_assets, len(exchangesymbols)))
+        limits[key] = {'max_assets': probe_assets, 'fail_rows': None, 'max_rows': 0}
+        print(f"Probed {key}: {probe_assets} assets per request")
+
+    # Stay below the response size that failed last time
+    limit = limits[key]
+    planned = limit['max_assets']
+    if limit['fail_rows']:
+        planned = min(planned, max(1, limit['fail_rows'] // expected_rows_per_symbol - 1))
+
+    return max(1, min(planned, len(exchangesymbols), max_assets))
+
+def alpacaUpdateRequestLimit(limits, exchange, batch_size, rows=None, error=None, timeframe_key='1Day', max_assets=1000, expected_rows=None):
+    '''
+    Grow or shrink the stored limit from an observed request
+    - Success at the current limit grows it by a quarter, up to max_assets
+    - A too large error halves it and remembers the expected response size that failed
+    - Other errors [rate limits, timeouts, server errors] leave it unchanged
+    '''
+    key = alpacaRequestLimitKey(exchange, timeframe_key)
+    if error is not None and not isRequestTooLargeError(error):
+        print(f"{key}: request of {batch_size} assets failed ({error}), limit unchanged")
+        return limits.get(key, {}).get('max_assets', batch_size)
+    limit = limits.setdefault(key, {'max_assets': batch_size, 'fail_rows': None, 'max_rows': 0})
+
+    if error is not None:
+        limit['max_assets'] = max(1, min(limit['max_assets'], batch_size) // 2)
+        if expected_rows:
+            limit['fail_rows'] = expected_rows if not limit['fail_rows'] else min(limit['fail_rows'], expected_rows)
+        print(f"{key}: request of {batch_size} assets failed ({error}), limit now {limit['max_assets']}")
+    else:
+        if rows:
+            limit['max_rows'] = max(limit['max_rows'], rows)
+            # A bigger response went through, so the failing size is no longer trusted below it
+            if limit['fail_rows'] and rows >= limit['fail_rows']:
+                limit['fail_rows'] = None
+        if batch_size >= limit['max_assets']:
+            limit['max_assets'] = min(max_assets, batch_size + max(1, batch_size // 4))
+
+    return limit['max_assets']
+
 ###################### DATABASE FUNCTIONS ######################
 ##### DB GET HISTORY FUNCTIONS #####
 def dbGetUniqueLatestDates(cur, exchanges, symbols, print_dates=False):
+    '''
+    Latest stored timestamp of every (exchange, symbol) in one query
+    - The universe is sent as two arrays, unnested and joined against the (exchange, symbol, timestamp) unique index
+    - Each pair is then a single index lookup inside postgres instead of a round-trip from here
+    '''
     global DB_MAIN_TABLE
 
+    cur.execute(f"""
+        SELECT u.exchange, u.symbol, latest.timestamp
+        FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS u(exchange, symbol, ord)
+        LEFT JOIN LATERAL (
+            SELECT MAX(m.timestamp) AS timestamp
+            FROM {DB_MAIN_TABLE} m
+            WHERE m.exchange = u.exchange AND m.symbol = u.symbol
+        ) latest ON TRUE
+        ORDER BY u.ord
+    """, (list(exchanges), list(symbols)))
+
     newsymbols = []
     stock_latest_dates = {}
     crypto_latest_dates = {}  #  Split them out because the dates are different
-    for idx, symbol in enumerate(symbols):
-        exchange = exchanges[idx]
-        cur.execute(f"""
-            SELECT MAX(timestamp) 
-            FROM {DB_MAIN_TABLE} 
-            WHERE exchange = %s AND symbol = %s
-        """, (exchange, symbol))
-        
-        # Fetch latest date for each symbol
-        result = cur.fetchone()
-        latest_date = result[0]
+    for exchange, symbol, latest_date in cur.fetchall():
         if latest_date is None:
             # Slot into brand symbols to create
             newsymbols.append((exchange, symbol))
@@ -181,11 +287,67 @@ def dbGetUniqueData(cur, conn, table, command="exchange, symbol", where=""):
 
     return unique_pairs
 
-def dbGetDataWhere(cur, conn, table, where, datafetch="*"):
-    sql_query = f"SELECT {datafetch} FROM {table} WHERE {where}"
-    df = pd.read_sql_query(sql_query, conn)
+def dbGetUniquePairs(cur, conn, table):
+    '''
+    SELECT DISTINCT exchange, symbol as a skip scan: one index probe per pair instead of reading every row
+    '''
+    cur.execute(f"""
+        WITH RECURSIVE pairs AS (
+            (SELECT exchange, symbol FROM {table} ORDER BY exchange, symbol LIMIT 1)
+            UNION ALL
+            SELECT n.exchange, n.symbol FROM pairs p
+            CROSS JOIN LATERAL (
+                SELECT exchange, symbol FROM {table}
+                WHERE (exchange, symbol) > (p.exchange, p.symbol)
+                ORDER BY exchange, symbol
+                LIMIT 1
+            ) n
+        )
+        SELECT exchange, symbol FROM pairs
+    """)
+    return cur.fetchall()
+
+def dbGetDataWhere(cur, conn, table, where, datafetch="*", params=None, timeframe=None):
+    # timeframe reads the weekly / monthly bars aggregated from table [see datatools/aggregate.py]
+    sql_query = f"SELECT {datafetch} FROM {dbTimeframeTable(table, timeframe)} WHERE {where}"
+    df = pd.read_sql_query(sql_query, conn, params=params)
     return df
 
+def dbStreamSymbolGroups(conn, table, where="TRUE", datafetch="*", params=None, itersize=DB_STREAM_ITERSIZE, timeframe=None):
+    '''
+    Yield (exchange, symbol, df) for every symbol from one server-side cursor over the table
+    - Rows come ordered by exchange, symbol, timestamp and are fetched itersize at a time
+    - Only one block plus the symbol it ends in are held in memory, a symbol split over blocks is carried to the next one
+    - The cursor lives in conn's transaction, which is rolled back when the scan ends
+    '''
+    table = dbTimeframeTable(table, timeframe)
+    sql_query = f"SELECT {datafetch} FROM {table} WHERE {where} ORDER BY exchange, symbol, timestamp"
+    cur = conn.cursor(name=f"stream_{table}_{os.getpid()}")
+    try:
+        cur.execute(sql_query, params)
+        columns, carry = None, None
+        while True:
+            rows = cur.fetchmany(itersize)
+            if not rows:
+                break
+            columns = columns or [desc[0] for desc in cur.description]
+            block = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            if carry is not None:
+                block = pd.concat([carry, block], ignore_index=True)
+
+            # The block's last symbol may go on in the next block
+            exchanges, symbols = block['exchange'].to_numpy(), block['symbol'].to_numpy()
+            carried = (exchanges == exchanges[-1]) & (symbols == symbols[-1])
+            carry = block[carried]
+            for (exchange, symbol), group in block[~carried].groupby(['exchange', 'symbol'], sort=False):
+                yield exchange, symbol, group.reset_index(drop=True)
+
+        if carry is not None and not carry.empty:
+            yield carry['exchange'].iat[0], carry['symbol'].iat[0], carry.reset_index(drop=True)
+    finally:
+        cur.close()
+        conn.rollback()
+
 ###################### GENERAL FUNCTIONS ######################
 def listChunks(lst, split_amount):
     """
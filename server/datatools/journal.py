@@ -0,0 +1,171 @@
+'''
+Durable ingestion journal kept in Postgres
+- One row per (job, exchange, symbol, unit) with its status, so any run can restart and skip finished work.
+- Units are claimed with FOR UPDATE SKIP LOCKED, so several workers can share a job without double work.
+'''
+
+from psycopg2.extras import execute_values
+from datetime import timedelta
+import threading
+import socket
+import os
+
+from datatools.constant import *
+from datatools.storedata import dbConnect
+
+###################### SETUP ######################
+JOURNAL_LEASE = timedelta(hours=1)  # A claimed unit not finished within this is handed out again
+JOURNAL_MAX_ATTEMPTS = 3  # Failed units are retried until they failed this many times
+
+# Pipeline stages share the journal connection [each thread with its own cursor], so statement + commit pairs are serialized
+JOURNAL_LOCK = threading.Lock()
+
+###################### JOURNAL FUNCTIONS ######################
+def dbInitializeJournal(table=DB_JOURNAL_TABLE):
+    '''
+    Journal gets its own connection, so marking units never commits half of a data write
+    '''
+    cur, conn = dbConnect()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            job TEXT NOT NULL,
+            exchange TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            unit TEXT NOT NULL,
+            range_start TIMESTAMP,
+            range_end TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_at TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            error TEXT,
+            PRIMARY KEY (job, exchange, symbol, unit)
+        )
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_status_idx ON {table} (job, status)")
+    conn.commit()
+    return cur, conn
+
+def journalWorkerName():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def journalReleaseDeadWorkers(cur, conn, job, table=DB_JOURNAL_TABLE):
+    '''
+    Hand back the claims of this host's workers that are no longer running [a crashed earlier run]
+    - Their leases would otherwise keep the units away from a rerun for JOURNAL_LEASE
+    - Returns the amount of units released
+    '''
+    host = socket.gethostname()
+    with JOURNAL_LOCK:
+        cur.execute(f"SELECT DISTINCT worker FROM {table} WHERE job = %s AND status = 'claimed' AND worker LIKE %s",
+                    (job, f"{host}:%"))
+        dead = [worker for (worker,) in cur.fetchall() if not _journalWorkerAlive(worker)]
+        if not dead:
+            conn.commit()
+            return 0
+        cur.execute(f"""
+            UPDATE {table}
+            SET status = 'pending', worker = NULL, claimed_at = NULL, updated_at = now()
+            WHERE job = %s AND status = 'claimed' AND worker = ANY(%s)
+        """, (job, dead))
+        released = cur.rowcount
+        conn.commit()
+    return released
+
+def _journalWorkerAlive(worker):
+    pid = worker.rpartition(':')[2]
+    if not pid.isdigit():
+        return True
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by another user
+    return True
+
+def journalAddUnits(cur, conn, job, units, table=DB_JOURNAL_TABLE):
+    '''
+    Register units = [(exchange, symbol, unit, range_start, range_end), ...]
+    - Already known units keep their status, so finished work stays finished
+    '''
+    if not units:
+        return
+    with JOURNAL_LOCK:
+        execute_values(cur, f"""
+            INSERT INTO {table} (job, exchange, symbol, unit, range_start, range_end)
+            VALUES %s
+            ON CONFLICT (job, exchange, symbol, unit) DO NOTHING
+        """, [(job, *unit) for unit in units])
+        conn.commit()
+
+def journalClaimUnits(cur, conn, job, worker, limit=100, exchangesymbols=None, lease=JOURNAL_LEASE, max_attempts=JOURNAL_MAX_ATTEMPTS, table=DB_JOURNAL_TABLE):
+    '''
+    Claim up to limit runnable units of a job for this worker
+    - Runnable = pending, failed with attempts left, or claimed by a worker whose lease ran out
+    - exchangesymbols optionally restricts the claim to those (exchange, symbol) pairs
+    - Returns [(exchange, symbol, unit, range_start, range_end), ...]
+    '''
+    restrict = ""
+    params = [job, lease, max_attempts]
+    if exchangesymbols is not None:
+        if not exchangesymbols:
+            return []
+        exchanges, symbols = zip(*exchangesymbols)
+        restrict = "AND (exchange, symbol) IN (SELECT * FROM unnest(%s::text[], %s::text[]))"
+        params += [list(exchanges), list(symbols)]
+    params += [limit, worker]
+
+    with JOURNAL_LOCK:
+        cur.execute(f"""
+            WITH runnable AS (
+                SELECT job, exchange, symbol, unit
+                FROM {table}
+                WHERE job = %s
+                  AND (status = 'pending'
+                       OR (status = 'claimed' AND claimed_at < now() - %s)
+                       OR (status = 'failed' AND attempts < %s))
+                  {restrict}
+                ORDER BY exchange, symbol, unit
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE {table} j
+            SET status = 'claimed', worker = %s, attempts = j.attempts + 1, claimed_at = now(), updated_at = now()
+            FROM runnable r
+            WHERE j.job = r.job AND j.exchange = r.exchange AND j.symbol = r.symbol AND j.unit = r.unit
+            RETURNING j.exchange, j.symbol, j.unit, j.range_start, j.range_end
+        """, params)
+        claimed = cur.fetchall()
+        conn.commit()
+    return sorted(claimed, key=lambda row: (row[0], row[1], row[2]))
+
+def journalMarkDone(cur, conn, job, units, table=DB_JOURNAL_TABLE):
+    '''
+    units = [(exchange, symbol, unit), ...] finished and durable
+    '''
+    _journalSetStatus(cur, conn, job, units, 'done', None, table)
+
+def journalMarkFailed(cur, conn, job, units, error, table=DB_JOURNAL_TABLE):
+    _journalSetStatus(cur, conn, job, units, 'failed', str(error), table)
+
+def _journalSetStatus(cur, conn, job, units, status, error, table):
+    if not units:
+        return
+    exchanges, symbols, unit_keys = zip(*[unit[:3] for unit in units])
+    with JOURNAL_LOCK:
+        cur.execute(f"""
+            UPDATE {table} j
+            SET status = %s, error = %s, updated_at = now()
+            FROM unnest(%s::text[], %s::text[], %s::text[]) AS u(exchange, symbol, unit)
+            WHERE j.job = %s AND j.exchange = u.exchange AND j.symbol = u.symbol AND j.unit = u.unit
+        """, (status, error, list(exchanges), list(symbols), list(unit_keys), job))
+        conn.commit()
+
+def journalSummary(cur, job, table=DB_JOURNAL_TABLE):
+    with JOURNAL_LOCK:
+        cur.execute(f"SELECT status, COUNT(*) FROM {table} WHERE job = %s GROUP BY status", (job,))
+        return dict(cur.fetchall())
@@ -0,0 +1,263 @@
+'''
+Manifest of the per-symbol CSV files, kept in a small SQLite catalog next to them
+- Per file: last timestamp, row count, byte size, crc32 checksum and whether its rows are time ordered
+- Appends extend the checksum incrementally, so keeping it current never re-reads a file
+- A fresh entry [byte size matches the file] answers freshness checks without opening the data file
+'''
+
+from datetime import datetime
+import threading
+import sqlite3
+import zlib
+import os
+
+from datatools.constant import *
+
+###################### SETUP ######################
+MANIFEST_FILE = 'manifest.sqlite'  # Under DIR_DATA/DIR_SUB_DATA
+MANIFEST_TAIL_BLOCK = 4096  # Bytes read at a time when looking for the last line
+
+_manifest_conn = None
+_manifest_lock = threading.Lock()  # Archive writes may come from a pipeline thread
+
+###################### CATALOG FUNCTIONS ######################
+def manifestConnect(manifest_file=MANIFEST_FILE):
+    global _manifest_conn
+    if _manifest_conn is None:
+        os.makedirs(os.path.join(DIR_DATA, DIR_SUB_DATA), exist_ok=True)
+        _manifest_conn = sqlite3.connect(os.path.join(DIR_DATA, DIR_SUB_DATA, manifest_file), check_same_thread=False)
+        _manifest_conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                last_timestamp TEXT,
+                row_count INTEGER NOT NULL,
+                byte_size INTEGER NOT NULL,
+                checksum INTEGER NOT NULL,
+                updated_at TEXT NOT NULL,
+                sorted INTEGER
+            )
+        """)
+        # Catalogs created before the sorted flag, their entries stay unknown [NULL] until the next scan
+        columns = [row[1] for row in _manifest_conn.execute("PRAGMA table_info(files)")]
+        if 'sorted' not in columns:
+            _manifest_conn.execute("ALTER TABLE files ADD COLUMN sorted INTEGER")
+        _manifest_conn.commit()
+    return _manifest_conn
+
+def _manifestKey(csv_file_path):
+    # Paths are stored relative to the data directory, so the tree can be moved
+    return os.path.relpath(os.path.abspath(csv_file_path), os.path.abspath(os.path.join(DIR_DATA, DIR_SUB_DATA)))
+
+def manifestPut(csv_file_path, last_timestamp, row_count, byte_size, checksum, is_sorted=None):
+    '''
+    is_sorted: True / False when the rows are known [not] to be in time order, None when unknown
+    '''
+    with _manifest_lock:
+        conn = manifestConnect()
+        conn.execute("""
+            INSERT INTO files (path, last_timestamp, row_count, byte_size, checksum, updated_at, sorted)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                last_timestamp = excluded.last_timestamp, row_count = excluded.row_count,
+                byte_size = excluded.byte_size, checksum = excluded.checksum, updated_at = excluded.updated_at,
+                sorted = excluded.sorted
+        """, (_manifestKey(csv_file_path), last_timestamp, row_count, byte_size, checksum, datetime.utcnow().isoformat(),
+              None if is_sorted is None else int(is_sorted)))
+        conn.commit()
+
+def manifestRemove(csv_file_path):
+    with _manifest_lock:
+        conn = manifestConnect()
+        conn.execute("DELETE FROM files WHERE path = ?", (_manifestKey(csv_file_path),))
+        conn.commit()
+
+def manifestGet(csv_file_path, check_fresh=True):
+    '''
+    Entry of a file as a dict, None if unknown
+    - check_fresh compares the stored byte size with a stat of the file [no read], stale entries return None
+    '''
+    with _manifest_lock:
+        row = manifestConnect().execute(
+            "SELECT last_timestamp, row_count, byte_size, checksum, updated_at, sorted FROM files WHERE path = ?",
+            (_manifestKey(csv_file_path),)).fetchone()
+    if row is None:
+        return None
+
+    entry = dict(zip(['last_timestamp', 'row_count', 'byte_size', 'checksum', 'updated_at', 'sorted'], row))
+    entry['sorted'] = None if entry['sorted'] is None else bool(entry['sorted'])
+    if check_fresh:
+        try:
+            if os.path.getsize(csv_file_path) != entry['byte_size']:
+                return None
+        except FileNotFoundError:
+            return None
+    return entry
+
+def manifestRecordAppend(csv_file_path, appended_bytes, appended_rows, last_timestamp, size_before,
+                         first_timestamp=None, appended_sorted=None):
+    '''
+    Extend an entry after appending appended_bytes to a file that was size_before bytes long
+    - The crc32 carries on from the stored value, so nothing is re-read
+    - The file stays sorted if it was, the appended rows are [appended_sorted] and start no earlier than its last timestamp
+    - An unknown or out-of-date entry falls back to a scan of the file
+    '''
+    entry = manifestGet(csv_file_path, check_fresh=False)
+    if entry is None or entry['byte_size'] != size_before:
+        return manifestScanFile(csv_file_path)
+
+    is_sorted = entry['sorted']
+    if is_sorted and appended_rows:
+        is_sorted = bool(appended_sorted) and first_timestamp is not None and _timestampNotBefore(first_timestamp, entry['last_timestamp'])
+    manifestPut(csv_file_path, str(last_timestamp) if appended_rows else entry['last_timestamp'],
+                entry['row_count'] + appended_rows,
+                size_before + len(appended_bytes),
+                zlib.crc32(appended_bytes, entry['checksum']),
+                is_sorted)
+
+def manifestRecordTruncate(csv_file_path, removed_bytes, removed_rows, last_timestamp, size_before):
+    '''
+    Shrink an entry after the last removed_bytes of a file that was size_before bytes long were truncated
+    - The crc32 is rolled back over the removed bytes only, the kept part is never re-read
+    - An unknown or out-of-date entry falls back to a scan of the file
+    '''
+    entry = manifestGet(csv_file_path, check_fresh=False)
+    if entry is None or entry['byte_size'] != size_before:
+        return manifestScanFile(csv_file_path)
+
+    manifestPut(csv_file_path, last_timestamp,
+                max(0, entry['row_count'] - removed_rows),
+                size_before - len(removed_bytes),
+                crc32Unappend(entry['checksum'], removed_bytes),
+                entry['sorted'])  # Cutting the end off keeps the order of what's left
+
+def _timestampNotBefore(timestamp, stored_timestamp):
+    # stored_timestamp is a manifest string, None for a file without rows
+    if stored_timestamp is None:
+        return True
+    import pandas as pd
+    try:
+        return pd.Timestamp(timestamp) >= pd.Timestamp(stored_timestamp)
+    except (TypeError, ValueError):
+        return False  # Unparseable or naive against aware, can't tell
+
+##### CRC32 ROLLBACK #####
+_crc32_table = None
+_crc32_reverse = None
+
+def crc32Unappend(checksum, removed_bytes):
+    '''
+    zlib.crc32 of data given zlib.crc32 of data + removed_bytes, by running the register backward
+    - Each crc32 table entry has a distinct top byte, so one table step can be undone per byte
+    '''
+    global _crc32_table, _crc32_reverse
+    if _crc32_table is None:
+        table = []
+        for idx in range(256):
+            crc = idx
+            for _ in range(8):
+                crc = (crc >> 1) ^ 0xEDB88320 if crc & 1 else crc >> 1
+            table.append(crc)
+        _crc32_table, _crc32_reverse = table, {crc >> 24: idx for idx, crc in enumerate(table)}
+
+    register = checksum ^ 0xFFFFFFFF
+    for byte in reversed(removed_bytes):
+        idx = _crc32_reverse[register >> 24]
+        register = (((register ^ _crc32_table[idx]) << 8) & 0xFFFFFFFF) | (idx ^ byte)
+    return register ^ 0xFFFFFFFF
+
+###################### FILE SCANNING FUNCTIONS ######################
+def csvTailLines(csv_file_path, lines=1):
+    '''
+    Last non-empty lines of a file, read backward from the end in blocks
+    '''
+    with open(csv_file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.strip(b'\r\n').count(b'\n') < lines:
+            step = min(MANIFEST_TAIL_BLOCK, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    tail = [line for line in data.decode().splitlines() if line.strip()]
+    return tail[-lines:]
+
+def csvHeader(csv_file_path):
+    with open(csv_file_path, 'r') as f:
+        return f.readline().rstrip('\r\n').split(',')
+
+def manifestScanFile(csv_file_path, date_column_name="timestamp"):
+    '''
+    (Re)build one entry: last timestamp from the tail, counts and crc32 from a raw byte pass [no CSV parsing]
+    '''
+    if not os.path.exists(csv_file_path):
+        manifestRemove(csv_file_path)
+        return None
+
+    header = csvHeader(csv_file_path)
+    tail = csvTailLines(csv_file_path)
+    last_timestamp = None
+    if tail and tail[-1].split(',') != header:
+        last_timestamp = tail[-1].split(',')[header.index(date_column_name)]
+
+    # Single streaming pass for size, newline count and checksum
+    checksum, byte_size, newlines, last_byte = 0, 0, 0, b'\n'
+    with open(csv_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            checksum = zlib.crc32(block, checksum)
+            byte_size += len(block)
+            newlines += block.count(b'\n')
+            last_byte = block[-1:]
+    lines = newlines + (0 if last_byte == b'\n' else 1)
+    row_count = max(0, lines - 1)  # Header
+
+    manifestPut(csv_file_path, last_timestamp, row_count, byte_size, checksum, csvDateSorted(csv_file_path, date_column_name))
+    return manifestGet(csv_file_path)
+
+def csvDateSorted(csv_file_path, date_column_name="timestamp"):
+    '''
+    Whether the rows of a file are in time order, None if its dates can't be parsed
+    - Reads the date column only, a scan is the one place the order has to be found out rather than carried over
+    '''
+    import pandas as pd
+    try:
+        dates = pd.to_datetime(pd.read_csv(csv_file_path, usecols=[date_column_name])[date_column_name], utc=True, format='ISO8601')
+    except (ValueError, KeyError, pd.errors.EmptyDataError):
+        return None
+    return bool(dates.is_monotonic_increasing)
+
+def manifestGetLatestDate(csv_file_path, csv_date_format='%Y-%m-%d %H:%M:%S%z'):
+    '''
+    Latest date of a file from its manifest entry, scanning it only when the entry is missing or stale
+    '''
+    if not os.path.exists(csv_file_path):
+        return None
+    entry = manifestGet(csv_file_path) or manifestScanFile(csv_file_path)
+    if entry is None or entry['last_timestamp'] is None:
+        return None
+    return datetime.strptime(entry['last_timestamp'], csv_date_format)
+
+def manifestRebuild(csv_root=None):
+    '''
+    Recover the manifest of a whole CSV tree [csv_root/<exchange>/<symbol>.csv]
+    '''
+    if csv_root is None:
+        csv_root = os.path.join(DIR_DATA, DIR_SUB_DATA)
+
+    # Entries of files that no longer exist go too
+    with _manifest_lock:
+        conn = manifestConnect()
+        conn.execute("DELETE FROM files")
+        conn.commit()
+
+    scanned = 0
+    for exchange in sorted(os.listdir(csv_root)):
+        exchange_dir = os.path.join(csv_root, exchange)
+        if not os.path.isdir(exchange_dir):
+            continue
+        for csv_name in sorted(os.listdir(exchange_dir)):
+            if csv_name.endswith('.csv'):
+                manifestScanFile(os.path.join(exchange_dir, csv_name))
+                scanned += 1
+    print(f"Manifest rebuilt for {scanned} files")
+    return scanned
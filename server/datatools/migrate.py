@@ -0,0 +1,191 @@
+'''
+Online migration of a NUMERIC bars table to the compact, partitioned layout
+- A trigger mirrors inserts / updates / deletes on the old table into the new one while it's being filled
+- Existing rows are copied in (exchange, symbol, timestamp) order, one committed batch at a time, so writers are never blocked for long
+- A rerun resumes after the last copied key, the swap renames both tables in one short transaction
+'''
+
+import time
+
+from datatools.constant import *
+from datatools.storedata import dbConnect, dbCommit, dbCreateCompactTable
+from datatools.dbpool import dbRelease
+
+###################### SETUP ######################
+MIGRATE_BATCH_ROWS = 200000  # Rows copied and committed per batch
+MIGRATE_PAUSE = 0.1  # Seconds between batches, leaves room for other writers
+
+# Type of the extra NUMERIC columns [backtest tables] in the compact layout
+MIGRATE_INT_COLUMNS = ['trade_count']
+
+###################### MIGRATION FUNCTIONS ######################
+def dbMigrateColumns(cur, table):
+    '''
+    [(column, data_type), ...] of a table in column order
+    '''
+    cur.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_name = %s ORDER BY ordinal_position
+    """, (table,))
+    return cur.fetchall()
+
+def dbMigratePrepare(cur, conn, table, new_table):
+    '''
+    Create new_table with the compact layout [plus the old table's extra columns] and the mirroring trigger
+    - Safe to call again, an existing new_table is kept as is
+    '''
+    cur.execute(f"SELECT EXISTS(SELECT FROM pg_tables WHERE tablename = '{new_table}')")
+    if not cur.fetchone()[0]:
+        dbCreateCompactTable(cur, new_table)
+
+        # Extra columns [e.g. backtest indicators] carry over with compact types
+        compact_columns = {column for column, data_type in dbMigrateColumns(cur, new_table)}
+        for column, data_type in dbMigrateColumns(cur, table):
+            if column in compact_columns:
+                continue
+            if data_type == 'numeric':
+                data_type = 'BIGINT' if column in MIGRATE_INT_COLUMNS else 'DOUBLE PRECISION'
+            cur.execute(f"ALTER TABLE {new_table} ADD COLUMN {column} {data_type}")
+
+    columns = [column for column, data_type in dbMigrateColumns(cur, table)]
+    cols = ", ".join(columns)
+    new_cols = ", ".join(f"NEW.{column}" for column in columns)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in ('exchange', 'symbol', 'timestamp'))
+
+    # Writes landing on the old table during the copy are replayed on the new one
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION {table}_mirror() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM {new_table}
+                WHERE exchange = OLD.exchange AND symbol = OLD.symbol AND timestamp = OLD.timestamp;
+                RETURN OLD;
+            END IF;
+            IF TG_OP = 'UPDATE' THEN
+                -- The key itself may have changed, the row copied under the old one goes
+                DELETE FROM {new_table}
+                WHERE exchange = OLD.exchange AND symbol = OLD.symbol AND timestamp = OLD.timestamp;
+                INSERT INTO {new_table} ({cols}) VALUES ({new_cols})
+                ON CONFLICT (exchange, symbol, timestamp) DO UPDATE SET {updates};
+                RETURN NEW;
+            END IF;
+            INSERT INTO {new_table} ({cols}) VALUES ({new_cols})
+            ON CONFLICT (exchange, symbol, timestamp) DO NOTHING;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute(f"DROP TRIGGER IF EXISTS {table}_mirror ON {table}")
+    cur.execute(f"""
+        CREATE TRIGGER {table}_mirror
+        AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_mirror()
+    """)
+    dbCommit(conn)
+    return columns
+
+def dbMigrateProgress(cur, new_table):
+    '''
+    Last copied key of a migration, kept in {new_table}_progress so a rerun resumes there
+    - Mirrored rows may already sit past it in new_table, so the table's own max key can't be used
+    '''
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {new_table}_progress (
+            id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            exchange TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL
+        )
+    """)
+    cur.execute(f"SELECT exchange, symbol, timestamp FROM {new_table}_progress")
+    return cur.fetchone()
+
+def dbMigrateCopy(cur, conn, table, new_table, columns, batch_rows=MIGRATE_BATCH_ROWS, pause=MIGRATE_PAUSE):
+    '''
+    Copy every row of table into new_table in key order, one committed batch at a time
+    '''
+    cols = ", ".join(columns)
+    last_key = dbMigrateProgress(cur, new_table)
+    dbCommit(conn)
+
+    copied, start = 0, time.perf_counter()
+    while True:
+        where = "" if last_key is None else "WHERE (exchange, symbol, timestamp) > (%s, %s, %s)"
+        cur.execute(f"""
+            WITH batch AS (
+                SELECT {cols} FROM {table}
+                {where}
+                ORDER BY exchange, symbol, timestamp
+                LIMIT %s
+            ), moved AS (
+                INSERT INTO {new_table} ({cols})
+                SELECT {cols} FROM batch
+                ON CONFLICT (exchange, symbol, timestamp) DO NOTHING
+            )
+            SELECT exchange, symbol, timestamp, (SELECT COUNT(*) FROM batch) FROM batch
+            ORDER BY exchange DESC, symbol DESC, timestamp DESC
+            LIMIT 1
+        """, (*(last_key or ()), batch_rows))
+        row = cur.fetchone()
+        if row is None:
+            dbCommit(conn)
+            break
+
+        # Progress moves in the same transaction as the batch itself
+        last_key, rows = row[:3], row[3]
+        cur.execute(f"""
+            INSERT INTO {new_table}_progress (id, exchange, symbol, timestamp) VALUES (1, %s, %s, %s)
+            ON CONFLICT (id) DO UPDATE SET exchange = excluded.exchange, symbol = excluded.symbol, timestamp = excluded.timestamp
+        """, last_key)
+        dbCommit(conn)
+
+        copied += rows
+        print(f"Migrated {copied} rows into {new_table} ({copied / (time.perf_counter() - start):,.0f} rows/s), at {last_key[0]}, {last_key[1]}")
+        if rows < batch_rows:
+            break
+        time.sleep(pause)
+
+    return copied
+
+def dbMigrateSwap(cur, conn, table, new_table, old_suffix='numeric'):
+    '''
+    Put new_table in place of table in one short transaction
+    - table is kept as {table}_{old_suffix} until dropped by hand
+    - Partitions are renamed to {table}_{year} / {table}_default, as dbEnsurePartitions expects
+    '''
+    cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+    cur.execute(f"DROP TRIGGER IF EXISTS {table}_mirror ON {table}")
+    cur.execute(f"DROP FUNCTION IF EXISTS {table}_mirror()")
+    cur.execute(f"ALTER TABLE {table} RENAME TO {table}_{old_suffix}")
+    cur.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+    cur.execute(f"ALTER INDEX IF EXISTS {new_table}_timestamp_brin RENAME TO {table}_timestamp_brin")
+
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s
+    """, (table,))
+    for (partition,) in cur.fetchall():
+        if partition.startswith(f"{new_table}_"):
+            cur.execute(f"ALTER TABLE {partition} RENAME TO {table}_{partition[len(new_table) + 1:]}")
+    cur.execute(f"DROP TABLE IF EXISTS {new_table}_progress")
+    dbCommit(conn)
+    print(f"Swapped {new_table} in as {table}, previous table kept as {table}_{old_suffix}")
+
+def dbMigrateCompact(table=DB_MAIN_TABLE, batch_rows=MIGRATE_BATCH_ROWS, swap=True):
+    '''
+    Full online migration of table to the compact layout
+    - Avoid deleting rows from table [history_modify] until it's swapped
+    '''
+    cur, conn = dbConnect()
+    new_table = f"{table}_compact"
+    try:
+        columns = dbMigratePrepare(cur, conn, table, new_table)
+        copied = dbMigrateCopy(cur, conn, table, new_table, columns, batch_rows)
+        print(f"Copied {copied} rows from {table} into {new_table}")
+        if swap:
+            dbMigrateSwap(cur, conn, table, new_table)
+    finally:
+        cur.close()
+        dbRelease(conn)
@@ -0,0 +1,161 @@
+'''
+Staged pipeline with bounded queues
+- Each stage runs on its own thread(s), so fetching, converting and writing overlap.
+- Queues are bounded, a slow stage blocks the ones before it instead of letting memory grow.
+'''
+
+import threading
+import queue
+import time
+
+###################### SETUP ######################
+PIPELINE_QUEUE_SIZE = 4  # Items allowed to wait between two stages
+
+_DONE = object()  # Sentinel pushed through the queues once the source is exhausted
+
+###################### PIPELINE ######################
+class PipelineStats:
+    '''
+    Per-stage counters, reported once the run is over
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.rows = 0
+        self.busy = 0.0  # Seconds spent inside the stage function
+        self.blocked = 0.0  # Seconds spent waiting on a full downstream queue [backpressure]
+        self.lock = threading.Lock()
+
+    def add(self, rows, busy, blocked):
+        with self.lock:
+            self.items += 1
+            self.rows += rows
+            self.busy += busy
+            self.blocked += blocked
+
+def pipelineRows(item):
+    # DataFrames count their rows, a list the sum of its pieces, a tuple its last element, anything else counts as one
+    if isinstance(item, list):
+        return sum(pipelineRows(piece) for piece in item)
+    if isinstance(item, tuple) and item:
+        item = item[-1]
+    if hasattr(item, 'shape'):
+        return len(item)
+    if isinstance(getattr(item, 'data', None), dict):
+        # Alpaca BarSet: symbol -> list of bars
+        return sum(len(bars) for bars in item.data.values())
+    return 1
+
+def pipelineRun(items, stages, maxsize=PIPELINE_QUEUE_SIZE, report=True):
+    '''
+    Push items through stages = [(name, fn, workers), ...]
+    - fn(item) returns the item handed to the next stage, None drops it
+    - An exception raised by a stage stops that stage and every stage before it [and the source],
+      the stages after it still finish the items already handed past it, then it's re-raised here
+    - Returns the list of PipelineStats, one per stage
+    '''
+    queues = [queue.Queue(maxsize=maxsize) for _ in range(len(stages) + 1)]
+    stats = [PipelineStats(name) for name, fn, workers in stages]
+    failed_stage = [-1]  # Highest stage that raised, it and everything upstream of it stop
+    errors = []
+    errors_lock = threading.Lock()
+
+    def halted(idx):
+        return failed_stage[0] >= idx
+
+    def put(q, item, idx):
+        # Blocking put that still notices stage idx [the consumer of q] halting
+        while not halted(idx):
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def runStage(idx, fn, remaining):
+        in_q, out_q = queues[idx], queues[idx + 1]
+        while not halted(idx):
+            try:
+                item = in_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                # Let sibling workers see it too, the last one forwards it downstream
+                put(in_q, _DONE, idx)
+                with remaining[1]:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        put(out_q, _DONE, idx + 1)
+                return
+
+            try:
+                start = time.perf_counter()
+                result = fn(item)
+                busy = time.perf_counter() - start
+            except Exception as e:
+                with errors_lock:
+                    errors.append(e)
+                    failed_stage[0] = max(failed_stage[0], idx)
+                return
+
+            start = time.perf_counter()
+            if result is not None and not put(out_q, result, idx + 1):
+                return
+            stats[idx].add(pipelineRows(result) if result is not None else 0, busy, time.perf_counter() - start)
+
+    # Start every stage
+    stage_threads = []
+    remainings = []
+    run_start = time.perf_counter()
+    for idx, (name, fn, workers) in enumerate(stages):
+        remaining = [workers, threading.Lock()]
+        remainings.append(remaining)
+        threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=runStage, args=(idx, fn, remaining), name=f"pipeline-{name}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        stage_threads.append(threads)
+
+    # Feed the source, then drain whatever falls out of the last stage
+    def drain():
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                return
+    drainer = threading.Thread(target=drain, name="pipeline-drain", daemon=True)
+    drainer.start()
+
+    for item in items:
+        if halted(0):
+            break
+        put(queues[0], item, 0)
+    put(queues[0], _DONE, 0)
+
+    # Stages are joined in order, a stage halted by an error never forwarded the end of its items,
+    # so it's sent on here and the stages after it finish what they hold
+    for idx, threads in enumerate(stage_threads):
+        for thread in threads:
+            thread.join()
+        if remainings[idx][0] != 0:
+            if idx + 1 == len(stages):
+                queues[-1].put(_DONE)
+            else:
+                put(queues[idx + 1], _DONE, idx + 1)
+    drainer.join()
+    elapsed = time.perf_counter() - run_start
+
+    if report:
+        pipelineReport(stats, elapsed)
+    if errors:
+        raise errors[0]
+
+    return stats
+
+def pipelineReport(stats, elapsed):
+    print(f"Pipeline finished in {elapsed:.1f}s")
+    for stat in stats:
+        rate = stat.rows / stat.busy if stat.busy else 0
+        print(f"  {stat.name:<10} items: {stat.items:>6}  rows: {stat.rows:>9}  "
+              f"busy: {stat.busy:>7.1f}s  blocked: {stat.blocked:>7.1f}s  throughput: {rate:,.0f} rows/s")
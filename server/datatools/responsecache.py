@@ -0,0 +1,215 @@
+'''
+Versioned response cache for the Flask API
+- Served data only changes when a batch script runs, those scripts bump a data version [a small file under DIR_DATA]
+- Responses are kept by (route, params, data version) in an in-process LRU, optionally backed by a shared on-disk tier
+- Every cached response carries an ETag, a client sending it back in If-None-Match gets a 304 without a body
+'''
+
+from collections import OrderedDict
+import functools
+import threading
+import hashlib
+import uuid
+import time
+import os
+
+from datatools.constant import *
+
+###################### SETUP ######################
+DATA_VERSION_FILE = 'data_version'  # Under DIR_DATA/DIR_SUB_DATA
+RESPONSE_CACHE_ENTRIES = 512
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 ** 2
+RESPONSE_CACHE_DIR = os.getenv('RESPONSE_CACHE_DIR')  # Shared disk tier [e.g. for several server processes], unset = memory only
+RESPONSE_CACHE_HEADERS = ['Accept']  # Request headers that change a response, part of the key
+
+###################### DATA VERSION ######################
+def dataVersionPath():
+    return os.path.join(DIR_DATA, DIR_SUB_DATA, DATA_VERSION_FILE)
+
+def dataVersion():
+    '''
+    Current data version, 0 before any script bumped it
+    '''
+    try:
+        with open(dataVersionPath()) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def dataVersionBump():
+    '''
+    Called by the ingestion / backtest scripts once their writes are committed, every cached response goes stale
+    - The new version is the clock in nanoseconds, not the old one + 1: two scripts bumping at once can't write the same value
+    '''
+    path = dataVersionPath()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    version = max(time.time_ns(), dataVersion() + 1)
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(str(version))
+    os.replace(temp_path, path)
+    return version
+
+###################### CACHE ######################
+class ResponseCache:
+    '''
+    key -> (body, mimetype, etag) for the current data version
+    - A changed version drops the memory tier at once, disk entries of older versions are removed as they're met
+    '''
+    def __init__(self, max_entries=RESPONSE_CACHE_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES, cache_dir=RESPONSE_CACHE_DIR):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.size = 0
+        self.version = None
+        self.version_mtime = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def currentVersion(self):
+        # One stat per request, the file is only read again when a script rewrote it
+        try:
+            mtime = os.stat(dataVersionPath()).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self.lock:
+            if mtime != self.version_mtime or self.version is None:
+                version = dataVersion()
+                if version != self.version:
+                    self.entries.clear()
+                    self.size = 0
+                self.version, self.version_mtime = version, mtime
+            return self.version
+
+    def digest(self, key):
+        return hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+
+    def diskPath(self, key, version):
+        return os.path.join(self.cache_dir, f"{version}-{self.digest(key)}.bin")
+
+    def get(self, key, version=None):
+        if version is None:
+            version = self.currentVersion()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self.diskGet(key, version)
+        if entry is not None:
+            self.memoryPut(key, entry, version)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, body, mimetype, version=None):
+        '''
+        version = the one read before the body was built, a body built while a script bumped it is returned but not kept
+        '''
+        if version is None:
+            version = self.currentVersion()
+        etag = f"{version}-{hashlib.blake2b(body, digest_size=12).hexdigest()}"
+        entry = (body, mimetype, etag)
+        if self.currentVersion() == version:
+            self.memoryPut(key, entry, version)
+            self.diskPut(key, version, entry)
+        return entry
+
+    def memoryPut(self, key, entry, version):
+        if len(entry[0]) > self.max_bytes:
+            return
+        with self.lock:
+            if version != self.version:
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self.entries[key] = entry
+            self.size += len(entry[0])
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[0])
+
+    ##### DISK TIER #####
+    def diskGet(self, key, version):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.diskPath(key, version), 'rb') as f:
+                header = f.readline().decode().rstrip('\n')
+                body = f.read()
+        except (FileNotFoundError, OSError):
+            return None
+        mimetype, _, etag = header.partition(' ')
+        return body, mimetype, etag
+
+    def diskPut(self, key, version, entry):
+        if not self.cache_dir:
+            return
+        body, mimetype, etag = entry
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.diskPrune(version)
+
+        # Write then rename, so another server process never reads a half written file
+        path = self.diskPath(key, version)
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(f"{mimetype} {etag}\n".encode())
+            f.write(body)
+        os.replace(temp_path, path)
+
+    def diskPrune(self, version):
+        # Entries of older versions can't be hit anymore
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.bin') and not name.startswith(f"{version}-"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+_response_cache = ResponseCache()
+
+###################### FLASK ######################
+def cachedResponse(view):
+    '''
+    Route decorator: serve the view's response from the cache until the data version changes
+    - Key = path, query params and the RESPONSE_CACHE_HEADERS, so every variant of a route is kept apart
+    - Only 200 responses are cached, a matching If-None-Match is answered with 304
+    '''
+    from flask import request, make_response
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))),
+               tuple(request.headers.get(header, '') for header in RESPONSE_CACHE_HEADERS))
+        # Read once before the view runs, its response belongs to this version even if a script bumps it meanwhile
+        version = _response_cache.currentVersion()
+        entry = _response_cache.get(key, version)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            entry = _response_cache.put(key, response.get_data(), response.mimetype, version)
+
+        body, mimetype, etag = entry
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(body)
+            response.mimetype = mimetype
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'  # Always revalidate, unchanged data costs a 304
+        response.headers['Vary'] = ', '.join(RESPONSE_CACHE_HEADERS)
+        return response
+
+    return wrapper
@@ -0,0 +1,196 @@
+'''
+Concurrent, rate limited fetch scheduler
+- Requests run on a thread pool, results are handed back on the calling thread.
+- Works with any fetch function, so a fake client with injected latency / 429s can stand in for Alpaca.
+'''
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import threading
+import random
+import time
+
+###################### SETUP ######################
+ALPACA_REQUESTS_PER_MINUTE = 200  # Alpaca free plan quota, unlimited plan allows 10000
+FETCH_WORKERS = 8
+FETCH_TIMEOUT = 120  # Seconds a single request may take before it's given up on
+FETCH_RETRIES = 3  # Retries of rate limited (429) requests
+FETCH_BACKOFF = 2  # Seconds to wait on the first rate limited retry, doubling each time
+
+###################### RATE LIMITING ######################
+class TokenBucket:
+    '''
+    Token bucket shared by all workers
+    - rate = tokens refilled per second, capacity = max burst
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        # Block until enough tokens are available
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def drain(self):
+        # Server told us we're over quota, so stop handing out the burst
+        with self.lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+def isRateLimitError(e):
+    # alpaca-py raises APIError with status_code, requests raises HTTPError with response
+    status_code = getattr(e, 'status_code', None)
+    if status_code is None and getattr(e, 'response', None) is not None:
+        status_code = getattr(e.response, 'status_code', None)
+    return status_code == 429 or '429' in str(e) or 'too many requests' in str(e).lower()
+
+###################### SCHEDULER ######################
+def fetchWithRetry(fetch_fn, job, bucket, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF, clock=None):
+    '''
+    Run a single job through the rate limiter, backing off on 429 responses
+    - clock[0] is set to the start time of the current attempt, waiting on the limiter doesn't count
+    '''
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        if clock is not None:
+            clock[0] = time.monotonic()
+        try:
+            return fetch_fn(job)
+        except Exception as e:
+            if not isRateLimitError(e) or attempt == retries:
+                raise
+            bucket.drain()
+            if clock is not None:
+                clock[0] = None  # Backing off isn't part of the request time
+            time.sleep(backoff * 2 ** attempt)
+
+def fetchConcurrent(jobs, fetch_fn, on_result, on_error=None, workers=FETCH_WORKERS,
+                    requests_per_minute=ALPACA_REQUESTS_PER_MINUTE, timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF, bucket=None):
+    '''
+    Fetch every job on a thread pool, rate limited to requests_per_minute
+    - on_result(job, result) and on_error(job, exception) run on the calling thread,
+      so DB cursors and CSV writes stay single threaded
+    - Jobs running longer than timeout are reported as TimeoutError and their late result is dropped
+    - bucket: a TokenBucket shared with other callers of the same API, else one for requests_per_minute
+    - Returns (succeeded, failed) counts
+    '''
+    bucket = bucket or TokenBucket(requests_per_minute / 60, capacity=max(1, workers))
+    jobs = iter(jobs)
+    started = {}  # future -> [start time of its current attempt], set from the worker
+    running = {}  # future -> job
+    succeeded, failed = 0, 0
+
+    def runJob(job, clock):
+        return fetchWithRetry(fetch_fn, job, bucket, retries=retries, backoff=backoff, clock=clock)
+
+    def report(job, e):
+        if on_error:
+            on_error(job, e)
+        else:
+            print(f"{job} error: {e}")
+
+    # Abandoned (timed out) requests keep their thread, so the pool gets a little headroom
+    executor = ThreadPoolExecutor(max_workers=workers * 2)
+    try:
+        exhausted = False
+        while running or not exhausted:
+            # Keep at most workers requests in flight, memory stays flat for any universe size
+            while not exhausted and len(running) < workers:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                clock = [None]
+                future = executor.submit(runJob, job, clock)
+                running[future] = job
+                started[future] = clock
+
+            if not running:
+                break
+
+            done, _ = wait(list(running), timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                started.pop(future, None)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    report(job, e)
+                    continue
+                succeeded += 1
+                on_result(job, result)
+
+            # Give up on requests that have gone past their timeout
+            now = time.monotonic()
+            for future in [f for f in running if started[f][0] is not None and now - started[f][0] > timeout]:
+                job = running.pop(future)
+                started.pop(future, None)
+                future.cancel()
+                failed += 1
+                report(job, TimeoutError(f"Request took longer than {timeout}s"))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return succeeded, failed
+
+###################### FAKE CLIENT ######################
+class FakeRateLimitError(Exception):
+    # Shaped like alpaca-py's APIError on a 429
+    status_code = 429
+
+    def __init__(self, message="429 Too Many Requests"):
+        super().__init__(message)
+
+class FakeClient:
+    '''
+    In-process stand-in for Alpaca, fetch(job) is a drop-in fetch_fn for fetchWithRetry / fetchConcurrent
+    - latency [+ random jitter] seconds per request, hang = {job: seconds} for requests that stall
+    - rate_limited = {job: n}: the first n requests of job answer 429
+    - quota_per_second: a server side quota, requests over it within any trailing second answer 429
+    - Every request is recorded in calls as (job, start time, outcome), outcome = 'ok', '429' or 'hang'
+    '''
+    def __init__(self, latency=0.0, jitter=0.0, rate_limited=None, quota_per_second=None, hang=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limited = dict(rate_limited or {})
+        self.quota_per_second = quota_per_second
+        self.hang = dict(hang or {})
+        self.random = random.Random(seed)
+        self.recent = deque()  # Start times within the last second, for the quota
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fetch(self, job):
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] >= 1:
+                self.recent.popleft()
+            over_quota = self.quota_per_second is not None and len(self.recent) >= self.quota_per_second
+            self.recent.append(now)
+            limited = self.rate_limited.get(job, 0) > 0
+            if limited:
+                self.rate_limited[job] -= 1
+            outcome = '429' if over_quota or limited else 'hang' if job in self.hang else 'ok'
+            self.calls.append((job, now, outcome))
+            delay = self.latency + self.random.uniform(0, self.jitter)
+
+        if outcome == '429':
+            raise FakeRateLimitError()
+        time.sleep(self.hang.get(job, delay))
+        return {'job': job, 'rows': 1}
+
+    def attempts(self, job):
+        return [call for call in self.calls if call[0] == job]
@@ -1,29 +1,42 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import psycopg2
+import zlib
+import io
 import os
 
 from datatools.constant import *
+from datatools.manifest import *
+from datatools.dbpool import *
+
+# Column layout of the main OHLC table, in insertion order
+OHLC_COLUMNS = ['exchange', 'symbol', 'timestamp', 'open', 'high', 'low', 'close', 'volume', 'trade_count', 'vwap']
+
+# First yearly partition of a compact table, earlier bars go to the default partition
+DB_PARTITION_START_YEAR = 2015
 
 ###################### DATABASE RELATED FUNCTIONS ######################
 ##### DB INITIALIATION FUNCTIONS #####
-def dbInitializeTable(table=DB_MAIN_TABLE):
-    # Connect to your postgres DB
-    conn = psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST
-    )
+def dbConnect():
+    # Take a connection from the shared pool [hand it back with dbRelease]
+    conn = dbAcquire()
 
     # Open a cursor to perform database operations
     cur = conn.cursor()
+    return cur, conn
+
+def dbInitializeTable(table=DB_MAIN_TABLE, schema=DB_SCHEMA):
+    cur, conn = dbConnect()
 
     cur.execute(f"SELECT EXISTS(SELECT FROM pg_tables WHERE tablename = '{table}')")
     exists = cur.fetchone()[0]
 
     # Execute a command: this creates a new table
-    if not exists:
+    if not exists and schema == 'compact':
+        print(f"No table found in Database, creating compact table {table}")
+        dbCreateCompactTable(cur, table)
+        conn.commit()
+    elif not exists:
         print(f"No table found in Database, creating table {table}")
         cur.execute(f"""
             CREATE TABLE {table} (
@@ -44,8 +57,62 @@ def dbInitializeTable(table=DB_MAIN_TABLE):
         # Make the changes to the database persistent
         conn.commit()
 
+    # A partitioned table always gets this and next year's partition ahead of time
+    if dbIsPartitioned(cur, table):
+        dbEnsurePartitions(cur, conn, table)
+
     return cur, conn
 
+##### DB SCHEMA FUNCTIONS #####
+def dbCreateCompactTable(cur, table):
+    '''
+    Compact layout of the bars table
+    - double precision / bigint columns [fixed width, arrive in pandas as floats instead of Decimal]
+    - Range partitioned by timestamp, one partition per year plus a default one
+    - btree on (exchange, symbol, timestamp) through the unique constraint, BRIN on timestamp for date range scans
+    '''
+    cur.execute(f"""
+        CREATE TABLE {table} (
+            exchange TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            open DOUBLE PRECISION,
+            high DOUBLE PRECISION,
+            low DOUBLE PRECISION,
+            close DOUBLE PRECISION,
+            volume DOUBLE PRECISION,
+            trade_count BIGINT,
+            vwap DOUBLE PRECISION,
+            UNIQUE(exchange, symbol, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+    """)
+    cur.execute(f"CREATE INDEX {table}_timestamp_brin ON {table} USING BRIN (timestamp)")
+    cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    dbEnsurePartitions(cur, None, table, start_year=DB_PARTITION_START_YEAR)
+
+def dbIsPartitioned(cur, table):
+    cur.execute("SELECT EXISTS(SELECT FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s)", (table,))
+    return cur.fetchone()[0]
+
+def dbEnsurePartitions(cur, conn, table, start_year=None, end_year=None):
+    '''
+    Create the missing yearly partitions {table}_{year} from start_year up to end_year [default: next year]
+    - Rows outside every yearly partition land in {table}_default
+    '''
+    if end_year is None:
+        end_year = datetime.utcnow().year + 1
+    if start_year is None:
+        start_year = end_year - 1
+
+    for year in range(start_year, end_year + 1):
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table}_{year} PARTITION OF {table}
+            FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')
+        """)
+
+    if conn is not None:
+        dbCommit(conn)
+
 ##### DB SLOTTING FUNCTIONS #####
 def dbSlotColumns(cur, conn, table, column_dict):
     # Iterate over your new columns
@@ -110,8 +177,109 @@ def dbSlotDataDynamic(df, cur, conn, table=DB_MAIN_TABLE):
         conn.rollback()  # If error, rollback to BEGIN
         raise ValueError(f"An error occurred: {e}")
 
+_db_integer_columns = {}  # table -> its integer typed columns, looked up once per table
+
+def dbIntegerColumns(cur, table):
+    '''
+    Integer typed columns of a table [e.g. trade_count of the compact layout]
+    '''
+    if table not in _db_integer_columns:
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = %s AND data_type IN ('smallint', 'integer', 'bigint')
+        """, (table,))
+        _db_integer_columns[table] = {column for (column,) in cur.fetchall()}
+    return _db_integer_columns[table]
+
+def dbSlotDataCopy(df, cur, conn, table=DB_MAIN_TABLE, columns=None, commit=True):
+    '''
+    Bulk version of dbSlotDataOHLC / dbSlotDataDynamic
+    - Streams the df into a temporary staging table with COPY, then merges it with one INSERT ... SELECT
+    - Pass commit=False to group many symbols into one transaction and call dbCommit when done
+    - Returns the amount of rows actually inserted (conflicts are skipped)
+    '''
+    if df.empty:
+        return 0
+
+    # There's a case where ticker 'True' got interpreted as Boolean
+    if df['symbol'].iloc[0] == True:
+        df['symbol'] = df['symbol'].astype(str)
+
+    # Only copy the requested columns, by default all of them
+    if columns is None:
+        columns = list(df.columns)
+    cols = ", ".join(columns)
+
+    # Staging table only holds the copied columns, one per column layout in this session
+    staging = f"{table}_staging_{zlib.crc32(cols.encode()):08x}"
+    cur.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {staging}
+        ON COMMIT DELETE ROWS
+        AS SELECT {cols} FROM {table} WITH NO DATA
+    """)
+    cur.execute(f"TRUNCATE {staging}")
+
+    # Float columns bound for integer ones [NaN turns counts into floats] would be written as "123.0", which COPY rejects
+    integer_columns = [column for column in columns if column in dbIntegerColumns(cur, table) and df[column].dtype.kind == 'f']
+    if integer_columns:
+        df = df.assign(**{column: df[column].round().astype('Int64') for column in integer_columns})
+
+    # Stream the rows in as CSV [empty fields are NULL]
+    buffer = io.StringIO()
+    df.to_csv(buffer, columns=columns, index=False, header=False, na_rep='')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '')", buffer)
+
+    # Merge everything into the target in one statement
+    cur.execute(f"""
+        INSERT INTO {table} ({cols})
+        SELECT {cols} FROM {staging}
+        ON CONFLICT (exchange, symbol, timestamp) DO NOTHING
+    """)
+    inserted = cur.rowcount
+
+    if commit:
+        dbCommit(conn)
+
+    return inserted
+
+def dbSlotDataCopyGroup(dfs, cur, conn, table=DB_MAIN_TABLE, columns=None, commit=True):
+    '''
+    Group commit of several symbol dfs through a single COPY
+    '''
+    dfs = [df for df in dfs if not df.empty]
+    if not dfs:
+        return 0
+    df = pd.concat(dfs, ignore_index=True)
+    return dbSlotDataCopy(df, cur, conn, table, columns=columns, commit=commit)
+
+def dbRemovePastDate(cur, conn, date, exchange, symbols, table=DB_MAIN_TABLE, commit=True):
+    '''
+    Delete rows at or past date for the given symbols of an exchange, in one statement
+    '''
+    # Timestamps are stored as naive UTC
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    cur.execute(f"""
+        DELETE FROM {table}
+        WHERE exchange = %s AND symbol = ANY(%s) AND timestamp >= %s
+    """, (exchange, list(symbols), date))
+    deleted = cur.rowcount
+
+    if commit:
+        dbCommit(conn)
+    return deleted
+
+def dbCommit(conn):
+    # Attempt to commit data
+    try:
+        conn.commit()
+    except Exception as e:
+        conn.rollback()  # If error, rollback to BEGIN
+        raise ValueError(f"An error occurred: {e}")
+
 ###################### DF FORMATTING RELATED FUNCTIONS ######################
-def dfInferColumnDBTypes(df):
+def dfInferColumnDBTypes(df, schema=DB_SCHEMA):
     # Define a mapping from pandas data types to SQL data types
     type_mapping = {
         'bool': 'BOOLEAN',
@@ -120,6 +288,8 @@ def dfInferColumnDBTypes(df):
         'datetime64[ns]': 'TIMESTAMP',
         'object': 'TEXT',
     }
+    if schema == 'compact':
+        type_mapping.update({'int64': 'BIGINT', 'float64': 'DOUBLE PRECISION'})
 
     # Get the pandas data type of each column
     pandas_types = df.dtypes
@@ -141,12 +311,25 @@ def dfGroupStoreCSVs(df):
     for exchange, exchange_df in grouped_exchange:
         grouped_symbol = exchange_df.groupby('symbol')
         for symbol, symbol_df in grouped_symbol:
+            os.makedirs(os.path.join(DIR_DATA, DIR_SUB_DATA, exchange), exist_ok=True)
             csv_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, exchange, f"{symbol.replace('/', '-')}.csv")
             print(f"Storing to CSV: {csv_file_path}")
             symbol_df = symbol_df.drop(columns=['exchange'])
-            symbol_df.to_csv(csv_file_path, mode='a', header=not os.path.exists(csv_file_path), index=False)
+            csvAppendFrame(symbol_df, csv_file_path)
             pass
 
+def csvAppendFrame(df, csv_file_path, date_column_name="timestamp"):
+    '''
+    Append a df to a CSV and extend its manifest entry with exactly the bytes written
+    '''
+    size_before = os.path.getsize(csv_file_path) if os.path.exists(csv_file_path) else 0
+    data = df.to_csv(header=(size_before == 0), index=False).encode()
+    with open(csv_file_path, 'ab') as f:
+        f.write(data)
+    dates = df[date_column_name]
+    manifestRecordAppend(csv_file_path, data, len(df), dates.max(), size_before,
+                         dates.iloc[0] if len(df) else None, dates.is_monotonic_increasing)
+
 ###################### CSV RELATED FUNCTIONS ######################
 def csvGetSkipSymbols(csv_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, "skip_symbols.csv")):
     import csv 
@@ -161,28 +344,93 @@ def csvAddSkipSymbols(data, csv_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA,
         writer = csv.writer(f)
         writer.writerows(data)
 
-def csvRemovePastDate(csv_file_path, date, date_column_name="timestamp", csv_date_format='%Y-%m-%d %H:%M:%S%z'):
-    # Remove all rows where column timestamp exceeded the date
-    df = pd.read_csv(csv_file_path)
-    df[date_column_name] = pd.to_datetime(df[date_column_name], format=csv_date_format)
-    df = df[df[date_column_name] < date]
-    df.to_csv(csv_file_path, index=False)
+def csvRemovePastDate(csv_file_path, date, date_column_name="timestamp", csv_date_format='%Y-%m-%d %H:%M:%S%z',
+                      inplace=True, cur=None, conn=None, exchange=None, symbol=None, table=DB_MAIN_TABLE):
+    '''
+    Remove all rows where column timestamp reached the date
+    - inplace: scan back from the end of the [time ordered] file and os.truncate at the cutoff
+    - Falls back to a full read / rewrite if the scanned tail turns out not to be sorted
+    - Given cur / conn / exchange / symbol, the matching rows are deleted from the table too [committed with the caller]
+    '''
+    removed = None
+    if inplace and os.path.exists(csv_file_path):
+        removed = csvTruncatePastDate(csv_file_path, date, date_column_name, csv_date_format)
+
+    if removed is None:
+        df = pd.read_csv(csv_file_path)
+        df[date_column_name] = pd.to_datetime(df[date_column_name], format=csv_date_format)
+        df = df[df[date_column_name] < date]
+        df.to_csv(csv_file_path, index=False)
+        manifestScanFile(csv_file_path, date_column_name)
     print(f"{os.path.basename(csv_file_path)}: Keeping only rows where {date_column_name} is below {date}")
 
-def csvGetLatestDate(csv_file_path, csv_date_format='%Y-%m-%d %H:%M:%S%z'):
-    # Check if the CSV file exists
-    if os.path.exists(csv_file_path):
-        # Load the existing data from CSV
-        existing_data = pd.read_csv(csv_file_path)
-        
-        # Determine the latest date in the existing data
-        latest_date_str = existing_data['timestamp'].max()
-        latest_date = datetime.strptime(latest_date_str, csv_date_format)
-        
-        return latest_date
-    else:
+    if cur is not None:
+        dbRemovePastDate(cur, conn, date, exchange, [symbol], table=table, commit=False)
+
+def csvTruncatePastDate(csv_file_path, date, date_column_name="timestamp", csv_date_format='%Y-%m-%d %H:%M:%S%z'):
+    '''
+    In-place version of csvRemovePastDate for time ordered files
+    - The manifest entry is rolled back over the cut off bytes, the kept part isn't re-read
+    - Only for files the manifest knows to be sorted: a tail scan can't see later rows above an earlier last row
+    - Returns the amount of rows cut off, None if the file or its tail isn't sorted [file left untouched]
+    '''
+    entry = manifestGet(csv_file_path) or manifestScanFile(csv_file_path, date_column_name)
+    if entry is None or not entry['sorted']:
         return None
 
+    with open(csv_file_path, 'rb+') as f:
+        header = f.readline()
+        date_idx = header.decode().rstrip('\r\n').split(',').index(date_column_name)
+
+        cut, removed, later_date, last_timestamp = None, 0, None, None
+        for line_start, line in csvReverseLines(f, len(header)):
+            if not line.strip():
+                continue
+            line_timestamp = line.split(b',')[date_idx].decode().strip()
+            line_date = datetime.strptime(line_timestamp, csv_date_format)
+            if later_date is not None and line_date > later_date:
+                return None  # Unsorted
+            if line_date < date:
+                last_timestamp = line_timestamp
+                break
+            cut, removed, later_date = line_start, removed + 1, line_date
+
+        if cut is not None:
+            size_before = f.seek(0, os.SEEK_END)
+            f.seek(cut)
+            removed_bytes = f.read()
+            f.truncate(cut)
+            manifestRecordTruncate(csv_file_path, removed_bytes, removed, last_timestamp, size_before)
+    return removed
+
+def csvReverseLines(f, start_offset=0, block_size=1 << 16):
+    '''
+    Yield (offset, line) of a binary file from its last line back to start_offset
+    '''
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    remainder = b''
+    while position > start_offset:
+        step = min(block_size, position - start_offset)
+        position -= step
+        f.seek(position)
+        data = f.read(step) + remainder
+
+        # The first piece may be a partial line, keep it for the next block
+        lines = data.split(b'\n')
+        remainder = lines[0]
+        line_end = position + len(data)
+        for line in reversed(lines[1:]):
+            line_start = line_end - len(line)
+            yield line_start, line
+            line_end = line_start - 1
+    if remainder:
+        yield start_offset, remainder
+
+def csvGetLatestDate(csv_file_path, csv_date_format='%Y-%m-%d %H:%M:%S%z'):
+    # Answered from the manifest, the file is only scanned if its entry is missing or stale
+    return manifestGetLatestDate(csv_file_path, csv_date_format)
+
 def csvGetLastWeekday():
     today = datetime.utcnow().date()
     if today.weekday() >= 5:  # If today is Saturday or Sunday
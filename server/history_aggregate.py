@@ -0,0 +1,26 @@
+'''
+Run this script to build [or catch up] the weekly / monthly bars of every symbol in the main table
+- history_batch.py keeps them current afterwards, a rerun only rebuilds each symbol's latest period
+'''
+
+from datatools.getdata import *
+from datatools.storedata import *
+from datatools.responsecache import *
+
+###################### SETUP ######################
+AGGREGATE_TIMEFRAMES = list(AGGREGATE_UNITS)
+
+if __name__ == "__main__":
+    cur, conn = dbInitializeTable()
+    exchange_symbol = dbGetUniquePairs(cur, conn, DB_MAIN_TABLE)
+    conn.rollback()
+
+    for timeframe in AGGREGATE_TIMEFRAMES:
+        written = dbRefreshAggregate(cur, conn, exchange_symbol, DB_MAIN_TABLE, timeframe)
+        print(f"{timeframe}: {written} periods written for {len(exchange_symbol)} symbols")
+
+    cur.close()
+    dbRelease(conn)
+
+    # Served responses are stale from here on [see datatools/responsecache.py]
+    dataVersionBump()
@@ -0,0 +1,10 @@
+'''
+Run this script to convert the per-symbol CSV tree into the partitioned parquet archive
+- One-shot: afterwards set ARCHIVE_MODE=parquet so the history scripts append to the archive instead.
+'''
+
+from datatools.archive import *
+
+if __name__ == "__main__":
+    ############################## CONVERT AND COMPACT ##############################
+    parquetConvertCSVTree()
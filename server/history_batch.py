@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import pandas as pd
 
+import threading
 import os
 
 from alpaca.data.historical.stock import StockHistoricalDataClient
@@ -19,9 +20,19 @@ from alpaca.data.requests import CryptoBarsRequest
 
 from datatools.getdata import *
 from datatools.storedata import *
+from datatools.responsecache import *
+from datatools.scheduler import *
+from datatools.pipeline import *
+from datatools.journal import *
+from datatools.archive import *
 
 ###################### SETUP ######################
 EXCHANGE_SKIP = ['OTC']  # All OTC data can't be fetched anyway, so just skip it
+TIMEFRAME_KEY = '1Day'  # Request limits are learned per asset class and timeframe
+DB_GROUP_COMMIT_ROWS = 50000  # New symbols are buffered and committed together once this many rows are pending
+PIPELINE_FETCH_WORKERS = 2  # Chunks fetched at once while earlier chunks are being written
+JOURNAL_JOB = 'batch'  # Journal job, symbols already brought up to date today are skipped on a rerun
+ASSET_REFRESH_TTL = timedelta(days=7)  # Tradable assets are re-listed from Alpaca once the pickle is older than this
 
 if __name__ == "__main__":
     ############################## LOAD VARIABLES ##############################
@@ -57,136 +68,215 @@ if __name__ == "__main__":
 
     # Get tradable assets based on relevant groupings and store them
     tupleSkipCSV = csvGetSkipSymbols()
-    exchanges, all_symbols = alpacaLoadTradableAssets(API_KEY, API_SECRET, skipCSVData=tupleSkipCSV, groupAssets=False)
+    exchanges, all_symbols = alpacaLoadTradableAssets(API_KEY, API_SECRET, skipCSVData=tupleSkipCSV, groupAssets=False, refresh_ttl=ASSET_REFRESH_TTL)
     new_exchangesymbols, stock_latestdates_exchangesymbols, crypto_latestdates_exchangesymbols = dbGetUniqueLatestDates(cur, exchanges, all_symbols)
 
-    ############################## STOCK & CRYPTO: LOOP AND STORE NEW DATA ##############################
-    for idx, exchangesymbols in enumerate(new_exchangesymbols):
-        exchange, symbol = exchangesymbols
-        
-        # Fetch the ohlc data
-        try:
-            if exchange.lower() == "crypto":
-                request = CryptoBarsRequest(
-                    symbol_or_symbols=symbol,
-                    start=START_DATE,
-                    end=END_DATE,
-                    timeframe=timeframe,
-                    limit=None,
-                )
-                bars = crypto_client.get_crypto_bars(request_params=request, feed=CryptoFeed.US)
-            else:
-                request = StockBarsRequest(
-                    symbol_or_symbols=symbol,
-                    start=START_DATE,
-                    end=END_DATE,
-                    timeframe=timeframe,
-                    limit=None,
-                    adjustment=Adjustment.ALL,
-                    feed=DataFeed.SIP
-                )
-                bars = stock_client.get_stock_bars(request)
-            print(f"{idx} {exchange} - {symbol} fetched")
-        except Exception as e:
-            print(f"{idx} {exchange} - {symbol} error: {e}")
-            continue
+    # Journal of what's finished, a unit = bringing one symbol up to this run's end date
+    jcur, jconn = dbInitializeJournal()
+
+    # One rate limiter for every Alpaca request of the run, new symbols and chunks alike
+    alpaca_bucket = TokenBucket(ALPACA_REQUESTS_PER_MINUTE / 60, capacity=FETCH_WORKERS)
+    worker = journalWorkerName()
+    journal_unit = f"upto:{END_DATE.date()}"
+    journal_local = threading.local()
+
+    # A crashed earlier run on this host left claims behind, they're runnable again right away
+    released = journalReleaseDeadWorkers(jcur, jconn, JOURNAL_JOB)
+    if released:
+        print(f"Journal: released {released} units claimed by stopped runs")
+
+    def journalCursor():
+        # psycopg2 cursors aren't thread safe, each pipeline thread gets its own on the journal connection
+        if not hasattr(journal_local, 'cur'):
+            journal_local.cur = jconn.cursor()
+        return journal_local.cur
+
+    def addSymbols(exchangesymbols, start_date):
+        # Register units, already known ones keep their status
+        journalAddUnits(jcur, jconn, JOURNAL_JOB, [(exchange, symbol, journal_unit, start_date, END_DATE) for exchange, symbol in exchangesymbols])
+
+    def claimSymbols(exchangesymbols):
+        # Claim right before fetching, whatever another worker holds or already finished is left out
+        claimed = journalClaimUnits(jcur, jconn, JOURNAL_JOB, worker, limit=len(exchangesymbols), exchangesymbols=exchangesymbols)
+        claimed = {(exchange, symbol) for exchange, symbol, _, _, _ in claimed}
+        return [exchangesymbol for exchangesymbol in exchangesymbols if exchangesymbol in claimed]
+
+    def journalUnits(exchangesymbols):
+        return [(exchange, symbol, journal_unit) for exchange, symbol in exchangesymbols]
 
-        # Slot into DB
+    ############################## STOCK & CRYPTO: FETCH AND STORE NEW DATA ##############################
+    pending_dfs = []
+    pending_units = []
+    pending_rows = {'rows': 0}  # Running count of the rows in pending_dfs
+
+    def flushNewSymbols():
+        # Units only count as done once their rows are committed
+        dbSlotDataCopyGroup(pending_dfs, cur, conn, columns=OHLC_COLUMNS)
+
+        # Archive only what the DB holds, a crash before the commit leaves neither side written [no duplicate rows on refetch]
+        for df in pending_dfs:
+            dfStoreArchive(df)
+        journalMarkDone(jcur, jconn, JOURNAL_JOB, pending_units)
+        pending_dfs.clear()
+        pending_units.clear()
+        pending_rows['rows'] = 0
+
+    def fetchNewSymbol(job):
+        # Runs on the scheduler's worker threads
+        idx, exchange, symbol = job
+        return alpacaFetchBars(stock_client, crypto_client, exchange, symbol, START_DATE, END_DATE, timeframe)
+
+    def storeNewSymbol(job, bars):
+        # Runs back on this thread, so the cursor is never shared
+        idx, exchange, symbol = job
+        print(f"{idx} {exchange} - {symbol} fetched")
+
+        # Buffer for DB, group committing once enough rows are pending
         df = bars.df.copy()
         df = df.reset_index()
         df["exchange"] = [exchange] * len(df)
-        dbSlotDataOHLC(df, cur, conn)
+        pending_dfs.append(df)
+        pending_units.extend(journalUnits([(exchange, symbol)]))
+        pending_rows['rows'] += len(df)
 
-        # Save to CSV
-        csv_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, exchange, f"{symbol.replace('/', '-')}.csv")
-        os.makedirs(os.path.join(DIR_DATA, DIR_SUB_DATA, exchange), exist_ok=True)
-        bars.df.to_csv(csv_file_path, mode='a', header=not os.path.exists(csv_file_path))
+        # CSV / parquet archive is written by the flush, after the DB commit
+        if pending_rows['rows'] >= DB_GROUP_COMMIT_ROWS:
+            flushNewSymbols()
 
-        pass
+    def skipNewSymbol(job, e):
+        idx, exchange, symbol = job
+        print(f"{idx} {exchange} - {symbol} error: {e}")
+        journalMarkFailed(jcur, jconn, JOURNAL_JOB, journalUnits([(exchange, symbol)]), e)
 
-    ############################## STOCK: LOOP AND STORE EXISTED DATA ##############################
-    for curstart_date in stock_latestdates_exchangesymbols:
-        if datetime.utcnow().weekday() >= 5 and curstart_date == LAST_TRADING_DATE.date():
-            print(f"Weekend: Skipping {curstart_date} as match latest trading date")
-            continue
-        elif curstart_date.date() == datetime.utcnow().date() - timedelta(days=1):
-            print(f"Skipping {curstart_date} as match latest trading date")
-            continue
+    def newJobs():
+        # Claimed a few at a time as the scheduler pulls jobs, so a crash leaves little claimed but unfetched
+        addSymbols(new_exchangesymbols, START_DATE)
+        idx = 0
+        for exchangesymbols in listChunks(new_exchangesymbols, FETCH_WORKERS):
+            for exchange, symbol in claimSymbols(exchangesymbols):
+                yield idx, exchange, symbol
+                idx += 1
 
-        # Get the max assets we can request for this date grouping
-        cur_dateexchangesymbols = stock_latestdates_exchangesymbols[curstart_date]
-        max_assets = alpacaGetMaxRequestAssets(stock_client, crypto_client, cur_dateexchangesymbols, curstart_date, END_DATE)
-
-        # Break data down into relevant chunk to load
-        chunked_dateexchangesymbols = listChunks(cur_dateexchangesymbols, max_assets)
-        for exchangesymbols in chunked_dateexchangesymbols:
-            exchanges, symbols = zip(*exchangesymbols)
-            symbols = list(symbols)
-            dict_exchanges = dict(zip(symbols, exchanges))
-
-            # Fetch the ohlc data
-            request = StockBarsRequest(
-                symbol_or_symbols=symbols,
-                start=curstart_date + timedelta(days=1),
-                end=END_DATE,
-                timeframe=timeframe,
-                limit=None,
-                adjustment=Adjustment.ALL,
-                feed=DataFeed.SIP
-            )
-            bars = stock_client.get_stock_bars(request)
-
-            # If fetched nothing - it means it's no longer a valid symbol
-            if len(bars.data) == 0:
-                csvAddSkipSymbols(exchangesymbols)
-                raise ValueError(f"{curstart_date}: {exchangesymbols} fetched nothing.\nAdded to skip symbol. Please validate.")
-
-            # Slot into DB
-            df = dfProcessDBStorage(bars.df.copy(), dict_exchanges)
-            dbSlotDataOHLC(df, cur, conn)
-
-            # Store into relevant CSVs
-            dfGroupStoreCSVs(df)
-
-    ############################## CRYPTO: LOOP AND STORE EXISTED DATA ##############################
-    for curstart_date in crypto_latestdates_exchangesymbols:
-        if curstart_date.date() == datetime.utcnow().date() - timedelta(days=1):
-            print(f"Skipping {curstart_date} as match latest trading date")
-            continue
+    new_jobs = newJobs()
+    fetchConcurrent(new_jobs, fetchNewSymbol, storeNewSymbol, on_error=skipNewSymbol,
+                    workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT, bucket=alpaca_bucket)
+
+    # Slot whatever is left of the new symbols into DB
+    flushNewSymbols()
+
+    ############################## STOCK & CRYPTO: PLAN CHUNKS OF EXISTED DATA ##############################
+    request_limits = alpacaLoadRequestLimits()
+    limits_lock = threading.Lock()
+
+    def planChunks():
+        # Yields (curstart_date, exchangesymbols) chunks lazily, so planning overlaps with the stages below
+        for curstart_date in stock_latestdates_exchangesymbols:
+            if datetime.utcnow().weekday() >= 5 and curstart_date == LAST_TRADING_DATE.date():
+                print(f"Weekend: Skipping {curstart_date} as match latest trading date")
+                continue
+            elif curstart_date.date() == datetime.utcnow().date() - timedelta(days=1):
+                print(f"Skipping {curstart_date} as match latest trading date")
+                continue
+            yield from planDateChunks(curstart_date, stock_latestdates_exchangesymbols[curstart_date])
+
+        for curstart_date in crypto_latestdates_exchangesymbols:
+            if curstart_date.date() == datetime.utcnow().date() - timedelta(days=1):
+                print(f"Skipping {curstart_date} as match latest trading date")
+                continue
+            yield from planDateChunks(curstart_date, crypto_latestdates_exchangesymbols[curstart_date])
+
+    def planDateChunks(curstart_date, cur_dateexchangesymbols):
+        if not cur_dateexchangesymbols:
+            return
+        addSymbols(cur_dateexchangesymbols, curstart_date)
 
         # Get the max assets we can request for this date grouping
-        cur_dateexchangesymbols = crypto_latestdates_exchangesymbols[curstart_date]
-        max_assets = alpacaGetMaxRequestAssets(stock_client, crypto_client, cur_dateexchangesymbols, curstart_date, END_DATE)
-
-        # Break data down into relevant chunk to load
-        chunked_dateexchangesymbols = listChunks(cur_dateexchangesymbols, max_assets)
-        for exchangesymbols in chunked_dateexchangesymbols:
-            exchanges, symbols = zip(*exchangesymbols)
-            symbols = list(symbols)
-            dict_exchanges = dict(zip(symbols, exchanges))
-
-            # Fetch the ohlc data
-            request = CryptoBarsRequest(
-                symbol_or_symbols=symbols,
-                start=curstart_date + timedelta(days=1),
-                end=END_DATE,
-                timeframe=timeframe,
-                limit=None,
-            )
-            bars = crypto_client.get_crypto_bars(request_params=request, feed=CryptoFeed.US)
-
-            # If fetched nothing - it means it's no longer a valid symbol
-            if len(bars.data) == 0:
-                csvAddSkipSymbols(exchangesymbols)
-                raise ValueError(f"{curstart_date}: {exchangesymbols} fetched nothing.\nAdded to skip symbol. Please validate.")
-
-            # Slot into DB
-            df = dfProcessDBStorage(bars.df.copy(), dict_exchanges)
-            dbSlotDataOHLC(df, cur, conn)
-
-            # Store into relevant CSVs
-            dfGroupStoreCSVs(df)
+        with limits_lock:
+            max_assets = alpacaPlanMaxRequestAssets(stock_client, crypto_client, cur_dateexchangesymbols, curstart_date, END_DATE, request_limits, timeframe_key=TIMEFRAME_KEY)
+
+        # Break data down into relevant chunk to load, each claimed only as the bounded queue takes it
+        for exchangesymbols in listChunks(cur_dateexchangesymbols, max_assets):
+            exchangesymbols = claimSymbols(exchangesymbols)
+            if exchangesymbols:
+                yield curstart_date, exchangesymbols
+
+    ############################## STOCK & CRYPTO: PIPELINE STAGES ##############################
+    def fetchChunk(job):
+        # Fetch the ohlc data through the shared rate limiter [429s back off], a failing chunk is halved and retried
+        curstart_date, exchangesymbols = job
+        exchanges, symbols = zip(*exchangesymbols)
+        symbols = list(symbols)
+        expected_rows = len(symbols) * max(1, (END_DATE - curstart_date).days)
+        try:
+            bars = fetchWithRetry(lambda _: alpacaFetchBars(stock_client, crypto_client, exchanges[0], symbols, curstart_date + timedelta(days=1), END_DATE, timeframe),
+                                  job, alpaca_bucket)
+        except Exception as e:
+            with limits_lock:
+                alpacaUpdateRequestLimit(request_limits, exchanges[0], len(symbols), error=e, timeframe_key=TIMEFRAME_KEY, expected_rows=expected_rows)
+            if len(symbols) == 1:
+                print(f"{curstart_date}: {exchangesymbols} error: {e}")
+                journalMarkFailed(journalCursor(), jconn, JOURNAL_JOB, journalUnits(exchangesymbols), e)
+                return []
+            return [fetched for half in listChunks(exchangesymbols, (len(exchangesymbols) + 1) // 2)
+                    for fetched in fetchChunk((curstart_date, half))]
+
+        # If fetched nothing - it means it's no longer a valid symbol
+        if len(bars.data) == 0:
+            csvAddSkipSymbols(exchangesymbols)
+            journalMarkFailed(journalCursor(), jconn, JOURNAL_JOB, journalUnits(exchangesymbols), "fetched nothing")
+            print(f"{curstart_date}: {exchangesymbols} fetched nothing.\nAdded to skip symbol. Please validate.")
+            return []
+
+        with limits_lock:
+            alpacaUpdateRequestLimit(request_limits, exchanges[0], len(symbols), rows=len(bars.df), timeframe_key=TIMEFRAME_KEY)
+        return [(exchangesymbols, bars)]
+
+    def frameChunk(fetched):
+        # Convert every fetched piece into one df ready for storage
+        if not fetched:
+            return None
+        dfs, exchangesymbols = [], []
+        for piece_exchangesymbols, bars in fetched:
+            exchanges, symbols = zip(*piece_exchangesymbols)
+            dfs.append(dfProcessDBStorage(bars.df.copy(), dict(zip(symbols, exchanges))))
+            exchangesymbols.extend(piece_exchangesymbols)
+        return exchangesymbols, pd.concat(dfs, ignore_index=True)
+
+    def storeChunkDB(chunk):
+        # Slot into DB [only this stage touches the cursor]
+        exchangesymbols, df = chunk
+        dbSlotDataCopy(df, cur, conn, columns=OHLC_COLUMNS)
+        return chunk
+
+    def storeChunkArchive(chunk):
+        # Store into relevant CSVs / parquet archive, only then is the chunk done
+        exchangesymbols, df = chunk
+        dfStoreArchive(df)
+        journalMarkDone(journalCursor(), jconn, JOURNAL_JOB, journalUnits(exchangesymbols))
+        return chunk
+
+    try:
+        pipelineRun(planChunks(), [
+            ("fetch", fetchChunk, PIPELINE_FETCH_WORKERS),
+            ("frame", frameChunk, 1),
+            ("db", storeChunkDB, 1),
+            ("archive", storeChunkArchive, 1),
+        ], maxsize=PIPELINE_QUEUE_SIZE)
+    finally:
+        # Keep what was learned even if a chunk fails
+        alpacaSaveRequestLimits(request_limits)
+
+    ############################## WEEKLY / MONTHLY BARS ##############################
+    # Only each symbol's latest period is rebuilt, plus whatever periods the new bars opened
+    refreshed = dbRefreshAggregates(cur, conn, list(zip(exchanges, all_symbols)))
+    print(f"Aggregated periods written: {refreshed}")
 
     ############################## WRAP UP: CLOSE DB CONNECTIONS ##############################
+    print(f"Journal: {journalSummary(jcur, JOURNAL_JOB)}")
+    jcur.close()
+    dbRelease(jconn)
     cur.close()
-    conn.close()
+    dbRelease(conn)
+
+    # Served responses are stale from here on [see datatools/responsecache.py]
+    dataVersionBump()
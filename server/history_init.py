@@ -18,10 +18,20 @@ from alpaca.data.requests import CryptoBarsRequest
 
 from datatools.getdata import *
 from datatools.storedata import *
+from datatools.responsecache import *
+from datatools.scheduler import *
+from datatools.journal import *
+from datatools.archive import *
 
 ###################### SETUP ######################
 # Take CSV to DB [If ran, it doesn't fetch from internet to CSV]
 DB_INITIALIZE_FROM_CSV = True
+DB_GROUP_COMMIT_ROWS = 50000  # CSVs are buffered and committed together once this many rows are pending
+
+# Journal jobs, finished units are skipped by every later run
+JOURNAL_JOB_CSV = 'init_csv'
+JOURNAL_JOB_FETCH = 'init_fetch'
+JOURNAL_CLAIM_SIZE = 200  # Units a worker claims at once, other workers take the rest
 
 if __name__ == "__main__":
     ############################## LOAD VARIABLES ##############################
@@ -60,7 +70,13 @@ if __name__ == "__main__":
     cur, conn = dbInitializeTable()
     cur.execute("BEGIN")  # Set a rollback point
 
-    ############################## LOOP AND STORE DATA ##############################
+    # Journal of what's finished, so a rerun [or a second worker] only picks up what's left
+    jcur, jconn = dbInitializeJournal()
+    worker = journalWorkerName()
+
+    ############################## LOOP AND PLAN UNITS ##############################
+    csv_units = []
+    fetch_jobs = []
     for idx, asset in enumerate(tradable_assets):
         # Get core variables
         symbol = asset['symbol']
@@ -70,18 +86,17 @@ if __name__ == "__main__":
         csv_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, exchange, f"{symbol.replace('/', '-')}.csv")
         os.makedirs(os.path.join(DIR_DATA, DIR_SUB_DATA, exchange), exist_ok=True)
 
-        # This is for a loading of CSV data into database
+        # This is for a loading of CSV / parquet data into database [loaded below through the journal]
         if DB_INITIALIZE_FROM_CSV:
-            if idx < 741: continue  # For a fast skip if I'm continuing from somewhere
-            if not os.path.exists(csv_file_path): continue  # Skip if CSV doesn't exist
-            df = pd.read_csv(csv_file_path)
-            df["exchange"] = [exchange] * len(df)
-            print(f"{idx} CSV: Adding {symbol} into database")
-            dbSlotDataOHLC(df, cur, conn)
+            if ARCHIVE_MODE == 'parquet' or os.path.exists(csv_file_path):
+                csv_units.append((exchange, symbol, 'csv', None, None))
             continue  # Initialize from CSV = won't load from internet
 
         # Get the latest date to load from
-        csv_date = csvGetLatestDate(csv_file_path)
+        if ARCHIVE_MODE == 'parquet':
+            csv_date = parquetGetLatestDate(exchange, symbol)
+        else:
+            csv_date = csvGetLatestDate(csv_file_path)
         if csv_date: curstart_date = csv_date + timedelta(days=1)
         else: curstart_date = START_DATE
 
@@ -95,43 +110,99 @@ if __name__ == "__main__":
                 print(f"{exchange}: Skipping {symbol} as it's already up to date")
                 continue
             
-        # Fetch the ohlc data
-        try:
-            if exchange.lower() == "crypto":
-                request = CryptoBarsRequest(
-                    symbol_or_symbols=symbol,
-                    start=curstart_date,
-                    end=END_DATE,
-                    timeframe=timeframe,
-                    limit=None,
-                )
-                bars = crypto_client.get_crypto_bars(request_params=request, feed=CryptoFeed.US)
+        # Queue for the concurrent fetch below
+        fetch_jobs.append((idx, exchange, symbol, csv_file_path, curstart_date))
+
+    ############################## LOAD CSV DATA THROUGH THE JOURNAL ##############################
+    def flushCSVUnits(pending_dfs, pending_units):
+        # Units only count as done once their rows are committed
+        dbSlotDataCopyGroup(pending_dfs, cur, conn, columns=OHLC_COLUMNS)
+        journalMarkDone(jcur, jconn, JOURNAL_JOB_CSV, pending_units)
+        pending_dfs.clear()
+        pending_units.clear()
+
+    journalAddUnits(jcur, jconn, JOURNAL_JOB_CSV, csv_units)
+    while csv_units:
+        claimed = journalClaimUnits(jcur, jconn, JOURNAL_JOB_CSV, worker, limit=JOURNAL_CLAIM_SIZE)
+        if not claimed:
+            break
+
+        # Parquet archive: one read per exchange for the whole claim, pushed down to the claimed symbols
+        archive_dfs = {}
+        if ARCHIVE_MODE == 'parquet':
+            for exchange in {exchange for exchange, _, _, _, _ in claimed}:
+                symbols = [symbol for claimed_exchange, symbol, _, _, _ in claimed if claimed_exchange == exchange]
+                archive_df = parquetRead(exchange=exchange, symbols=symbols)
+                if not archive_df.empty:
+                    archive_dfs.update({(exchange, symbol): symbol_df for symbol, symbol_df in archive_df.groupby('symbol')})
+
+        pending_dfs, pending_units = [], []
+        for exchange, symbol, unit, _, _ in claimed:
+            if ARCHIVE_MODE == 'parquet':
+                df = archive_dfs.get((exchange, symbol), pd.DataFrame(columns=OHLC_COLUMNS))
             else:
-                request = StockBarsRequest(
-                    symbol_or_symbols=symbol,
-                    start=curstart_date,
-                    end=END_DATE,
-                    timeframe=timeframe,
-                    limit=None,
-                    adjustment=Adjustment.ALL,
-                    feed=DataFeed.SIP
-                )
-                bars = stock_client.get_stock_bars(request)
-            print(f"{idx} {exchange} - {symbol} fetched")
-        except Exception as e:
-            print(f"{idx} {exchange} - {symbol} error: {e}")
-            continue
+                csv_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, exchange, f"{symbol.replace('/', '-')}.csv")
+                try:
+                    df = pd.read_csv(csv_file_path)
+                except Exception as e:
+                    print(f"CSV: {exchange}:{symbol} error: {e}")
+                    journalMarkFailed(jcur, jconn, JOURNAL_JOB_CSV, [(exchange, symbol, unit)], e)
+                    continue
+            df["exchange"] = [exchange] * len(df)
+            print(f"CSV: Adding {exchange}:{symbol} into database")
+            pending_dfs.append(df)
+            pending_units.append((exchange, symbol, unit))
+            if sum(len(pending_df) for pending_df in pending_dfs) >= DB_GROUP_COMMIT_ROWS:
+                flushCSVUnits(pending_dfs, pending_units)
+
+        # Slot whatever is left of this claim into DB
+        flushCSVUnits(pending_dfs, pending_units)
+    print(f"CSV journal: {journalSummary(jcur, JOURNAL_JOB_CSV)}")
+
+    ############################## FETCH AND STORE DATA ##############################
+    def fetchAsset(job):
+        # Runs on the scheduler's worker threads
+        idx, exchange, symbol, csv_file_path, curstart_date = job
+        return alpacaFetchBars(stock_client, crypto_client, exchange, symbol, curstart_date, END_DATE, timeframe)
+
+    def storeAsset(job, bars):
+        # Runs back on this thread, so the cursor is never shared
+        idx, exchange, symbol, csv_file_path, curstart_date = job
+        print(f"{idx} {exchange} - {symbol} fetched")
 
         # Database Variables
         df = bars.df.copy()
         df = df.reset_index()
         df["exchange"] = [exchange] * len(df)
-        dbSlotDataOHLC(df, cur)
-
-        # Save to CSV
-        bars.df.to_csv(csv_file_path, mode='a', header=not os.path.exists(csv_file_path))
-        pass
-
-    # Close DB connection
+        dbSlotDataCopy(df, cur, conn, columns=OHLC_COLUMNS)
+
+        # Save to CSV / parquet archive, a crash before this is simply refetched from the archive's latest date
+        dfStoreArchive(df)
+        journalMarkDone(jcur, jconn, JOURNAL_JOB_FETCH, [(exchange, symbol, fetch_unit)])
+
+    def skipAsset(job, e):
+        idx, exchange, symbol = job[:3]
+        print(f"{idx} {exchange} - {symbol} error: {e}")
+        journalMarkFailed(jcur, jconn, JOURNAL_JOB_FETCH, [(exchange, symbol, fetch_unit)], e)
+
+    # A unit = bringing one symbol up to this run's end date
+    fetch_unit = f"upto:{END_DATE.date()}"
+    fetch_planned = {(job[1], job[2]): job for job in fetch_jobs}
+    journalAddUnits(jcur, jconn, JOURNAL_JOB_FETCH, [(exchange, symbol, fetch_unit, job[4], END_DATE) for (exchange, symbol), job in fetch_planned.items()])
+    while fetch_jobs:
+        claimed = journalClaimUnits(jcur, jconn, JOURNAL_JOB_FETCH, worker, limit=JOURNAL_CLAIM_SIZE, exchangesymbols=list(fetch_planned))
+        if not claimed:
+            break
+        claimed_jobs = [fetch_planned[(exchange, symbol)] for exchange, symbol, _, _, _ in claimed]
+        fetchConcurrent(claimed_jobs, fetchAsset, storeAsset, on_error=skipAsset,
+                        workers=FETCH_WORKERS, requests_per_minute=ALPACA_REQUESTS_PER_MINUTE, timeout=FETCH_TIMEOUT)
+    print(f"Fetch journal: {journalSummary(jcur, JOURNAL_JOB_FETCH)}")
+
+    # Close DB connections
+    jcur.close()
+    dbRelease(jconn)
     cur.close()
-    conn.close()
+    dbRelease(conn)
+
+    # Served responses are stale from here on [see datatools/responsecache.py]
+    dataVersionBump()
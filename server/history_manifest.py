@@ -0,0 +1,9 @@
+'''
+Run this script to rebuild the manifest of the CSV tree [last timestamp, rows, size, checksum per file]
+- Only needed if the manifest got lost or files were edited outside of datatools.
+'''
+
+from datatools.manifest import *
+
+if __name__ == "__main__":
+    manifestRebuild()
@@ -0,0 +1,16 @@
+'''
+Run this script to move the bars tables to the compact layout [double precision / bigint, partitioned by year]
+- Online: ingestion can keep writing to the old tables while rows are copied, a rerun resumes where it stopped.
+- Set DB_SCHEMA=compact afterwards, so newly created tables use the same layout.
+'''
+
+from datatools.constant import *
+from datatools.migrate import *
+
+###################### SETUP ######################
+MIGRATE_TABLES = [DB_MAIN_TABLE]  # Add the backtest table here to migrate it too
+MIGRATE_SWAP = True  # False only copies, the swap can then be done by a later run
+
+if __name__ == "__main__":
+    for table in MIGRATE_TABLES:
+        dbMigrateCompact(table, batch_rows=MIGRATE_BATCH_ROWS, swap=MIGRATE_SWAP)
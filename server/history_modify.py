@@ -18,6 +18,7 @@ from alpaca.data.requests import CryptoBarsRequest
 
 from datatools.getdata import *
 from datatools.storedata import *
+from datatools.responsecache import *
 
 if __name__ == "__main__":
     ############################## LOAD VARIABLES ##############################
@@ -30,14 +31,34 @@ if __name__ == "__main__":
     tupleSkipCSV = csvGetSkipSymbols()
     exchanges, all_symbols = alpacaLoadTradableAssets(API_KEY, API_SECRET, skipCSVData=tupleSkipCSV, groupAssets=False)
 
+    # Rows trimmed off the CSVs are deleted from the main table as well
+    cur, conn = dbInitializeTable()
+
     ############################## CRYPTO: CLEAR THE LATEST FILE ##############################
+    trimmed_symbols = []
     for idx, exchange in enumerate(exchanges):
         if exchange != 'CRYPTO':
             continue
         symbol = all_symbols[idx]
         
-        # Remove unnecessary lines off the csv
+        # Remove unnecessary lines off the csv [truncated in place from the end]
         csv_file_path = os.path.join(DIR_DATA, DIR_SUB_DATA, exchange, f"{symbol.replace('/', '-')}.csv")
+        if not os.path.exists(csv_file_path):
+            continue
         print(f"Removing items past date {TRIMOFF_DATE} for {symbol}...")
         csvRemovePastDate(csv_file_path, TRIMOFF_DATE)
-        
\ No newline at end of file
+        trimmed_symbols.append(symbol)
+
+    ############################## CRYPTO: CLEAR THE SAME ROWS IN DB ##############################
+    deleted = dbRemovePastDate(cur, conn, TRIMOFF_DATE, 'CRYPTO', trimmed_symbols)
+    print(f"Deleted {deleted} rows past {TRIMOFF_DATE} from {DB_MAIN_TABLE}")
+
+    # Weekly / monthly periods from the trimmed date on are rebuilt from what's left
+    refreshed = dbRefreshAggregates(cur, conn, [('CRYPTO', symbol) for symbol in trimmed_symbols], since=TRIMOFF_DATE)
+    print(f"Aggregated periods rebuilt: {refreshed}")
+
+    cur.close()
+    dbRelease(conn)
+
+    # Served responses are stale from here on [see datatools/responsecache.py]
+    dataVersionBump()
@@ -1,11 +1,13 @@
 from flask_cors import CORS
-from flask import Flask
+from flask import Flask, request
 
 
 from dotenv import load_dotenv
-from datatools.storedata import dbInitializeTable
+from datatools.dbpool import dbPoolInit, dbCheckout
 from datatools.getdata import *
 from datatools.frontend import *
+from datatools.responsecache import cachedResponse
+from backtest.trading import TRADING_SIGNAL_ALL
 import warnings
 
 '''
@@ -26,6 +28,16 @@ warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy conne
 app = Flask(__name__)
 CORS(app)
 
+###################### SETUP ######################
+SERVER_POOL_MAX = 20  # Chart requests served at once, each checks out its own connection
+SERVER_STATEMENT_TIMEOUT = 15000  # Milliseconds, a runaway query can't hold a connection for long
+
+# signal_mask with every criterion bit set, answered from the partial index [see backtest/runner.py]
+MINERVINI_WHERE = f"signal_mask = {TRADING_SIGNAL_ALL}"
+
+STOCKS_MAX_ROWS = 5000  # Cap on limit / points of one /stocks request
+STOCKS_DOWNSAMPLE = ['ohlc', 'lttb']
+
 @app.route("/")
 def main():
     return { "main page": ["Main1", "Main2", "Main3"] }
@@ -36,23 +48,62 @@ def getMembers():
 
 #### MINERVINI RELATED ####
 @app.route("/minervini", methods=['GET'])
+@cachedResponse
 def getMinervini():
-    df = dbGetUniqueData(bt_cur, bt_conn, DB_MINERVINI_TABLE, command="symbol", where="long_sma = TRUE AND long_hhhl = TRUE AND long_vspike = TRUE AND long_week_vup_lt_vdn = TRUE")
-    return jsonDF(df)
+    # One row per symbol in the screen table, no scan of the backtest history
+    with dbCheckout() as (cur, conn):
+        df = pd.DataFrame(dbGetUniqueData(cur, conn, DB_SCREEN_TABLE, command="symbol", where="last_signal IS NOT NULL"), columns=['symbol'])
+    return dfResponse(df)
 
 @app.route('/minervini/<symbol>', methods=['GET'])
-def getStock(symbol):
-    df = dbGetDataWhereDefault(bt_cur, bt_conn, DB_MINERVINI_TABLE, f"long_sma = TRUE AND long_hhhl = TRUE AND long_vspike = TRUE AND long_week_vup_lt_vdn = TRUE AND symbol = {symbol}")
+@cachedResponse
+def getMinerviniStock(symbol):
+    with dbCheckout() as (cur, conn):
+        df = dbGetDataWhereDefault(cur, conn, DB_MINERVINI_TABLE, f"{MINERVINI_WHERE} AND symbol = %s", params=(symbol,))
     df = dfGroupGetFirstDate(df)
-    return jsonDF(df)
+    return dfResponse(df)
 
 #### STOCK SYMBOL ####
 @app.route('/stocks/<symbol>', methods=['GET'])
+@cachedResponse
 def getStock(symbol):
-    df = dbGetDataWhereDefault(bt_cur, bt_conn, DB_MINERVINI_TABLE, f"symbol = {symbol}")
-    return jsonDF(df)
+    '''
+    - ?start=&end= limits the range [ISO date or epoch ms]
+    - ?limit=N pages through it: the next page passes after=<last timestamp>, scrolling back passes before=<first timestamp>
+    - ?points=N returns at most N OHLCV bars over the range, &downsample=ohlc [bucket aggregates, default] or lttb [selected rows]
+    - No parameters returns the whole history
+    '''
+    try:
+        range_args = requestRangeArgs(request.args, max_rows=STOCKS_MAX_ROWS)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    downsample = request.args.get('downsample', 'ohlc')
+    if downsample not in STOCKS_DOWNSAMPLE:
+        return {"error": f"Unknown downsample {downsample}, expected one of {STOCKS_DOWNSAMPLE}"}, 400
+
+    points = range_args.pop('points', None)
+    with dbCheckout() as (cur, conn):
+        if points is not None and downsample == 'ohlc':
+            df = dbGetRangeOHLC(cur, conn, DB_MINERVINI_TABLE, symbol, points, range_args.get('start'), range_args.get('end'))
+        elif points is not None:
+            df = dbGetRangeLTTB(cur, conn, DB_MINERVINI_TABLE, symbol, points, range_args.get('start'), range_args.get('end'))
+        else:
+            df = dbGetRange(cur, conn, DB_MINERVINI_TABLE, symbol, **range_args)
+    return dfResponse(df)
+
+@app.route('/bars/<symbol>', methods=['GET'])
+@cachedResponse
+def getBars(symbol):
+    # ?timeframe=1Day [default], 1Week or 1Month
+    timeframe = request.args.get('timeframe', TIMEFRAME_DAY)
+    if timeframe not in TIMEFRAMES:
+        return {"error": f"Unknown timeframe {timeframe}, expected one of {TIMEFRAMES}"}, 400
+    with dbCheckout() as (cur, conn):
+        df = dbGetDataWhereDefault(cur, conn, DB_MAIN_TABLE, "symbol = %s ORDER BY timestamp", params=(symbol,), timeframe=timeframe)
+    return dfResponse(df)
 
 @app.route("/assets")
+@cachedResponse
 def assets():
     return jsonAssets()
 
@@ -71,8 +122,8 @@ if __name__ == "__main__":
     DB_MAIN_TABLE = str(os.getenv('DB_MAIN_TABLE'))
     DB_MINERVINI_TABLE = str(os.getenv('DB_MINERVINI_TABLE'))
 
-    # First establish a connection to our database
-    bt_cur, bt_conn = dbInitializeTable(DB_MINERVINI_TABLE)
+    # First set up the connection pool, every request checks out its own connection
+    dbPoolInit(maxconn=SERVER_POOL_MAX, statement_timeout=SERVER_STATEMENT_TIMEOUT)
     
     pass 
 